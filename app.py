@@ -1,495 +1,576 @@
 import os
+import io
 import json
-import tempfile
+import random
 import subprocess
-import re
-from threading import Thread
-from flask import Flask, render_template, request, jsonify, session, Response, send_file
+import time
+import uuid
+import hashlib
+from threading import BoundedSemaphore, Event, Timer
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, render_template, request, jsonify, session, Response
 import yt_dlp
 import ffmpeg
 
+from artifact_cache import artifact_cache, artifact_key
+from download_jobs import QueueFull, download_queue
+from download_journal import DownloadJournal, interrupted_journals
+from extractor_pool import extractor_pool
+from media_response import send_media
+from media_merge import MERGE_MODE, pipelined_download_and_merge, audio_codec_for_format, plan_audio_merge
+from progress_aggregator import ProgressAggregator
+from progress_store import progress_store
+from rate_limiter import youtube_limiter
+from singleflight import single_flight, extraction_group
+from storage import DOWNLOAD_DIR, download_dir
+from storage_manager import storage_manager
+from transcript_cleaner import iter_clean_paragraphs
+from video_cache import VideoInfoCache, canonical_video_key, shared_video_cache
+from video_metadata import get_video_metadata, download_with_metadata
+
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "your-secret-key")
 
-# Store download progress globally (in production, use a proper database)
-download_progress = {}
-video_info_cache = {}
+# Server-Sent Events progress stream settings
+SSE_POLL_SECONDS = float(os.environ.get("SSE_POLL_SECONDS", 0.5))
+SSE_HEARTBEAT_SECONDS = int(os.environ.get("SSE_HEARTBEAT_SECONDS", 15))
+SSE_MAX_SECONDS = int(os.environ.get("SSE_MAX_SECONDS", 60 * 60))
+SSE_RETRY_MS = 2000
+# Streams held open at once per worker process, so open tabs can't take every
+# request thread; clients beyond this reconnect every SSE_BUSY_RETRY_MS instead
+SSE_MAX_STREAMS = int(os.environ.get("SSE_MAX_STREAMS", 4))
+SSE_BUSY_RETRY_MS = int(os.environ.get("SSE_BUSY_RETRY_MS", 5000))
+
+# Runs a journaled download gets before a network failure is reported as final
+DOWNLOAD_MAX_ATTEMPTS = int(os.environ.get("DOWNLOAD_MAX_ATTEMPTS", 3))
+# Delay before the first retry, doubled for each further one up to the maximum, in seconds
+DOWNLOAD_RETRY_DELAY = float(os.environ.get("DOWNLOAD_RETRY_DELAY", 30))
+DOWNLOAD_RETRY_MAX_DELAY = float(os.environ.get("DOWNLOAD_RETRY_MAX_DELAY", 600))
+# Error messages of failures that may go away when the download is re-run
+RETRYABLE_ERROR_HINTS = ('timed out', 'timeout', 'connection', 'temporarily', 'network',
+                         'incomplete read', 'http error 429', 'http error 5')
+
+# Bounded LRU/TTL cache of extracted video metadata, keyed by canonical video ID
+video_info_cache = VideoInfoCache()
+
+# Slots for open progress streams in this process
+sse_slots = BoundedSemaphore(SSE_MAX_STREAMS)
 
+@single_flight(lambda url: f"app_info:{canonical_video_key(url)}")
 def get_video_info(url):
     """Get video information using yt-dlp."""
-    if url in video_info_cache:
-        return video_info_cache[url]
-    
-    ydl_opts = {
-        'quiet': True,
-        'no_warnings': True,
-        'cookies': 'cookies.txt',  # ✅ Add this line
-    }
+    cache_key = canonical_video_key(url)
+    cached = video_info_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # Fall back to the node-wide cache shared with the other workers
+    cached = shared_video_cache.get(f"app_info:{cache_key}")
+    if cached is not None:
+        video_info_cache.set(cache_key, cached)
+        return cached
     
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            
-            # Process formats to make them more readable
-            video_formats = []
-            audio_formats = []
+        # Shared extraction result, also used by the downloads for this video
+        info = get_video_metadata(url).info
+        
+        # Process formats to make them more readable
+        video_formats = []
+        audio_formats = []
 
+        
+        for f in info.get('formats', []):
+            format_note = f.get('format_note', '')
+            file_size = f.get('filesize') or f.get('filesize_approx')
             
-            for f in info.get('formats', []):
-                format_note = f.get('format_note', '')
-                file_size = f.get('filesize') or f.get('filesize_approx')
-                
-                if file_size:
-                    file_size_mb = round(file_size / (1024 * 1024), 2)
-                    size_str = f"{file_size_mb} MB"
-                else:
-                    size_str = "Unknown size"
-                
-                format_id = f.get('format_id', '')
-                ext = f.get('ext', '')
+            if file_size:
+                file_size_mb = round(file_size / (1024 * 1024), 2)
+                size_str = f"{file_size_mb} MB"
+            else:
+                size_str = "Unknown size"
+            
+            format_id = f.get('format_id', '')
+            ext = f.get('ext', '')
+            
+            if f.get('vcodec') != 'none' and f.get('acodec') == 'none':
+                # Video-only format
+                height = f.get('height')
+                width = f.get('width')
                 
-                if f.get('vcodec') != 'none' and f.get('acodec') == 'none':
-                    # Video-only format
-                    height = f.get('height')
-                    width = f.get('width')
+                if height and width:
+                    resolution = f"{width}x{height}"
+                    quality = f"{height}p" if height else format_note
                     
-                    if height and width:
-                        resolution = f"{width}x{height}"
-                        quality = f"{height}p" if height else format_note
+                    # Only include formats 480p and above
+                    if height and height >= 480:
+                        # Create clean display text that shows resolution and size
+                        display_text = f"{quality} ({ext})"
+                        if size_str != "Unknown size":
+                            display_text += f" - {size_str}"
+                            
+                        video_formats.append({
+                            'format_id': format_id,
+                            'ext': ext,
+                            'quality': quality,
+                            'resolution': resolution,
+                            'size': size_str,
+                            'display_text': display_text
+                        })
+                else:
+                    # Include formats where we can't determine height
+                    # but have a format note that might indicate high quality
+                    if format_note and any(q in format_note.lower() for q in ['720', '1080', 'hd', '4k']):
+                        resolution = format_note
+                        quality = format_note
                         
-                        # Only include formats 480p and above
-                        if height and height >= 480:
-                            # Create clean display text that shows resolution and size
-                            display_text = f"{quality} ({ext})"
-                            if size_str != "Unknown size":
-                                display_text += f" - {size_str}"
-                                
-                            video_formats.append({
-                                'format_id': format_id,
-                                'ext': ext,
-                                'quality': quality,
-                                'resolution': resolution,
-                                'size': size_str,
-                                'display_text': display_text
-                            })
-                    else:
-                        # Include formats where we can't determine height
-                        # but have a format note that might indicate high quality
-                        if format_note and any(q in format_note.lower() for q in ['720', '1080', 'hd', '4k']):
-                            resolution = format_note
-                            quality = format_note
+                        # Create clean display text
+                        display_text = f"{quality} ({ext})"
+                        if size_str != "Unknown size":
+                            display_text += f" - {size_str}"
                             
-                            # Create clean display text
-                            display_text = f"{quality} ({ext})"
-                            if size_str != "Unknown size":
-                                display_text += f" - {size_str}"
-                                
-                            video_formats.append({
-                                'format_id': format_id,
-                                'ext': ext,
-                                'quality': quality,
-                                'resolution': resolution,
-                                'size': size_str,
-                                'display_text': display_text
-                            })
-                
-                elif f.get('acodec') != 'none' and f.get('vcodec') == 'none':
-                    # Audio-only format
-                    abr = f.get('abr')
-                    asr = f.get('asr')  # Audio sampling rate (Hz)
-                    quality_str = ""
-                    
-                    # Determine quality string, preferring bitrate
-                    if abr:
-                        quality_str = f"{int(abr)}kbps"
-                        # Store raw bitrate for prioritization
-                        raw_bitrate = float(abr)
-                    elif format_note and 'kbps' in format_note.lower():
-                        quality_str = format_note
-                        # Try to extract bitrate from format note
-                        try:
-                            bitrate_part = format_note.lower().split('kbps')[0].strip()
-                            if bitrate_part.isdigit():
-                                raw_bitrate = float(bitrate_part)
-                            else:
-                                raw_bitrate = 0
-                        except:
-                            raw_bitrate = 0
-                    elif asr:
-                        # Approximate bitrate from sampling rate
-                        # Higher sampling rates usually have higher quality
-                        if asr >= 44100:
-                            approx_bitrate = 192
-                        elif asr >= 32000:
-                            approx_bitrate = 128
-                        else:
-                            approx_bitrate = 96
-                        quality_str = f"{approx_bitrate}kbps"
-                        raw_bitrate = float(approx_bitrate)
-                    else:
-                        quality_str = format_note or "Unknown"
-                        raw_bitrate = 0
-                    
-                    # Only add the audio format if it's a common format or high quality
-                    # Prioritize high-quality formats (320kbps, 256kbps, 192kbps)
-                    is_high_quality = raw_bitrate >= 192
-                    is_preferred_format = ext in ['m4a', 'mp3', 'aac', 'opus']
-                    
-                    if is_high_quality or is_preferred_format:
-                        audio_formats.append({
+                        video_formats.append({
                             'format_id': format_id,
                             'ext': ext,
-                            'quality': quality_str,
-                            'raw_bitrate': raw_bitrate,
+                            'quality': quality,
+                            'resolution': resolution,
                             'size': size_str,
-                            'display_text': f"{quality_str} ({ext})"  # Clean display text
+                            'display_text': display_text
                         })
             
-            # Sort formats by quality (higher resolution/bitrate first)
-            video_formats.sort(key=lambda x: int(x['quality'].replace('p', '')) if x['quality'].replace('p', '').isdigit() else 0, reverse=True)
-            
-            # Custom sorting for audio formats to prioritize high quality options
-            def audio_format_quality_score(format_item):
-                # First, try to use raw bitrate directly
-                if 'raw_bitrate' in format_item and format_item['raw_bitrate']:
-                    bitrate = float(format_item['raw_bitrate'])
-                    
-                    # Give higher priority to specific high-quality bitrates
-                    if bitrate >= 320:  # 320kbps is highest priority
-                        return 10000 + bitrate
-                    elif bitrate >= 256:  # 256kbps is second priority
-                        return 9000 + bitrate
-                    elif bitrate >= 192:  # 192kbps is third priority
-                        return 8000 + bitrate
+            elif f.get('acodec') != 'none' and f.get('vcodec') == 'none':
+                # Audio-only format
+                abr = f.get('abr')
+                asr = f.get('asr')  # Audio sampling rate (Hz)
+                quality_str = ""
+                
+                # Determine quality string, preferring bitrate
+                if abr:
+                    quality_str = f"{int(abr)}kbps"
+                    # Store raw bitrate for prioritization
+                    raw_bitrate = float(abr)
+                elif format_note and 'kbps' in format_note.lower():
+                    quality_str = format_note
+                    # Try to extract bitrate from format note
+                    try:
+                        bitrate_part = format_note.lower().split('kbps')[0].strip()
+                        if bitrate_part.isdigit():
+                            raw_bitrate = float(bitrate_part)
+                        else:
+                            raw_bitrate = 0
+                    except:
+                        raw_bitrate = 0
+                elif asr:
+                    # Approximate bitrate from sampling rate
+                    # Higher sampling rates usually have higher quality
+                    if asr >= 44100:
+                        approx_bitrate = 192
+                    elif asr >= 32000:
+                        approx_bitrate = 128
                     else:
-                        return bitrate
+                        approx_bitrate = 96
+                    quality_str = f"{approx_bitrate}kbps"
+                    raw_bitrate = float(approx_bitrate)
+                else:
+                    quality_str = format_note or "Unknown"
+                    raw_bitrate = 0
                 
-                # Fallback for formats where we can't determine bitrate
-                # Give preference to high-quality formats
-                if format_item['ext'] in ['m4a', 'aac']:
-                    return 500  # Higher score for preferred formats
-                elif format_item['ext'] in ['mp3', 'opus']:
-                    return 400  # Good score for common formats
+                # Only add the audio format if it's a common format or high quality
+                # Prioritize high-quality formats (320kbps, 256kbps, 192kbps)
+                is_high_quality = raw_bitrate >= 192
+                is_preferred_format = ext in ['m4a', 'mp3', 'aac', 'opus']
+                
+                if is_high_quality or is_preferred_format:
+                    audio_formats.append({
+                        'format_id': format_id,
+                        'ext': ext,
+                        'quality': quality_str,
+                        'raw_bitrate': raw_bitrate,
+                        'size': size_str,
+                        'display_text': f"{quality_str} ({ext})"  # Clean display text
+                    })
+        
+        # Sort formats by quality (higher resolution/bitrate first)
+        video_formats.sort(key=lambda x: int(x['quality'].replace('p', '')) if x['quality'].replace('p', '').isdigit() else 0, reverse=True)
+        
+        # Custom sorting for audio formats to prioritize high quality options
+        def audio_format_quality_score(format_item):
+            # First, try to use raw bitrate directly
+            if 'raw_bitrate' in format_item and format_item['raw_bitrate']:
+                bitrate = float(format_item['raw_bitrate'])
                 
-                return 0  # Lowest priority for unknown/unrated formats
+                # Give higher priority to specific high-quality bitrates
+                if bitrate >= 320:  # 320kbps is highest priority
+                    return 10000 + bitrate
+                elif bitrate >= 256:  # 256kbps is second priority
+                    return 9000 + bitrate
+                elif bitrate >= 192:  # 192kbps is third priority
+                    return 8000 + bitrate
+                else:
+                    return bitrate
+            
+            # Fallback for formats where we can't determine bitrate
+            # Give preference to high-quality formats
+            if format_item['ext'] in ['m4a', 'aac']:
+                return 500  # Higher score for preferred formats
+            elif format_item['ext'] in ['mp3', 'opus']:
+                return 400  # Good score for common formats
             
-            # Sort by our custom quality score
-            audio_formats.sort(key=audio_format_quality_score, reverse=True)
+            return 0  # Lowest priority for unknown/unrated formats
+        
+        # Sort by our custom quality score
+        audio_formats.sort(key=audio_format_quality_score, reverse=True)
+        
+        result = {
+            'title': info.get('title', 'Unknown Title'),
+            'thumbnail': info.get('thumbnail'),
+            'duration': info.get('duration'),
+            'uploader': info.get('uploader'),
+            'video_formats': video_formats,
+            'audio_formats': audio_formats,
+            'description': info.get('description', ''),
+            'webpage_url': info.get('webpage_url'),
+        }
+        
+        # Try to get transcript if available
+        try:
+            subtitles = info.get('subtitles', {})
+            captions = info.get('automatic_captions', {})
             
-            result = {
-                'title': info.get('title', 'Unknown Title'),
-                'thumbnail': info.get('thumbnail'),
-                'duration': info.get('duration'),
-                'uploader': info.get('uploader'),
-                'video_formats': video_formats,
-                'audio_formats': audio_formats,
-                'description': info.get('description', ''),
-                'webpage_url': info.get('webpage_url'),
-            }
+            # Prefer manually created subtitles over automatic captions
+            transcript_sources = subtitles or captions
             
-            # Try to get transcript if available
-            try:
-                subtitles = info.get('subtitles', {})
-                captions = info.get('automatic_captions', {})
+            if transcript_sources:
+                # Prefer English, but take any language if English is not available
+                lang_keys = list(transcript_sources.keys())
+                lang_pref = 'en' if 'en' in lang_keys else lang_keys[0]
                 
-                # Prefer manually created subtitles over automatic captions
-                transcript_sources = subtitles or captions
+                transcript_formats = transcript_sources[lang_pref]
                 
-                if transcript_sources:
-                    # Prefer English, but take any language if English is not available
-                    lang_keys = list(transcript_sources.keys())
-                    lang_pref = 'en' if 'en' in lang_keys else lang_keys[0]
-                    
-                    transcript_formats = transcript_sources[lang_pref]
-                    
-                    # Prefer text formats
-                    for fmt in transcript_formats:
-                        if fmt.get('ext') in ['txt', 'vtt', 'srt']:
-                            transcript_url = fmt.get('url')
-                            if transcript_url:
-                                import requests
-                                transcript_text = requests.get(transcript_url).text
-                                
-                                # Simple cleaning for common subtitle formats
-                                if fmt.get('ext') in ['vtt', 'srt']:
-                                    import re
-                                    # Remove timestamps and other non-text elements
-                                    clean_text = re.sub(r'\d+:\d+:\d+.\d+ --> \d+:\d+:\d+.\d+', '', transcript_text)
-                                    clean_text = re.sub(r'^\d+$', '', clean_text, flags=re.MULTILINE)
-                                    clean_text = re.sub(r'<[^>]+>', '', clean_text)
-                                    clean_text = '\n'.join(line for line in clean_text.split('\n') if line.strip())
-                                    
-                                    result['transcript'] = clean_text
-                                    break
-                                else:
-                                    result['transcript'] = transcript_text
-                                    break
-            except Exception as e:
-                print(f"Error extracting transcript: {str(e)}")
-                result['transcript'] = None
-            
-            # Cache the result
-            video_info_cache[url] = result
-            return result
-            
+                # Prefer text formats
+                for fmt in transcript_formats:
+                    if fmt.get('ext') in ['txt', 'vtt', 'srt']:
+                        transcript_url = fmt.get('url')
+                        if transcript_url:
+                            import requests
+                            youtube_limiter.acquire()
+                            with requests.get(transcript_url, stream=True) as response:
+                                # Clean the captions as they arrive instead of holding the
+                                # whole file in memory; this is the only cleaning pass
+                                lines = response.iter_lines(chunk_size=64 * 1024)
+                                result['transcript'] = '\n\n'.join(iter_clean_paragraphs(lines))
+                            break
+        except Exception as e:
+            print(f"Error extracting transcript: {str(e)}")
+            result['transcript'] = None
+        
+        # Cache the result
+        video_info_cache.set(cache_key, result)
+        shared_video_cache.set(f"app_info:{cache_key}", result)
+        return result
+        
     except Exception as e:
         print(f"Error extracting video info: {str(e)}")
         return {'error': str(e)}
 
-def download_and_merge(session_id, url, video_format_id, audio_format_id, output_ext='mp4', download_type='combined'):
-    """Download video and audio based on the download type."""
-    download_progress[session_id] = {
+def download_streams_in_parallel(url, stream_opts):
+    """Download several streams of the same video at once.
+    
+    Each entry in stream_opts is a set of yt-dlp options for one stream. If any
+    stream fails, the others are cancelled from their next progress callback
+    and the original error is raised.
+    """
+    cancel_event = Event()
+    
+    def cancel_hook(d):
+        if cancel_event.is_set():
+            raise yt_dlp.utils.DownloadCancelled('Cancelled because another stream failed')
+    
+    def download_stream(opts):
+        opts = {**opts, 'progress_hooks': [cancel_hook] + opts.get('progress_hooks', [])}
+        try:
+            with yt_dlp.YoutubeDL(opts) as ydl:
+                download_with_metadata(ydl, url)
+        except BaseException:
+            cancel_event.set()
+            raise
+    
+    with ThreadPoolExecutor(max_workers=len(stream_opts)) as executor:
+        futures = [executor.submit(download_stream, opts) for opts in stream_opts]
+        errors = [f.exception() for f in futures if f.exception() is not None]
+    
+    if errors:
+        # Report the failure that caused the cancellation, not the cancellation itself
+        for error in errors:
+            if not isinstance(error, yt_dlp.utils.DownloadCancelled):
+                raise error
+        raise errors[0]
+
+def download_and_merge(job_id, url, video_format_id, audio_format_id, output_ext='mp4', download_type='combined',
+                       journal=None):
+    """Download video and audio based on the download type.
+    
+    Streams are downloaded into a durable job directory with a journal, so a
+    job re-run after a crash (see resume_interrupted_downloads) skips finished
+    streams and continues partial ones from their .part files.
+    """
+    progress_store.set(job_id, {
         'status': 'downloading',
         'progress': 0,
         'video_progress': 0 if download_type != 'audio_only' else 100,
         'audio_progress': 0 if download_type != 'video_only' else 100,
         'message': 'Starting download...',
         'download_type': download_type
-    }
+    })
     
     try:
-        # Create a temp directory to store downloaded files
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # Get video info for title
-            video_info = get_video_info(url)
-            safe_title = "".join([c for c in video_info.get('title', 'download') if c.isalnum() or c in ' ._-']).strip()
-            
-            # Define different output paths based on download type
-            output_dir = os.path.join('static', 'downloads')
-            os.makedirs(output_dir, exist_ok=True)
+        if journal is None:
+            journal = DownloadJournal.open(job_id, {
+                'url': url,
+                'video_format_id': video_format_id,
+                'audio_format_id': audio_format_id,
+                'output_ext': output_ext,
+                'download_type': download_type
+            })
+        
+        # Get video info for title
+        video_info = get_video_info(url)
+        safe_title = "".join([c for c in video_info.get('title', 'download') if c.isalnum() or c in ' ._-']).strip()
+        
+        # Identical requests from any user map to the same stored artifact
+        key = artifact_key(url, video_format_id, audio_format_id, output_ext, postprocessing=download_type)
+        completion = {'status': 'complete', 'progress': 100, 'download_type': download_type}
+        
+        if download_type == 'audio_only':
+            # For audio-only, use m4a extension
+            download_name = f'{safe_title}_audio.m4a'
+            completion['message'] = 'Audio download complete'
             
-            if download_type == 'audio_only':
-                # For audio-only, use m4a extension
-                output_filename = f'{safe_title}_audio.m4a'
-                audio_file = os.path.join(temp_dir, 'audio.m4a')
-                output_path = os.path.join(output_dir, output_filename)
-                
-                # Download audio only
-                download_progress[session_id]['message'] = 'Downloading audio...'
-                audio_opts = {
-                    'quiet': True,
-                    'no_warnings': True,
-                    'format': audio_format_id,
-                    'outtmpl': audio_file,
-                    'progress_hooks': [lambda d: update_audio_progress(session_id, d)],
-                }
-                
-                with yt_dlp.YoutubeDL(audio_opts) as ydl:
-                    ydl.download([url])
+            def produce(temp_dir):
+                audio_file = journal.file('audio.m4a')
+                progress = job_progress(job_id, ['audio'])
                 
-                download_progress[session_id]['audio_progress'] = 100
-                download_progress[session_id]['progress'] = 100
+                # Download audio only, unless an earlier run already finished it
+                if not journal.stream_complete('audio'):
+                    progress_store.update(job_id, message='Downloading audio...')
+                    with yt_dlp.YoutubeDL(stream_opts(audio_format_id, audio_file, 'audio', progress, journal)) as ydl:
+                        download_with_metadata(ydl, url)
                 
-                # Just copy the audio file to the output location
-                import shutil
-                shutil.copy2(audio_file, output_path)
-                
-                # Complete the download
-                download_progress[session_id] = {
-                    'status': 'complete',
-                    'progress': 100,
-                    'message': 'Audio download complete',
-                    'output_path': output_path,
-                    'filename': os.path.basename(output_path),
-                    'download_type': download_type
-                }
-                print(f"Successfully downloaded audio only for {video_info['title']}")
-                
-            elif download_type == 'video_only':
-                # For video-only
-                output_filename = f'{safe_title}_video.{output_ext}'
-                video_file = os.path.join(temp_dir, f'video.{output_ext}')
-                output_path = os.path.join(output_dir, output_filename)
-                
-                # Download video only
-                download_progress[session_id]['message'] = 'Downloading video...'
-                video_opts = {
-                    'quiet': True,
-                    'no_warnings': True,
-                    'format': video_format_id,
-                    'outtmpl': video_file,
-                    'progress_hooks': [lambda d: update_video_progress(session_id, d)],
-                }
-                
-                with yt_dlp.YoutubeDL(video_opts) as ydl:
-                    ydl.download([url])
-                
-                download_progress[session_id]['video_progress'] = 100
-                download_progress[session_id]['progress'] = 100
-                
-                # Just copy the video file to the output location
-                import shutil
-                shutil.copy2(video_file, output_path)
-                
-                # Clean and add transcript if available
-                transcript = ''
-                if video_info.get('transcript'):
-                    transcript = clean_transcript(video_info.get('transcript', ''))
-                
-                # Complete the download
-                download_progress[session_id] = {
-                    'status': 'complete',
-                    'progress': 100,
-                    'message': 'Video-only download complete',
-                    'output_path': output_path,
-                    'filename': os.path.basename(output_path),
-                    'transcript': transcript,
-                    'download_type': download_type
-                }
-                print(f"Successfully downloaded video only for {video_info['title']}")
+                progress_store.update(job_id, audio_progress=100, progress=100)
+                return audio_file, download_name, 'audio/mp4'
+            
+        elif download_type == 'video_only':
+            # For video-only
+            download_name = f'{safe_title}_video.{output_ext}'
+            completion['message'] = 'Video-only download complete'
+            
+            def produce(temp_dir):
+                video_file = journal.file(f'video.{output_ext}')
+                progress = job_progress(job_id, ['video'])
                 
-            else:
-                # For combined video and audio
-                output_filename = f'{safe_title}.{output_ext}'
-                video_file = os.path.join(temp_dir, f'video.{output_ext}')
-                audio_file = os.path.join(temp_dir, 'audio.m4a')
-                output_path = os.path.join(output_dir, output_filename)
+                # Download video only, unless an earlier run already finished it
+                if not journal.stream_complete('video'):
+                    progress_store.update(job_id, message='Downloading video...')
+                    with yt_dlp.YoutubeDL(stream_opts(video_format_id, video_file, 'video', progress, journal)) as ydl:
+                        download_with_metadata(ydl, url)
                 
-                # Download video
-                download_progress[session_id]['message'] = 'Downloading video...'
-                video_opts = {
-                    'quiet': True,
-                    'no_warnings': True,
-                    'format': video_format_id,
-                    'outtmpl': video_file,
-                    'progress_hooks': [lambda d: update_video_progress(session_id, d)],
-                }
+                progress_store.update(job_id, video_progress=100, progress=100)
+                return video_file, download_name, None
+            
+        else:
+            # For combined video and audio
+            download_name = f'{safe_title}.{output_ext}'
+            completion['message'] = 'Download complete'
+            
+            # Stream-copy the audio whenever the output container can hold it
+            source_audio_codec = audio_codec_for_format(get_video_metadata(url).info, audio_format_id)
+            audio_merge, merge_args = plan_audio_merge(source_audio_codec, output_ext)
+            completion['audio_merge'] = audio_merge
+            
+            def produce(temp_dir):
+                video_file = journal.file(f'video.{output_ext}')
+                audio_file = journal.file('audio.m4a')
+                merged_file = journal.file(f'merged.{output_ext}')
+                print(f"Audio merge path for {video_info['title']}: {audio_merge} ({source_audio_codec} -> {output_ext})")
                 
-                with yt_dlp.YoutubeDL(video_opts) as ydl:
-                    ydl.download([url])
+                # Both streams feed one aggregator so overall progress is weighted by bytes
+                progress = job_progress(job_id, ['video', 'audio'])
                 
-                download_progress[session_id]['video_progress'] = 100
-                download_progress[session_id]['message'] = 'Downloading audio...'
+                if MERGE_MODE == 'pipelined':
+                    # Mux while both streams are still arriving, no intermediate files
+                    # (nothing to resume from, so the output stays in throwaway scratch)
+                    progress_store.update(job_id, message='Downloading and merging video and audio...')
+                    merged_file = os.path.join(temp_dir, f'merged.{output_ext}')
+                    pipelined_download_and_merge(
+                        url, video_format_id, audio_format_id, merged_file, temp_dir,
+                        video_progress_hook=progress.hook('video'),
+                        audio_progress_hook=progress.hook('audio'),
+                        output_args=merge_args,
+                    )
+                    return merged_file, download_name, None
                 
-                # Download audio
-                audio_opts = {
-                    'quiet': True,
-                    'no_warnings': True,
-                    'format': audio_format_id,
-                    'outtmpl': audio_file,
-                    'progress_hooks': [lambda d: update_audio_progress(session_id, d)],
-                }
+                # Download video and audio streams at the same time, skipping
+                # any stream an earlier run of this job already finished
+                progress_store.update(job_id, message='Downloading video and audio...')
+                pending = []
+                for name, format_id, file_path in (('video', video_format_id, video_file),
+                                                   ('audio', audio_format_id, audio_file)):
+                    if journal.stream_complete(name):
+                        # Count a stream finished by an earlier run towards overall progress
+                        size = os.path.getsize(file_path)
+                        progress.update(name, {'status': 'finished', 'downloaded_bytes': size, 'total_bytes': size})
+                    else:
+                        pending.append(stream_opts(format_id, file_path, name, progress, journal))
                 
-                with yt_dlp.YoutubeDL(audio_opts) as ydl:
-                    ydl.download([url])
+                if pending:
+                    download_streams_in_parallel(url, pending)
                 
-                download_progress[session_id]['audio_progress'] = 100
-                download_progress[session_id]['message'] = 'Merging video and audio...'
+                progress_store.update(job_id, video_progress=100, audio_progress=100, message='Merging video and audio...')
                 
                 # Merge video and audio using ffmpeg
                 try:
                     ffmpeg.input(video_file).output(
                         ffmpeg.input(audio_file),
-                        output_path,
-                        vcodec='copy',
-                        acodec='aac',
-                        strict='experimental'
+                        merged_file,
+                        **merge_args
                     ).run(quiet=True, overwrite_output=True)
-                    
-                    # Clean and add transcript if available
-                    transcript = ''
-                    if video_info.get('transcript'):
-                        transcript = clean_transcript(video_info.get('transcript', ''))
-                    
-                    # Complete the download
-                    download_progress[session_id] = {
-                        'status': 'complete',
-                        'progress': 100,
-                        'message': 'Download complete',
-                        'output_path': output_path,
-                        'filename': os.path.basename(output_path),
-                        'transcript': transcript,
-                        'download_type': download_type
-                    }
-                    print(f"Successfully processed video content for {video_info['title']}")
-                    
                 except Exception as e:
-                    print(f"Error merging files: {str(e)}")
-                    download_progress[session_id] = {
-                        'status': 'error',
-                        'message': f'Error merging files: {str(e)}',
-                        'download_type': download_type
-                    }
+                    raise RuntimeError(f'Error merging files: {str(e)}')
+                return merged_file, download_name, None
+        
+        # Served from disk when an identical download already exists
+        output_path, download_name, mime_type = artifact_cache.get_or_produce(key, produce)
+        
+        completion.update({
+            'output_path': output_path,
+            'filename': download_name,
+            'mime_type': mime_type,
+            'artifact_key': key,
+            'download_url': f'/download_artifact/{key}',
+        })
+        
+        # Add the transcript if available; get_video_info already cleaned it
+        if download_type != 'audio_only':
+            completion['transcript'] = video_info.get('transcript') or ''
+        
+        # Complete the download; the journal goes only once the result is recorded
+        progress_store.set(job_id, completion)
+        journal.finish()
+        print(f"Successfully processed {download_type} download for {video_info['title']}")
     
     except Exception as e:
         print(f"Download error: {str(e)}")
-        download_progress[session_id] = {
+        if journal is not None:
+            failures = journal.record_failure(e) if is_retryable_download_error(e) else None
+            if failures is not None and failures < DOWNLOAD_MAX_ATTEMPTS:
+                retry_download(journal, e, failures)
+                return
+            journal.finish()
+        progress_store.set(job_id, {
             'status': 'error',
             'message': f'Download error: {str(e)}',
+            'error': str(e),
             'download_type': download_type
-        }
+        })
+        # Let the download queue record the job as failed too
+        raise
 
-def clean_transcript(transcript):
-    """Clean transcript text by removing WEBVTT markers, timestamps, and formatting"""
-    # Make sure transcript is a string
-    if not transcript:
-        return ""
-    
-    # Dictionary to track unique content
-    unique_content = {}
-    
-    # Remove WEBVTT header and metadata
-    lines = str(transcript).split('\n')
-    cleaned_lines = []
-    
-    for line in lines:
-        # Skip WEBVTT headers and metadata
-        if any(keyword in line for keyword in ['WEBVTT', 'Kind:', 'Language:']):
-            continue
-            
-        # Skip timestamp lines (they contain --> format)
-        if '-->' in line:
-            continue
-            
-        # Skip empty numeric lines (usually indices)
-        if line.strip().isdigit():
-            continue
-            
-        # Skip any line with line percentage format (like line:76%)
-        if re.search(r'line:\d+%', line):
-            continue
-            
-        # Skip alignment and position markers
-        if any(marker in line for marker in ['align:', 'position:']):
-            continue
-        
-        # Clean HTML entities and special formatting
-        cleaned_line = line
-        
-        # Replace HTML entities
-        cleaned_line = cleaned_line.replace('&gt;', '>')
-        cleaned_line = cleaned_line.replace('&lt;', '<')
-        cleaned_line = cleaned_line.replace('&amp;', '&')
-        
-        # Remove angle brackets (often used for speaker identification)
-        cleaned_line = re.sub(r'>>>|>>|\[\[.*?\]\]|\[.*?\]', '', cleaned_line)
-        
-        # Remove Reporter: and similar tags
-        cleaned_line = re.sub(r'(Reporter|Speaker|Host|Narrator):\s*', '', cleaned_line)
-        
-        # Remove timestamp markers and caption markers
-        cleaned_line = re.sub(r'<\d{2}:\d{2}:\d{2}\.\d{3}>', '', cleaned_line)
-        cleaned_line = re.sub(r'<c>', '', cleaned_line) 
-        cleaned_line = re.sub(r'</c>', '', cleaned_line)
-        
-        # Trim whitespace
-        cleaned_line = cleaned_line.strip()
-        
-        # Only add non-empty lines that we haven't seen before
-        if cleaned_line and cleaned_line not in unique_content:
-            unique_content[cleaned_line] = True
-            cleaned_lines.append(cleaned_line)
-    
-    # Join the unique lines
-    cleaned_text = '\n'.join(cleaned_lines)
+def stream_opts(format_id, file_path, name, progress, journal):
+    """yt-dlp options for downloading one stream of a journaled job to file_path."""
+    return {
+        'quiet': True,
+        'no_warnings': True,
+        'format': format_id,
+        'outtmpl': file_path,
+        # Continue from the .part file an interrupted run left behind
+        'continuedl': True,
+        'progress_hooks': [progress.hook(name), journal.progress_hook(name, file_path)],
+    }
+
+def is_retryable_download_error(error):
+    """True if a failed download may succeed when re-run from its journal (network trouble, not a bad video)."""
+    if isinstance(error, (ConnectionError, TimeoutError)):
+        return True
+    message = str(error).lower()
+    return any(hint in message for hint in RETRYABLE_ERROR_HINTS)
+
+def submit_journaled_download(journal, description):
+    """Queue download_and_merge for a journaled job, continuing from its journal."""
+    params = journal.params
+    download_queue.submit(
+        download_and_merge, journal.job_id, params['url'], params['video_format_id'],
+        params['audio_format_id'], params['output_ext'], params['download_type'],
+        description=description, job_id=journal.job_id, journal=journal
+    )
+
+def retry_delay(failures):
+    """Seconds to wait before retrying after this many failed runs: exponential backoff with jitter."""
+    delay = min(DOWNLOAD_RETRY_MAX_DELAY, DOWNLOAD_RETRY_DELAY * 2 ** (failures - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+def retry_download(journal, error, failures):
+    """Queue a failed journaled download again once its backoff delay has passed.
     
-    # Add paragraph breaks for readability (after sentence-ending punctuation)
-    cleaned_text = re.sub(r'([.!?])\s+', r'\1\n\n', cleaned_text)
+    The job keeps its journal locked while it waits, so recovery in another
+    process leaves it alone; if this process stops first, the journal is
+    resumed after the restart instead.
+    """
+    params = journal.params
+    delay = retry_delay(failures)
+    progress_store.update(
+        journal.job_id,
+        status='queued',
+        message=f'Download interrupted ({str(error)}), retrying in {delay:.0f}s...',
+        download_type=params['download_type']
+    )
     
-    # Clean up any remaining multiple newlines
-    cleaned_text = re.sub(r'\n{3,}', '\n\n', cleaned_text)
+    def resubmit():
+        try:
+            submit_journaled_download(journal, f"retried {params['download_type']} download of {params['url']}")
+        except QueueFull:
+            # Keep the partial streams for recovery after a restart; the
+            # storage janitor removes the directory if nobody comes back
+            journal.unlock()
+            progress_store.set(journal.job_id, {
+                'status': 'error',
+                'message': f'Download error: {str(error)}',
+                'error': str(error),
+                'download_type': params['download_type']
+            })
     
-    return cleaned_text.strip()
+    timer = Timer(delay, resubmit)
+    timer.daemon = True
+    timer.start()
+    print(f"Retrying download job {journal.job_id} in {delay:.0f}s after: {str(error)}")
+
+def resume_interrupted_downloads():
+    """Re-queue downloads that a crashed or restarted process left unfinished."""
+    for journal in interrupted_journals():
+        params = journal.params
+        progress_store.update(
+            journal.job_id,
+            status='queued',
+            progress=0,
+            message='Resuming interrupted download...',
+            download_type=params['download_type']
+        )
+        try:
+            submit_journaled_download(journal, f"resumed {params['download_type']} download of {params['url']}")
+        except QueueFull:
+            journal.unlock()
+            break
+        print(f"Resuming interrupted download job {journal.job_id}")
+
+# Interrupted downloads are picked up by the first request each process serves
+_resume_checked_pid = None
+
+@app.before_request
+def resume_downloads_once():
+    global _resume_checked_pid
+    if _resume_checked_pid != os.getpid():
+        _resume_checked_pid = os.getpid()
+        resume_interrupted_downloads()
+        # Whatever else was queued in a process that is gone will never run
+        download_queue.fail_orphaned_jobs()
 
 @app.route('/test-transcript', methods=['GET', 'POST'])
 def test_transcript_cleaning():
@@ -505,19 +586,37 @@ def test_transcript_cleaning():
     reduction = 0
     
     if request.method == 'POST':
-        raw_transcript = request.form.get('raw_transcript', '')
-        
-        if raw_transcript:
-            cleaned_transcript = clean_transcript(raw_transcript)
-            
-            # Calculate stats
-            original_count = len(raw_transcript.split())
-            cleaned_count = len(cleaned_transcript.split())
-            original_chars = len(raw_transcript)
-            cleaned_chars = len(cleaned_transcript)
-            
-            if original_chars > 0:
-                reduction = round((1 - (cleaned_chars / original_chars)) * 100, 1)
+        form_types = ('multipart/form-data', 'application/x-www-form-urlencoded')
+        if request.mimetype == 'multipart/form-data' and request.files.get('transcript_file'):
+            # Uploaded caption files are cleaned line by line as they are read
+            lines = request.files['transcript_file'].stream
+        elif request.mimetype not in form_types:
+            # A caption file sent as the raw request body never gets buffered whole
+            lines = request.stream
+        else:
+            raw_transcript = request.form.get('raw_transcript', '')
+            lines = io.StringIO(raw_transcript, newline='\n')
+
+        original = {'words': 0, 'chars': 0}
+
+        def counted(lines):
+            for line in lines:
+                if isinstance(line, bytes):
+                    line = line.decode('utf-8', 'replace')
+                original['words'] += len(line.split())
+                original['chars'] += len(line)
+                yield line
+
+        cleaned_transcript = '\n\n'.join(iter_clean_paragraphs(counted(lines)))
+
+        # Calculate stats
+        original_count = original['words']
+        cleaned_count = len(cleaned_transcript.split())
+        original_chars = original['chars']
+        cleaned_chars = len(cleaned_transcript)
+
+        if original_chars > 0:
+            reduction = round((1 - (cleaned_chars / original_chars)) * 100, 1)
     
     return render_template('test_transcript.html', 
                           raw_transcript=raw_transcript,
@@ -528,45 +627,14 @@ def test_transcript_cleaning():
                           cleaned_chars=cleaned_chars,
                           reduction=reduction)
 
-def update_video_progress(session_id, d):
-    """Update video download progress."""
-    if d['status'] == 'downloading':
-        try:
-            if 'total_bytes' in d and d['total_bytes'] > 0:
-                percentage = (d['downloaded_bytes'] / d['total_bytes']) * 100
-            elif 'total_bytes_estimate' in d and d['total_bytes_estimate'] > 0:
-                percentage = (d['downloaded_bytes'] / d['total_bytes_estimate']) * 100
-            else:
-                percentage = 0
-                
-            download_progress[session_id]['video_progress'] = percentage
-            # Overall progress is average of video and audio progress
-            download_progress[session_id]['progress'] = (
-                download_progress[session_id]['video_progress'] + 
-                download_progress[session_id]['audio_progress']
-            ) / 2
-        except Exception as e:
-            print(f"Error updating video progress: {str(e)}")
-
-def update_audio_progress(session_id, d):
-    """Update audio download progress."""
-    if d['status'] == 'downloading':
+def job_progress(job_id, streams):
+    """Progress aggregator publishing a download job's stream hooks to the progress store."""
+    def publish(snapshot):
         try:
-            if 'total_bytes' in d and d['total_bytes'] > 0:
-                percentage = (d['downloaded_bytes'] / d['total_bytes']) * 100
-            elif 'total_bytes_estimate' in d and d['total_bytes_estimate'] > 0:
-                percentage = (d['downloaded_bytes'] / d['total_bytes_estimate']) * 100
-            else:
-                percentage = 0
-                
-            download_progress[session_id]['audio_progress'] = percentage
-            # Overall progress is average of video and audio progress
-            download_progress[session_id]['progress'] = (
-                download_progress[session_id]['video_progress'] + 
-                download_progress[session_id]['audio_progress']
-            ) / 2
+            progress_store.update(job_id, **snapshot)
         except Exception as e:
-            print(f"Error updating audio progress: {str(e)}")
+            print(f"Error updating download progress: {str(e)}")
+    return ProgressAggregator(publish, streams=streams)
 
 # Removed OpenAI analysis functions as they are not needed
 
@@ -605,23 +673,6 @@ def download_video():
     
     session_id = session['session_id']
     
-    ydl_opts = {
-        'cookies': 'cookies.txt',  # ✅ This line fixes the bot-check error
-        'outtmpl': f'downloads/{session_id}/%(title)s.%(ext)s',
-        'quiet': True,
-        'no_warnings': True,
-        'format': 'bestvideo+bestaudio/best',
-        'merge_output_format': output_ext
-    }
-
-    try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=True)
-            return jsonify({'status': 'success', 'title': info.get('title', 'Downloaded')})
-    except Exception as e:
-        return jsonify({'status': 'error', 'message': str(e)}), 500
-
-    
     # Validate depending on download type
     if download_type == 'video_only':
         if not all([url, video_format_id]):
@@ -636,22 +687,47 @@ def download_video():
         if not all([url, video_format_id, audio_format_id]):
             return jsonify({'error': 'URL, video format, and audio format are required for combined download'}), 400
     
-    # Start download in background thread
-    thread = Thread(target=download_and_merge, args=(session_id, url, video_format_id, audio_format_id, output_ext, download_type))
-    thread.daemon = True
-    thread.start()
+    # Progress is keyed by job, so a session can run several downloads at once
+    job_id = uuid.uuid4().hex
+    progress_store.set(job_id, {
+        'status': 'queued',
+        'progress': 0,
+        'message': 'Waiting in download queue...',
+        'download_type': download_type
+    }, owner=session_id)
     
-    return jsonify({'status': 'started', 'session_id': session_id, 'download_type': download_type})
-
-@app.route('/download_progress')
-def get_download_progress():
-    """API endpoint to check download progress."""
-    session_id = session.get('session_id')
-    if not session_id or session_id not in download_progress:
-        return jsonify({'status': 'not_started', 'progress': 0})
+    # Hand the download to the bounded worker pool
+    try:
+        download_queue.submit(
+            download_and_merge, job_id, url, video_format_id, audio_format_id, output_ext, download_type,
+            description=f'{download_type} download of {url}', job_id=job_id
+        )
+    except QueueFull as e:
+        progress_store.set(job_id, {
+            'status': 'error',
+            'message': str(e),
+            'download_type': download_type
+        })
+        return jsonify({'error': str(e)}), 503
     
-    # Filter the response to include only necessary fields
-    progress_data = download_progress[session_id]
+    return jsonify({
+        'status': 'queued',
+        'job_id': job_id,
+        'queue_position': download_queue.position(job_id),
+        'session_id': session_id,
+        'download_type': download_type
+    })
+
+@app.route('/download_jobs/<job_id>')
+def get_download_job(job_id):
+    """API endpoint to check a queued download job and its queue position."""
+    status = download_queue.status(job_id)
+    if status is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(status)
+
+def progress_response(progress_data):
+    """Filter a stored progress entry down to the fields clients need."""
     response = {
         'status': progress_data.get('status', 'unknown'),
         'progress': progress_data.get('progress', 0),
@@ -664,21 +740,163 @@ def get_download_progress():
         response['filename'] = progress_data['filename']
     if 'transcript' in progress_data:
         response['transcript'] = progress_data['transcript']
+    if 'download_url' in progress_data:
+        response['download_url'] = progress_data['download_url']
+    
+    return response
+
+@app.route('/download_progress')
+def get_download_progress():
+    """API endpoint to check download progress.
+    
+    Takes a job_id query parameter; without one, reports the most recent
+    download started from this session.
+    """
+    job_id = request.args.get('job_id') or latest_session_job()
+    
+    progress_data = progress_store.get(job_id) if job_id else None
+    if not progress_data:
+        return jsonify({'status': 'not_started', 'progress': 0})
     
+    response = progress_response(progress_data)
+    response['job_id'] = job_id
     return jsonify(response)
 
+def latest_session_job():
+    """Job ID of the most recent download started from this session, if any."""
+    session_id = session.get('session_id')
+    recent_jobs = progress_store.jobs_for_owner(session_id, limit=1) if session_id else []
+    return recent_jobs[0] if recent_jobs else None
+
+@app.route('/download_progress/stream')
+def stream_download_progress():
+    """Server-Sent Events stream of a download job's progress.
+    
+    Only changed progress is pushed; a comment line is sent as a heartbeat
+    while nothing changes. Each event ID is a digest of the progress it
+    carries, so a reconnecting client sending Last-Event-ID only receives the
+    current state if it differs from what it last saw. The stream ends once
+    the job completes or fails.
+    
+    Each open stream holds a request thread, so only SSE_MAX_STREAMS are kept
+    open per process. Past that a client gets the current state and is told
+    to reconnect in SSE_BUSY_RETRY_MS, which turns its stream into polling.
+    Unknown jobs get a 404, which EventSource does not retry.
+    """
+    job_id = request.args.get('job_id') or latest_session_job()
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    
+    if not job_id or progress_store.get(job_id) is None:
+        return jsonify({'error': 'Unknown download job'}), 404
+    
+    def progress_event(last_sent):
+        progress_data = progress_store.get(job_id)
+        if progress_data is None:
+            # Purged while the stream was open
+            response = {'status': 'error', 'progress': 0, 'message': 'Unknown download job'}
+        else:
+            response = progress_response(progress_data)
+        response['job_id'] = job_id
+        event_id = hashlib.sha1(json.dumps(response, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+        event = f"id: {event_id}\ndata: {json.dumps(response)}\n\n" if event_id != last_sent else None
+        return response['status'], event_id, event
+    
+    def generate():
+        if not sse_slots.acquire(blocking=False):
+            yield f"retry: {SSE_BUSY_RETRY_MS}\n\n"
+            _, _, event = progress_event(last_event_id)
+            if event:
+                yield event
+            return
+        
+        try:
+            last_sent = last_event_id
+            last_write = time.monotonic()
+            started = last_write
+            
+            # Tell EventSource how quickly to reconnect if the connection drops
+            yield f"retry: {SSE_RETRY_MS}\n\n"
+            
+            while True:
+                status, last_sent, event = progress_event(last_sent)
+                
+                now = time.monotonic()
+                if event:
+                    yield event
+                    last_write = now
+                elif now - last_write >= SSE_HEARTBEAT_SECONDS:
+                    yield ": heartbeat\n\n"
+                    last_write = now
+                
+                if status in ('complete', 'error') or now - started > SSE_MAX_SECONDS:
+                    break
+                time.sleep(SSE_POLL_SECONDS)
+        finally:
+            sse_slots.release()
+    
+    return Response(generate(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no',  # Stop nginx from buffering the stream
+    })
+
+@app.route('/download_progress/bulk', methods=['GET', 'POST'])
+def get_bulk_download_progress():
+    """API endpoint to check the progress of several download jobs at once."""
+    if request.method == 'POST':
+        job_ids = (request.get_json(silent=True) or {}).get('job_ids', [])
+    else:
+        job_ids = [j for j in request.args.get('job_ids', '').split(',') if j]
+    
+    if len(job_ids) > 100:
+        return jsonify({'error': 'At most 100 job IDs per request'}), 400
+    
+    found = progress_store.get_many(job_ids)
+    return jsonify({
+        job_id: progress_response(found[job_id]) if job_id in found else {'status': 'not_started', 'progress': 0}
+        for job_id in job_ids
+    })
+
+@app.route('/cache_stats')
+def cache_stats():
+    """API endpoint to inspect the video info cache counters."""
+    return jsonify({
+        'local': video_info_cache.stats(),
+        'shared': shared_video_cache.stats(),
+        'single_flight': extraction_group.stats(),
+        'rate_limiter': youtube_limiter.stats(),
+        'download_queue': download_queue.stats(),
+        'artifacts': artifact_cache.stats(),
+        'storage': storage_manager.stats(),
+    })
+
+@app.route('/download_artifact/<key>')
+def download_artifact(key):
+    """Download a finished file from the artifact cache."""
+    artifact = artifact_cache.lookup(key)
+    if not artifact:
+        return jsonify({'error': 'File not found'}), 404
+    
+    file_path, download_name, mime_type = artifact
+    return send_media(file_path, download_name=download_name, mimetype=mime_type)
+
 @app.route('/download_file/<filename>')
 def download_file(filename):
     """Download the processed file."""
-    file_path = os.path.join('static', 'downloads', filename)
+    file_path = os.path.join(DOWNLOAD_DIR, filename)
     if os.path.exists(file_path):
-        return send_file(file_path, as_attachment=True)
+        return send_media(file_path)
     else:
         return jsonify({'error': 'File not found'}), 404
 
 if __name__ == '__main__':
     # Create downloads directory if it doesn't exist
-    os.makedirs(os.path.join('static', 'downloads'), exist_ok=True)
+    download_dir()
+    
+    # Pre-warm the extractor workers so the first request doesn't pay for them
+    extractor_pool.warm()
+    
+    # Start evicting and cleaning up download storage
+    storage_manager.start()
     
     # Start the Flask app
     app.run(host='0.0.0.0', port=5000, debug=True)
@@ -0,0 +1,207 @@
+import fcntl
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import tempfile
+import threading
+import time
+
+from download_journal import lock_directory
+from singleflight import SingleFlight
+from storage import DOWNLOAD_DIR, file_sha256, finalize_file, scratch_root
+from video_cache import canonical_video_key
+
+# Finished downloads are stored here under their content key
+ARTIFACT_DIR = os.environ.get("DOWNLOAD_ARTIFACT_DIR", os.path.join(DOWNLOAD_DIR, 'artifacts'))
+# Per-key lock files inside ARTIFACT_DIR, skipped by the quota scan like every dot entry
+LOCK_DIR = '.locks'
+
+
+def artifact_key(video, video_format_id=None, audio_format_id=None, container=None, postprocessing=None):
+    """
+    Return the content key of a download artifact
+
+    Two requests with the same key produce the same bytes, whoever asks.
+
+    Args:
+        video: Video URL or ID; any URL form of the same video gives the same key
+        video_format_id: yt-dlp format ID of the video stream, if any
+        audio_format_id: yt-dlp format ID of the audio stream, if any
+        container: Output container or format type ('mp4', 'webm', 'mp3', ...)
+        postprocessing: String describing anything else that changes the output
+            (download type, resolution selector, audio extraction)
+    """
+    parts = [canonical_video_key(video), video_format_id or '', audio_format_id or '',
+             container or '', postprocessing or '']
+    return hashlib.sha256('\x1f'.join(parts).encode('utf-8')).hexdigest()
+
+
+class ArtifactCache:
+    """
+    Finished download files shared across users and requests
+
+    Each artifact is stored as <key><ext> next to a <key>.json record holding
+    its download name and MIME type; the record is written after the file is
+    in place, so a record always points at a complete file. Concurrent
+    requests for the same key in this process share one production, and a
+    per-key flock under .locks makes other processes wait for it and reuse
+    the result instead of producing the same file again.
+    """
+
+    def __init__(self, root=ARTIFACT_DIR):
+        self.root = root
+        self._flight = SingleFlight()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # Called with the file path of every newly stored artifact
+        self.on_store = None
+
+    def _record_path(self, key):
+        return os.path.join(self.root, f'{key}.json')
+
+    def _lock_key(self, key):
+        # Lock files are never removed, so every process locks the same inode
+        lock_dir = os.path.join(self.root, LOCK_DIR)
+        os.makedirs(lock_dir, exist_ok=True)
+        fd = os.open(os.path.join(lock_dir, f'{key}.lock'), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        except BaseException:
+            os.close(fd)
+            raise
+        return fd
+
+    def lookup(self, key):
+        """
+        Return (file_path, download_name, mime_type) for a cached artifact, or None
+        """
+        try:
+            with open(self._record_path(key)) as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        file_path = os.path.join(self.root, record['file'])
+        if not os.path.exists(file_path):
+            # The file was removed behind our back; forget the record
+            self.delete(key)
+            return None
+        return file_path, record['download_name'], record['mime_type']
+
+    def get(self, key):
+        """Like lookup, but counted in the hit/miss stats"""
+        artifact = self.lookup(key)
+        with self._lock:
+            if artifact:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if artifact:
+            # The record's mtime is the artifact's last use, for eviction
+            try:
+                os.utime(self._record_path(key))
+            except OSError:
+                pass
+        return artifact
+
+    def get_or_produce(self, key, produce):
+        """
+        Return the artifact for key, producing it first if it isn't cached
+
+        Args:
+            key: Content key from artifact_key()
+            produce: Called with a scratch directory; returns a tuple of
+                (file_path, download_name, mime_type) for a file it wrote.
+                mime_type may be None to guess it from the download name.
+
+        Returns:
+            A tuple of (file_path, download_name, mime_type) in the cache
+        """
+        artifact = self.get(key)
+        if artifact:
+            return artifact
+        return self._flight.do(key, self._produce, key, produce)
+
+    def _produce(self, key, produce):
+        # Another worker may have finished it while this caller waited
+        artifact = self.lookup(key)
+        if artifact:
+            return artifact
+
+        os.makedirs(self.root, exist_ok=True)
+        key_fd = self._lock_key(key)
+        try:
+            # ...or another process, while this one waited for the key's lock
+            artifact = self.lookup(key)
+            if artifact:
+                return artifact
+            return self._store(key, produce)
+        finally:
+            os.close(key_fd)
+
+    def _store(self, key, produce):
+        with tempfile.TemporaryDirectory(dir=scratch_root()) as work_dir:
+            # Held while producing, so a stalled download's directory is
+            # never mistaken for an orphan by the storage janitor
+            lock_fd = lock_directory(work_dir)
+            try:
+                produced_path, download_name, mime_type = produce(work_dir)
+                ext = os.path.splitext(produced_path)[1] or os.path.splitext(download_name)[1]
+                file_name = f'{key}{ext}'
+                file_path = finalize_file(produced_path, os.path.join(self.root, file_name))
+            finally:
+                os.close(lock_fd)
+
+        mime_type = mime_type or mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+        self._write_record(key, {
+            'file': file_name,
+            'download_name': download_name,
+            'mime_type': mime_type,
+            'size': os.path.getsize(file_path),
+            # Strong validator for conditional and range requests
+            'sha256': file_sha256(file_path),
+            'created_at': time.time(),
+        })
+        logging.info(f"Stored download artifact {file_name} ({download_name})")
+        if self.on_store:
+            self.on_store(file_path)
+        return file_path, download_name, mime_type
+
+    def _write_record(self, key, record):
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.record-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(record, f)
+            os.replace(tmp_path, self._record_path(key))
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def delete(self, key):
+        """Remove an artifact and its record"""
+        try:
+            with open(self._record_path(key)) as f:
+                file_name = json.load(f).get('file')
+        except (OSError, ValueError):
+            file_name = None
+
+        for path in (self._record_path(key), file_name and os.path.join(self.root, file_name)):
+            if path:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+
+    def stats(self):
+        with self._lock:
+            stats = {'hits': self.hits, 'misses': self.misses}
+        stats.update(self._flight.stats())
+        return stats
+
+
+# Process-wide handle on the artifact directory
+artifact_cache = ArtifactCache()
@@ -0,0 +1,128 @@
+import glob
+import os
+import string
+import sys
+import time
+
+from youtube_service import merge_transcript_entries
+
+# Sample captions pasted from YouTube, one caption line per entry
+assets_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "attached_assets")
+caption_files = sorted(glob.glob(os.path.join(assets_dir, "Pasted-Kind-captions-*.txt")))
+# How many times the samples are repeated, to mimic multi-hour captions
+scales = [1, 10, 100]
+# Sizes of the synthetic run of continuation entries that all merge into one line
+continuation_sizes = [1000, 5000, 20000]
+# The previous, quadratic pass is only timed on inputs up to this many entries
+REFERENCE_MAX_ENTRIES = 10000
+
+
+def caption_entries(text, seconds_per_line=2.0):
+    """Turn pasted caption text into YouTubeTranscriptApi-style entries"""
+    entries = []
+    for line in text.split('\n'):
+        line = line.strip()
+        if not line or line.startswith(('Kind:', 'Language:', 'line:')):
+            continue
+        entries.append({'text': line, 'start': len(entries) * seconds_per_line, 'duration': seconds_per_line})
+    return entries
+
+
+def word_entries(entries):
+    """Split every entry into one entry per word, like fast auto-generated captions"""
+    split = []
+    for entry in entries:
+        for word in entry['text'].split():
+            split.append({'text': word, 'start': entry['start'] + len(split) * 0.01, 'duration': 0.3})
+    return split
+
+
+def continuation_entries(count):
+    """Entries that each start with the previous entry's last word, so they all merge into one line"""
+    return [{'text': f"w{i} w{i + 1}", 'start': i * 0.5, 'duration': 0.5} for i in range(count)]
+
+
+def reference_merge(entries):
+    """The previous merge pass, kept to check the output hasn't changed"""
+    cleaned = []
+    buffer = []
+    prev_normalized = ""
+    punctuation = str.maketrans('', '', string.punctuation.replace("'", ""))
+
+    def normalize(t):
+        return t.translate(punctuation).lower().replace(" ", "").strip()
+
+    def is_continuation(current, previous):
+        return current.startswith(previous.split()[-1]) if previous else False
+
+    for entry in entries:
+        text = entry['text'].strip()
+        if not text:
+            continue
+        if buffer and (len(buffer[-1].split()) < 4 or is_continuation(text, buffer[-1])):
+            buffer[-1] += " " + text
+        else:
+            buffer.append(text)
+
+    for line in buffer:
+        line_normalized = normalize(line)
+        if not line_normalized:
+            continue
+        is_duplicate = any(line_normalized.startswith(n) or n.startswith(line_normalized)
+                           for n in [prev_normalized] if n)
+        if not is_duplicate and line_normalized != prev_normalized:
+            cleaned.append(line)
+            prev_normalized = line_normalized
+
+    return "\n".join(cleaned)
+
+
+def timed(fn, entries, repeat=3):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn(entries)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def report(label, entries):
+    """Time both passes on entries and print one line; the reference is skipped on big inputs"""
+    result, elapsed = timed(merge_transcript_entries, entries)
+    line = (f"{label:>8}: {len(entries):>8} entries in {elapsed * 1000:9.2f} ms "
+            f"({elapsed / len(entries) * 1e6:6.2f} us per entry)")
+    if len(entries) <= REFERENCE_MAX_ENTRIES:
+        reference, reference_time = timed(reference_merge, entries, repeat=1)
+        line += f", reference {reference_time * 1000:9.2f} ms"
+        if reference != result[0]:
+            line += " OUTPUT DIFFERS"
+    else:
+        line += ", reference skipped"
+    print(line)
+
+
+if not caption_files:
+    print(f"No sample captions found in {assets_dir}")
+    sys.exit(0)
+
+sample = []
+for path in caption_files:
+    with open(path, 'r') as f:
+        sample += caption_entries(f.read())
+
+print(f"Sample: {len(caption_files)} caption files, {len(sample)} entries")
+
+for name, entries in (("caption lines", sample), ("one word per entry", word_entries(sample))):
+    text, cues = merge_transcript_entries(entries)
+    print(f"\n=== {name} ===")
+    print("Output matches reference:", text == reference_merge(entries))
+    print(f"Cues: {len(cues)}, transcript characters: {len(text)}")
+
+    for scale in scales:
+        scaled = [dict(entry, start=entry['start'] + i * 10000) for i in range(scale) for entry in entries]
+        report(f"{scale}x", scaled)
+
+print("\n=== long continuation run ===")
+for size in continuation_sizes:
+    report(str(size), continuation_entries(size))
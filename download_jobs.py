@@ -0,0 +1,294 @@
+import fcntl
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from progress_store import progress_store
+
+# Number of downloads processed at once and how many may wait behind them
+DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", 2))
+DOWNLOAD_QUEUE_SIZE = int(os.environ.get("DOWNLOAD_QUEUE_SIZE", 100))
+# Finished jobs kept around so clients can still fetch their results
+FINISHED_JOBS_KEPT = int(os.environ.get("DOWNLOAD_FINISHED_JOBS_KEPT", 1000))
+# Owner files of live queues sit next to the progress database
+QUEUE_OWNER_PREFIX = 'download-queue-'
+
+
+class QueueFull(Exception):
+    """Raised when the download queue cannot accept another job"""
+
+
+class DownloadJob:
+    """One queued unit of download work and its outcome"""
+
+    def __init__(self, job_id, fn, args, kwargs, description=''):
+        self.job_id = job_id
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.description = description
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            'job_id': self.job_id,
+            'status': self.status,
+            'description': self.description,
+            'error': self.error,
+            'created_at': self.created_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at,
+        }
+
+
+class DownloadQueue:
+    """
+    Bounded FIFO of download jobs served by a fixed pool of worker threads
+
+    Entry points submit work and get a job ID back immediately instead of
+    starting a thread or downloading inside the request. When the queue is
+    full, submit raises QueueFull so the caller can answer 503.
+
+    The queue itself lives in one process, but a job's status and result are
+    kept in the shared progress store under its job ID: status() answers for
+    jobs accepted by any worker process, and survives restarts. Each record
+    names the queue that accepted the job, and that queue holds an flock on
+    its owner file for as long as its process lives, so jobs lost with a dead
+    process can be found and failed (fail_orphaned_jobs).
+    """
+
+    # Progress store fields reported by status()
+    STATUS_FIELDS = ('progress', 'message', 'download_type', 'filename', 'mime_type',
+                     'download_url', 'artifact_key')
+
+    def __init__(self, workers=DOWNLOAD_WORKERS, max_pending=DOWNLOAD_QUEUE_SIZE, store=None):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.store = store
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        self._jobs = OrderedDict()
+        self._pending = OrderedDict()  # queued job IDs in arrival order
+        self._threads = []
+        self._started = False
+        self.owner = None
+        self._owner_fd = None
+        self._owner_pid = None
+
+    def _start(self):
+        # Worker threads start on first use so importing never spawns threads
+        self._claim_owner()
+        with self._lock:
+            if self._started:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f'download-worker-{i}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._started = True
+
+    def _owner_path(self, owner):
+        directory = os.path.dirname(self.store.path) or '.'
+        return os.path.join(directory, f'{QUEUE_OWNER_PREFIX}{owner}.lock')
+
+    def _claim_owner(self):
+        # One owner per process; a forked child claims its own
+        if not self.store or self._owner_pid == os.getpid():
+            return
+        with self._lock:
+            if self._owner_pid == os.getpid():
+                return
+            owner = f'{os.getpid()}-{uuid.uuid4().hex[:8]}'
+            path = self._owner_path(owner)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            self.owner, self._owner_fd, self._owner_pid = owner, fd, os.getpid()
+
+    def submit(self, fn, *args, description='', job_id=None, **kwargs):
+        """
+        Queue fn(*args, **kwargs) and return its job ID
+
+        Raises:
+            QueueFull if max_pending jobs are already waiting
+        """
+        self._start()
+        job = DownloadJob(job_id or uuid.uuid4().hex, fn, args, kwargs, description)
+        if self.store:
+            # Before the job can start, so the job's own writes come after it
+            self.store.update(job.job_id, queue_owner=self.owner)
+
+        with self._lock:
+            try:
+                self._queue.put_nowait(job)
+            except queue.Full:
+                raise QueueFull(f"Download queue is full ({self.max_pending} jobs waiting)")
+            self._jobs[job.job_id] = job
+            self._pending[job.job_id] = True
+
+        return job.job_id
+
+    def _owner_alive(self, owner):
+        if owner == self.owner:
+            return True
+        try:
+            fd = os.open(self._owner_path(owner), os.O_RDWR)
+        except FileNotFoundError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        finally:
+            os.close(fd)
+        return False
+
+    def fail_orphaned_jobs(self):
+        """
+        Mark jobs whose queue died with its process as failed
+
+        A queued or running job lives only in the memory of the process that
+        accepted it, so after a restart its progress record would wait
+        forever. Jobs resumed from a download journal are handed to a live
+        queue first and are left alone.
+
+        Returns:
+            The number of jobs marked as failed
+        """
+        if not self.store:
+            return 0
+        self._claim_owner()
+
+        failed = 0
+        dead = {}
+        for job_id, record in self.store.unfinished_jobs().items():
+            owner = record.get('queue_owner')
+            if not owner:
+                continue
+            if owner not in dead:
+                dead[owner] = not self._owner_alive(owner)
+            if dead[owner]:
+                self.store.update(job_id, status='error', error='Download was interrupted by a server restart',
+                                  message='Download was interrupted by a server restart')
+                failed += 1
+
+        # Owner files of stopped processes are no longer needed
+        directory = os.path.dirname(self._owner_path(self.owner))
+        for name in os.listdir(directory):
+            if name.startswith(QUEUE_OWNER_PREFIX) and name.endswith('.lock'):
+                owner = name[len(QUEUE_OWNER_PREFIX):-len('.lock')]
+                if dead.get(owner) or (owner not in dead and not self._owner_alive(owner)):
+                    try:
+                        os.unlink(os.path.join(directory, name))
+                    except OSError:
+                        pass
+        if failed:
+            logging.info(f"Marked {failed} download jobs of stopped processes as failed")
+        return failed
+
+    def get(self, job_id):
+        """Return the job with this ID, or None"""
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def position(self, job_id):
+        """Return the 1-based queue position of a waiting job, or 0 if it isn't waiting"""
+        with self._lock:
+            for index, pending_id in enumerate(self._pending):
+                if pending_id == job_id:
+                    return index + 1
+        return 0
+
+    def status(self, job_id):
+        """
+        Return a JSON-ready status dict for a job, or None if unknown
+
+        The status and result come from the progress store; the queue
+        position is only known to the process holding the job, and is 0
+        elsewhere.
+        """
+        job = self.get(job_id)
+        record = self.store.get(job_id) if self.store else None
+        if job is None and record is None:
+            return None
+
+        status = job.to_dict() if job else {'job_id': job_id, 'status': 'queued', 'error': None}
+        if record:
+            status['status'] = record.get('status') or status['status']
+            for field in self.STATUS_FIELDS:
+                if field in record:
+                    status[field] = record[field]
+            if status['status'] == 'error':
+                status['error'] = record.get('error') or record.get('message') or status.get('error')
+        status['queue_position'] = self.position(job_id)
+        return status
+
+    def stats(self):
+        with self._lock:
+            running = sum(1 for job in self._jobs.values() if job.status == 'running')
+            return {
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'pending': len(self._pending),
+                'running': running,
+            }
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                self._pending.pop(job.job_id, None)
+            job.status = 'running'
+            job.started_at = time.time()
+
+            try:
+                job.result = job.fn(*job.args, **job.kwargs)
+                record = self.store.get(job.job_id) if self.store else None
+                if record and record.get('status') == 'error':
+                    # The job reported its failure through the store
+                    job.error = record.get('error') or record.get('message')
+                    job.status = 'error'
+                else:
+                    job.status = 'complete'
+            except Exception as e:
+                logging.error(f"Download job {job.job_id} failed: {str(e)}")
+                job.error = str(e)
+                job.status = 'error'
+                self._record_failure(job)
+            finally:
+                job.finished_at = time.time()
+                self._queue.task_done()
+                self._trim()
+
+    def _record_failure(self, job):
+        # Make sure other processes see the failure even if the job didn't record it
+        if not self.store:
+            return
+        try:
+            record = self.store.get(job.job_id) or {}
+            if record.get('status') != 'error':
+                self.store.update(job.job_id, status='error', error=job.error,
+                                  message=f'Download error: {job.error}')
+        except Exception as e:
+            logging.error(f"Failed to record failure of download job {job.job_id}: {str(e)}")
+
+    def _trim(self):
+        # Forget the oldest finished jobs once the history grows too long
+        with self._lock:
+            finished = [job_id for job_id, job in self._jobs.items()
+                        if job.status in ('complete', 'error')]
+            for job_id in finished[:max(0, len(finished) - FINISHED_JOBS_KEPT)]:
+                del self._jobs[job_id]
+
+
+# Every download entry point in this process submits to this queue
+download_queue = DownloadQueue(store=progress_store)
@@ -0,0 +1,215 @@
+import fcntl
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from storage import scratch_root
+
+# Job scratch directories are named job-<job_id> inside the scratch space
+JOB_DIR_PREFIX = 'job-'
+JOURNAL_FILE = 'journal.json'
+LOCK_FILE = 'lock'
+# How often in-progress byte offsets are written to the journal, in seconds
+PROGRESS_WRITE_INTERVAL = float(os.environ.get("DOWNLOAD_JOURNAL_INTERVAL", 5))
+
+
+def lock_directory(path, blocking=True):
+    """
+    Take the exclusive lock of a scratch directory
+
+    The storage janitor never removes a scratch directory whose lock is held,
+    however long the work in it has stalled.
+
+    Returns:
+        The locked file descriptor, which releases the lock when closed, or
+        None if another process holds the lock and blocking is False
+    """
+    fd = os.open(os.path.join(path, LOCK_FILE), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+class DownloadJournal:
+    """
+    Durable scratch directory and journal of one download job
+
+    Stream files and yt-dlp's .part files live in the job's own directory,
+    which survives a crash, and journal.json records the job parameters and
+    each stream's state and byte offset. A job re-run with its journal skips
+    completed streams, and yt-dlp continues partial ones from their .part
+    files. The job holds an flock on the directory while it runs, so a live
+    job is never claimed by recovery in another process.
+    """
+
+    def __init__(self, job_id, root=None):
+        self.job_id = job_id
+        self.dir = os.path.join(root or scratch_root(), f'{JOB_DIR_PREFIX}{job_id}')
+        self.path = os.path.join(self.dir, JOURNAL_FILE)
+        self.state = {'job_id': job_id, 'params': {}, 'streams': {}}
+        self._mutex = threading.Lock()
+        self._lock_fd = None
+        self._last_write = 0
+
+    @classmethod
+    def open(cls, job_id, params, root=None):
+        """Create (or reopen) the journal of a job and lock it for this process"""
+        journal = cls(job_id, root)
+        os.makedirs(journal.dir, exist_ok=True)
+        journal.lock()
+        if not journal.load():
+            journal.state['params'] = params
+            journal.state['created_at'] = time.time()
+            journal.save()
+        return journal
+
+    def lock(self, blocking=True):
+        """Take the job's exclusive lock; returns False if another process holds it"""
+        if self._lock_fd is not None:
+            return True
+        self._lock_fd = lock_directory(self.dir, blocking)
+        return self._lock_fd is not None
+
+    def unlock(self):
+        if self._lock_fd is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def load(self):
+        """Read the journal from disk; returns False if there is none"""
+        try:
+            with open(self.path) as f:
+                self.state = json.load(f)
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def save(self):
+        """Write the journal atomically and durably"""
+        with self._mutex:
+            data = json.dumps(self.state)
+            self._last_write = time.monotonic()
+        fd, tmp_path = tempfile.mkstemp(dir=self.dir, prefix='.journal-')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        # Make the rename itself durable
+        dir_fd = os.open(self.dir, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+    @property
+    def params(self):
+        return self.state.get('params', {})
+
+    def file(self, name):
+        """Path of a file in the job's scratch directory"""
+        return os.path.join(self.dir, name)
+
+    def stream_complete(self, name):
+        """True if the stream finished in an earlier run and its file is intact"""
+        stream = self.state['streams'].get(name)
+        if not stream or stream.get('status') != 'complete':
+            return False
+        try:
+            return os.path.getsize(stream['file']) == stream['size']
+        except OSError:
+            return False
+
+    def progress_hook(self, name, file_path):
+        """
+        Return a yt-dlp progress hook recording a stream's state in the journal
+
+        Args:
+            name: Stream name ('video', 'audio')
+            file_path: Final path of the stream file (yt-dlp's outtmpl)
+        """
+        def hook(d):
+            if d.get('status') == 'finished':
+                self.complete_stream(name, file_path)
+                return
+            if d.get('status') != 'downloading':
+                return
+            with self._mutex:
+                self.state['streams'][name] = {
+                    'status': 'downloading',
+                    'file': file_path,
+                    'downloaded_bytes': d.get('downloaded_bytes') or 0,
+                    'total_bytes': d.get('total_bytes') or d.get('total_bytes_estimate') or 0,
+                }
+                due = time.monotonic() - self._last_write >= PROGRESS_WRITE_INTERVAL
+            if due:
+                self.save()
+        return hook
+
+    def complete_stream(self, name, file_path):
+        """Record that a stream's file is complete"""
+        with self._mutex:
+            self.state['streams'][name] = {
+                'status': 'complete',
+                'file': file_path,
+                'size': os.path.getsize(file_path),
+            }
+        self.save()
+
+    def record_failure(self, error):
+        """Count a failed run of the job in its journal; returns the number of failed runs"""
+        with self._mutex:
+            failures = self.state.get('failures', 0) + 1
+            self.state['failures'] = failures
+            self.state['last_error'] = str(error)
+        self.save()
+        return failures
+
+    def finish(self):
+        """Delete the job's scratch directory once its result is safe elsewhere"""
+        shutil.rmtree(self.dir, ignore_errors=True)
+        self.unlock()
+
+
+def interrupted_journals(root=None):
+    """
+    Yield the journals of jobs that died before finishing, locked for the caller
+
+    Journals locked by a running job in any process are skipped.
+    """
+    root = root or scratch_root()
+    try:
+        entries = list(os.scandir(root))
+    except FileNotFoundError:
+        return
+
+    for entry in entries:
+        if not entry.name.startswith(JOB_DIR_PREFIX) or not entry.is_dir():
+            continue
+        journal = DownloadJournal(entry.name[len(JOB_DIR_PREFIX):], root)
+        try:
+            if not journal.lock(blocking=False):
+                continue
+        except OSError:
+            continue
+        if not journal.load() or not journal.params:
+            journal.unlock()
+            # A job that is just starting hasn't written its journal yet
+            if time.time() - entry.stat().st_mtime > 60:
+                logging.info(f"Discarding incomplete download journal {entry.name}")
+                shutil.rmtree(journal.dir, ignore_errors=True)
+            continue
+        yield journal
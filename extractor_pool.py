@@ -0,0 +1,126 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# Pool configuration, overridable per deployment through the environment
+POOL_SIZE = int(os.environ.get("EXTRACTOR_POOL_SIZE", 2))
+MAX_JOBS_PER_WORKER = int(os.environ.get("EXTRACTOR_MAX_JOBS_PER_WORKER", 200))
+JOB_TIMEOUT_SECONDS = int(os.environ.get("EXTRACTOR_TIMEOUT", 120))
+COOKIES_FILE = os.environ.get("EXTRACTOR_COOKIES_FILE", "cookies.txt")
+
+# Per-process extractor, created once by _init_worker inside each pool process
+_worker_ydl = None
+
+
+def base_ydl_options(cookies_file=COOKIES_FILE):
+    """Options shared by every extractor, including the cookie jar if present"""
+    opts = {
+        'quiet': True,
+        'no_warnings': True,
+        'skip_download': True,
+    }
+    if cookies_file and os.path.exists(cookies_file):
+        opts['cookiefile'] = cookies_file
+    return opts
+
+
+def _init_worker(cookies_file):
+    """Build the long-lived extractor; runs once per pool process"""
+    global _worker_ydl
+    import yt_dlp
+
+    # Constructing YoutubeDL loads the cookie jar and extractor registry once
+    _worker_ydl = yt_dlp.YoutubeDL(base_ydl_options(cookies_file))
+
+
+def _extract_job(url):
+    """Extract metadata for url with this process's extractor"""
+    info = _worker_ydl.extract_info(url, download=False)
+    # Strip non-picklable internals before the result crosses the process boundary
+    return _worker_ydl.sanitize_info(info)
+
+
+def _ping():
+    return os.getpid()
+
+
+class ExtractorPool:
+    """
+    Pool of pre-warmed yt-dlp extractor processes
+
+    Each worker process builds one YoutubeDL instance (with cookies) at start-up
+    and reuses it for every job, so extractor initialisation and cookie parsing
+    are paid once per worker instead of once per request. Signature and JS
+    player work runs in the workers and never holds the Flask worker's GIL.
+    """
+
+    def __init__(self, size=POOL_SIZE, cookies_file=COOKIES_FILE,
+                 max_jobs_per_worker=MAX_JOBS_PER_WORKER, timeout=JOB_TIMEOUT_SECONDS):
+        self.size = size
+        self.cookies_file = cookies_file
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.timeout = timeout
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            # A pool inherited through fork is unusable in the child
+            if self._executor is not None and self._pid == os.getpid():
+                return self._executor
+
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.size,
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(self.cookies_file,),
+                max_tasks_per_child=self.max_jobs_per_worker or None,
+            )
+            self._pid = os.getpid()
+            return self._executor
+
+    def warm(self):
+        """Start every worker process ahead of the first request"""
+        executor = self._get_executor()
+        futures = [executor.submit(_ping) for _ in range(self.size)]
+        for future in futures:
+            future.result(timeout=self.timeout)
+
+    def extract_info(self, url):
+        """
+        Extract metadata for a URL in one of the pool workers
+
+        Args:
+            url: The video URL
+
+        Returns:
+            The sanitized yt-dlp info dict
+        """
+        try:
+            return self._get_executor().submit(_extract_job, url).result(timeout=self.timeout)
+        except BrokenProcessPool:
+            # A worker died (OOM, segfault in a native extension); rebuild and retry once
+            logging.warning("Extractor pool broken, restarting workers")
+            self.shutdown()
+            return self._get_executor().submit(_extract_job, url).result(timeout=self.timeout)
+
+    def shutdown(self):
+        """Stop the worker processes"""
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self._pid = None
+
+
+# Process-wide pool shared by app and youtube_service
+extractor_pool = ExtractorPool()
+
+
+def extract_info(url):
+    """Extract video metadata (no download) through the shared extractor pool"""
+    return extractor_pool.extract_info(url)
@@ -0,0 +1,405 @@
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+
+import yt_dlp
+
+from download_journal import lock_directory
+from extractor_pool import COOKIES_FILE
+from rate_limiter import youtube_limiter
+from storage import scratch_root
+from video_metadata import get_video_metadata
+
+# "files" downloads both streams to disk and merges afterwards; "pipelined"
+# streams yt-dlp output straight into ffmpeg so muxing overlaps the download
+MERGE_MODE = os.environ.get("DOWNLOAD_MERGE_MODE", "files")
+# Lines of ffmpeg's stderr quoted when a merge fails
+MERGE_ERROR_LINES = 10
+
+# yt-dlp reports codecs as RFC 6381 strings ("mp4a.40.2"); map them to ffmpeg names
+AUDIO_CODEC_ALIASES = {
+    'mp4a': 'aac',
+    'aac': 'aac',
+    'opus': 'opus',
+    'vorbis': 'vorbis',
+    'mp3': 'mp3',
+    'ac-3': 'ac3',
+    'ac3': 'ac3',
+    'ec-3': 'eac3',
+    'eac3': 'eac3',
+    'flac': 'flac',
+    'alac': 'alac',
+}
+
+# Audio codecs each output container can hold as-is; None means anything goes
+CONTAINER_AUDIO_CODECS = {
+    'mp4': {'aac', 'mp3', 'ac3', 'eac3', 'alac', 'flac'},
+    'm4a': {'aac', 'alac'},
+    'mov': {'aac', 'mp3', 'ac3', 'alac'},
+    'webm': {'opus', 'vorbis'},
+    'mkv': None,
+}
+
+# What to transcode to when the source codec doesn't fit the container
+CONTAINER_AUDIO_FALLBACK = {
+    'webm': 'libopus',
+}
+DEFAULT_AUDIO_FALLBACK = 'aac'
+
+# Video codecs (yt-dlp vcodec prefixes) each streaming container can hold
+CONTAINER_VIDEO_CODECS = {
+    'mp4': ('avc1', 'h264', 'hev1', 'hvc1', 'av01', 'vp09'),
+    'webm': ('vp8', 'vp9', 'vp09', 'av01'),
+}
+
+# ffmpeg muxer options for output that is written to a pipe and usable while it grows
+STREAMING_MUXERS = {
+    'mp4': ['-f', 'mp4', '-movflags', 'frag_keyframe+empty_moov+default_base_moof'],
+    'm4a': ['-f', 'mp4', '-movflags', 'frag_keyframe+empty_moov+default_base_moof'],
+    'webm': ['-f', 'webm'],
+    'mkv': ['-f', 'matroska'],
+    'mp3': ['-f', 'mp3'],
+}
+STREAM_MIME_TYPES = {
+    'mp4': 'video/mp4',
+    'm4a': 'audio/mp4',
+    'webm': 'video/webm',
+    'mkv': 'video/x-matroska',
+    'mp3': 'audio/mpeg',
+}
+STREAM_CHUNK_SIZE = 64 * 1024
+# Streams tie up a request worker and an ffmpeg process for their whole length
+STREAM_MAX_CONCURRENT = int(os.environ.get("MEDIA_STREAM_MAX_CONCURRENT", 2))
+stream_slots = threading.BoundedSemaphore(STREAM_MAX_CONCURRENT)
+
+
+def normalize_audio_codec(codec):
+    """Map a yt-dlp codec string to an ffmpeg codec name, or None if unknown"""
+    if not codec or codec == 'none':
+        return None
+    return AUDIO_CODEC_ALIASES.get(codec.lower().split('.')[0])
+
+
+def audio_codec_for_format(info, format_id):
+    """Look up the normalized audio codec of a format in an extraction result"""
+    for f in info.get('formats') or []:
+        if f.get('format_id') == format_id:
+            return normalize_audio_codec(f.get('acodec'))
+    return None
+
+
+def plan_audio_merge(source_codec, container):
+    """
+    Decide whether the audio stream can be copied into the output container
+
+    Args:
+        source_codec: Normalized audio codec of the source stream, or None if unknown
+        container: Output file extension ('mp4', 'webm', ...)
+
+    Returns:
+        A tuple of (path, output_args) where path is 'copy' or 'transcode:<codec>'
+        and output_args are the ffmpeg output options for the merge
+    """
+    allowed = CONTAINER_AUDIO_CODECS.get(container, set())
+    if source_codec and (allowed is None or source_codec in allowed):
+        return 'copy', {'c:v': 'copy', 'c:a': 'copy'}
+
+    target = CONTAINER_AUDIO_FALLBACK.get(container, DEFAULT_AUDIO_FALLBACK)
+    return f'transcode:{target}', {'c:v': 'copy', 'c:a': target, 'strict': 'experimental'}
+
+
+class _StreamFetch:
+    """A yt-dlp subprocess writing one stream to a pipe, with progress parsing"""
+
+    # yt-dlp prints one line per progress update in this shape
+    PROGRESS_PREFIX = 'progress:'
+
+    def __init__(self, info_path, format_id, write_fd, progress_hook=None):
+        self.progress_hook = progress_hook
+        self.errors = []
+
+        cmd = [sys.executable, '-m', 'yt_dlp',
+               '--load-info-json', info_path,
+               '--format', format_id,
+               '--output', '-',
+               '--quiet', '--no-warnings', '--progress', '--newline',
+               '--progress-template',
+               'download:' + self.PROGRESS_PREFIX +
+               '%(progress.downloaded_bytes)s %(progress.total_bytes)s %(progress.total_bytes_estimate)s']
+        if COOKIES_FILE and os.path.exists(COOKIES_FILE):
+            cmd += ['--cookies', COOKIES_FILE]
+
+        youtube_limiter.acquire()
+        self.process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=write_fd,
+                                        stderr=subprocess.PIPE, text=True)
+        self._reader = threading.Thread(target=self._read_stderr, daemon=True)
+        self._reader.start()
+
+    def _read_stderr(self):
+        for line in self.process.stderr:
+            line = line.strip()
+            if not line.startswith(self.PROGRESS_PREFIX):
+                if line:
+                    self.errors.append(line)
+                continue
+
+            if not self.progress_hook:
+                continue
+
+            downloaded, total, estimate = (line[len(self.PROGRESS_PREFIX):].split() + ['NA'] * 3)[:3]
+            try:
+                d = {'status': 'downloading', 'downloaded_bytes': int(float(downloaded))}
+            except ValueError:
+                continue
+            if total not in ('NA', 'None'):
+                d['total_bytes'] = int(float(total))
+            elif estimate not in ('NA', 'None'):
+                d['total_bytes_estimate'] = int(float(estimate))
+            self.progress_hook(d)
+
+    def wait(self):
+        returncode = self.process.wait()
+        self._reader.join()
+        return returncode
+
+    def kill(self):
+        if self.process.poll() is None:
+            self.process.kill()
+
+
+def pipelined_download_and_merge(url, video_format_id, audio_format_id, output_path, work_dir,
+                                 video_progress_hook=None, audio_progress_hook=None,
+                                 output_args=None):
+    """
+    Download video and audio while ffmpeg muxes them, without intermediate files
+
+    Each stream is fetched by its own yt-dlp process writing to a pipe, and
+    ffmpeg reads both pipes directly, so the output is finished moments after
+    the last byte arrives. The shared extraction result is handed to yt-dlp as
+    an info JSON so no extra extraction happens.
+
+    Args:
+        url: The video URL
+        video_format_id: yt-dlp format ID of the video stream
+        audio_format_id: yt-dlp format ID of the audio stream
+        output_path: Where ffmpeg writes the merged file
+        work_dir: Scratch directory for the info JSON
+        video_progress_hook: Optional yt-dlp style progress hook for the video stream
+        audio_progress_hook: Optional yt-dlp style progress hook for the audio stream
+        output_args: Optional dict of extra ffmpeg output options (codec choices)
+
+    Raises:
+        RuntimeError if either fetch or the mux fails; a mux failure is
+        reported with the tail of ffmpeg's stderr even when the fetches then
+        failed on the broken pipe
+    """
+    info_path = os.path.join(work_dir, 'info.json')
+    with open(info_path, 'w') as f:
+        json.dump(get_video_metadata(url).info, f)
+
+    output_args = output_args or {'c:v': 'copy', 'c:a': 'aac', 'strict': 'experimental'}
+
+    video_read, video_write = os.pipe()
+    audio_read, audio_write = os.pipe()
+
+    cmd = ['ffmpeg', '-y', '-loglevel', 'error',
+           '-i', f'pipe:{video_read}', '-i', f'pipe:{audio_read}',
+           '-map', '0:v:0', '-map', '1:a:0']
+    for key, value in output_args.items():
+        cmd += [f'-{key}', str(value)]
+    cmd.append(output_path)
+
+    merger = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                              stderr=subprocess.PIPE, pass_fds=(video_read, audio_read))
+    os.close(video_read)
+    os.close(audio_read)
+
+    fetches = []
+    try:
+        fetches.append(_StreamFetch(info_path, video_format_id, video_write, video_progress_hook))
+        fetches.append(_StreamFetch(info_path, audio_format_id, audio_write, audio_progress_hook))
+    finally:
+        # The child processes hold their own copies of the write ends
+        os.close(video_write)
+        os.close(audio_write)
+
+    # Watch both fetches; the first failure tears the whole pipeline down
+    failed = []
+    merger_lock = threading.Lock()
+    merger_killed = []
+
+    def watch(fetch):
+        if fetch.wait() != 0:
+            failed.append(fetch)
+            for other in fetches:
+                other.kill()
+            with merger_lock:
+                # If ffmpeg has already exited on its own, the fetch most
+                # likely died of the broken pipe and ffmpeg is the culprit
+                if merger.poll() is None:
+                    merger.kill()
+                    merger_killed.append(True)
+        elif fetch.progress_hook:
+            fetch.progress_hook({'status': 'finished'})
+
+    watchers = [threading.Thread(target=watch, args=(fetch,)) for fetch in fetches]
+    for watcher in watchers:
+        watcher.start()
+    for watcher in watchers:
+        watcher.join()
+
+    _, merge_errors = merger.communicate()
+
+    fetch_errors = '; '.join(failed[0].errors[-3:]) if failed else ''
+    if merger.returncode != 0 and not merger_killed:
+        tail = '\n'.join(merge_errors.decode('utf-8', 'replace').strip().splitlines()[-MERGE_ERROR_LINES:])
+        message = f"ffmpeg merge failed (exit code {merger.returncode}): {tail or 'no error output'}"
+        if fetch_errors:
+            message += f" (stream fetch also failed: {fetch_errors})"
+        raise RuntimeError(message)
+    if failed:
+        raise RuntimeError(f"Stream download failed: {fetch_errors or 'yt-dlp exited with an error'}")
+
+    logging.info(f"Pipelined merge finished for {url} -> {output_path}")
+    return output_path
+
+
+def _ffmpeg_args(options):
+    args = []
+    for key, value in options.items():
+        args += [f'-{key}', str(value)]
+    return args
+
+
+def resolve_formats(url, format_spec):
+    """Return the format dicts yt-dlp selects for format_spec from the shared extraction"""
+    info = get_video_metadata(url).info
+    with yt_dlp.YoutubeDL({'format': format_spec, 'quiet': True, 'no_warnings': True}) as ydl:
+        selected = ydl.process_ie_result(dict(info), download=False)
+    return selected.get('requested_formats') or [selected]
+
+
+def plan_stream(url, format_spec, container):
+    """
+    Work out what to fetch and how to mux it for a streamed download
+
+    Args:
+        url: The video URL
+        format_spec: yt-dlp format selector, as chosen by select_download_format
+        container: Requested container ('mp4', 'webm', 'mp3'), or 'audio' to
+            keep the source audio codec in a matching container
+
+    Returns:
+        A tuple of (format_ids, container, output_args). The container may
+        differ from the requested one (mkv) when the selected video codec
+        can't be muxed into it.
+    """
+    formats = resolve_formats(url, format_spec)
+    video = next((f for f in formats if f.get('vcodec') not in (None, 'none')), None)
+    audio = next((f for f in formats if f.get('acodec') not in (None, 'none')), None)
+
+    if container in ('mp3', 'audio') or video is None:
+        source = audio or formats[0]
+        codec = normalize_audio_codec(source.get('acodec'))
+        if container == 'mp3':
+            return [source['format_id']], 'mp3', ['-vn', '-c:a', 'libmp3lame', '-b:a', '192k']
+        container = 'webm' if codec in ('opus', 'vorbis') else 'm4a'
+        _, merge_args = plan_audio_merge(codec, container)
+        return [source['format_id']], container, ['-vn', '-c:a', merge_args['c:a']]
+
+    vcodec = (video.get('vcodec') or '').lower()
+    if not vcodec.startswith(CONTAINER_VIDEO_CODECS.get(container, ())):
+        container = 'mkv'
+    _, merge_args = plan_audio_merge(normalize_audio_codec(audio.get('acodec')) if audio else None, container)
+
+    if audio is None or audio is video:
+        # A single format carrying both streams
+        return [video['format_id']], container, ['-map', '0:v:0', '-map', '0:a:0?'] + _ffmpeg_args(merge_args)
+    return ([video['format_id'], audio['format_id']], container,
+            ['-map', '0:v:0', '-map', '1:a:0'] + _ffmpeg_args(merge_args))
+
+
+def stream_media(url, format_ids, output_args, container, chunk_size=STREAM_CHUNK_SIZE):
+    """
+    Generate the bytes of a download while ffmpeg is still producing them
+
+    The selected formats are fetched by yt-dlp into pipes and ffmpeg writes a
+    streamable layout (fragmented MP4, WebM/Matroska or MP3) to its stdout, so
+    the first bytes reach the client within seconds. Closing the generator
+    (the client went away) stops every process.
+
+    Args:
+        url: The video URL
+        format_ids, output_args, container: As returned by plan_stream
+        chunk_size: Largest chunk yielded at once
+    """
+    work_dir = tempfile.mkdtemp(prefix='stream-', dir=scratch_root())
+    # Keeps the storage janitor away from the directory while the stream lasts
+    lock_fd = lock_directory(work_dir)
+    fetches = []
+    open_fds = [lock_fd]
+    merger = None
+    try:
+        info_path = os.path.join(work_dir, 'info.json')
+        with open(info_path, 'w') as f:
+            json.dump(get_video_metadata(url).info, f)
+
+        pipes = []
+        for _ in format_ids:
+            pipes.append(os.pipe())
+            open_fds.extend(pipes[-1])
+        read_fds = [read_fd for read_fd, _ in pipes]
+        cmd = ['ffmpeg', '-loglevel', 'error']
+        for read_fd in read_fds:
+            cmd += ['-i', f'pipe:{read_fd}']
+        cmd += output_args + STREAMING_MUXERS[container] + ['pipe:1']
+
+        # ffmpeg's stderr goes to a file so a chatty error can't block the pipeline
+        with open(os.path.join(work_dir, 'ffmpeg.log'), 'wb') as log:
+            merger = subprocess.Popen(cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                      stderr=log, pass_fds=read_fds)
+        for read_fd in read_fds:
+            os.close(read_fd)
+            open_fds.remove(read_fd)
+
+        for format_id, (_, write_fd) in zip(format_ids, pipes):
+            fetches.append(_StreamFetch(info_path, format_id, write_fd))
+        # The yt-dlp processes hold their own copies of the write ends
+        for _, write_fd in pipes:
+            os.close(write_fd)
+            open_fds.remove(write_fd)
+
+        output_fd = merger.stdout.fileno()
+        while True:
+            chunk = os.read(output_fd, chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+        failed = [fetch for fetch in fetches if fetch.wait() != 0]
+        if merger.wait() != 0 or failed:
+            with open(os.path.join(work_dir, 'ffmpeg.log'), 'rb') as log:
+                merge_errors = log.read().decode('utf-8', 'replace').strip()
+            fetch_errors = '; '.join(error for fetch in failed for error in fetch.errors[-3:])
+            logging.error(f"Streamed download of {url} ended early: {fetch_errors or merge_errors}")
+        else:
+            logging.info(f"Streamed download of {url} finished")
+
+    finally:
+        for fetch in fetches:
+            fetch.kill()
+        if merger is not None:
+            if merger.poll() is None:
+                merger.kill()
+            merger.stdout.close()
+            merger.wait()
+        for fetch in fetches:
+            fetch.wait()
+        for fd in open_fds:
+            os.close(fd)
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,303 @@
+import json
+import mimetypes
+import os
+import uuid
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote
+
+from flask import Response, request
+from werkzeug.wsgi import ClosingIterator, wrap_file
+
+from storage import DOWNLOAD_DIR
+from storage_manager import storage_manager
+
+# Chunk size for bodies that can't be handed to sendfile
+CHUNK_SIZE = 256 * 1024
+# Range requests asking for more pieces than this get the whole file instead
+MAX_RANGES = int(os.environ.get("MEDIA_MAX_RANGES", 16))
+# Hand finished files to the fronting web server instead of streaming them
+# from a worker: "x-accel" (nginx X-Accel-Redirect), "x-sendfile" (Apache
+# mod_xsendfile, lighttpd) or "none" to serve them from Flask
+OFFLOAD_MODE = os.environ.get("MEDIA_OFFLOAD_MODE", "none").lower()
+# nginx internal location that maps onto DOWNLOAD_DIR, for x-accel
+OFFLOAD_PREFIX = os.environ.get("MEDIA_OFFLOAD_PREFIX", "/protected-downloads/")
+# WSGI servers whose file_wrapper sends exactly Content-Length bytes from the
+# current file offset with sendfile(2), so partial responses stay zero-copy
+ZERO_COPY_SERVERS = ('gunicorn',)
+
+
+def content_etag(path, stat):
+    """
+    Strong ETag for a file
+
+    Artifacts carry the content hash computed when they were stored. Any
+    other file gets a validator built from its inode, size and nanosecond
+    mtime, which changes whenever the file is replaced or rewritten, so no
+    request ever has to hash a file.
+    """
+    try:
+        with open(os.path.splitext(path)[0] + '.json') as f:
+            record = json.load(f)
+        if record.get('sha256') and record.get('size') == stat.st_size:
+            return f'"{record["sha256"]}"'
+    except (OSError, ValueError):
+        pass
+    return f'"{stat.st_ino:x}-{stat.st_size:x}-{stat.st_mtime_ns:x}"'
+
+
+def parse_ranges(header, size):
+    """
+    Parse a Range header into a list of (start, end) byte ranges, end exclusive
+
+    Returns:
+        None if the header should be ignored (absent, malformed or too many
+        ranges), or a possibly empty list of satisfiable ranges, with
+        overlapping and adjacent ranges merged
+    """
+    if not header or not header.startswith('bytes='):
+        return None
+
+    ranges = []
+    for spec in header[len('bytes='):].split(','):
+        spec = spec.strip()
+        if '-' not in spec:
+            return None
+        first, _, last = spec.partition('-')
+        try:
+            if not first:
+                # Suffix range: the last N bytes
+                length = int(last)
+                if length <= 0:
+                    continue
+                start, end = max(0, size - length), size
+            else:
+                start = int(first)
+                end = int(last) + 1 if last else size
+                if last and end <= start:
+                    # An invalid range makes the whole header invalid
+                    return None
+        except ValueError:
+            return None
+        if start >= size:
+            continue
+        ranges.append((start, min(end, size)))
+
+    if len(ranges) > MAX_RANGES:
+        return None
+
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def content_disposition(download_name):
+    """Content-Disposition header value offering download_name as an attachment"""
+    download_name = download_name.replace('\\', '_').replace('"', "'")
+    try:
+        download_name.encode('ascii')
+        return f'attachment; filename="{download_name}"'
+    except UnicodeEncodeError:
+        fallback = download_name.encode('ascii', 'ignore').decode('ascii') or 'download'
+        return f"attachment; filename=\"{fallback}\"; filename*=UTF-8''{quote(download_name)}"
+
+
+class PinnedFile:
+    """
+    Open file that releases its eviction pin when it is closed
+
+    Response bodies are sent with direct_passthrough, so the server closes
+    the body (and through it this file) but never runs the response's
+    call_on_close callbacks. Everything but close is delegated to the file,
+    including fileno, so the server's file_wrapper can still use sendfile.
+    """
+
+    def __init__(self, f, release):
+        self._f = f
+        self._release = release
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+    def close(self):
+        try:
+            self._f.close()
+        finally:
+            self._release()
+
+
+def _read_range(f, start, end):
+    f.seek(start)
+    remaining = end - start
+    while remaining > 0:
+        chunk = f.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        yield chunk
+
+
+def offload_response(path, download_name, mimetype):
+    """
+    Response telling the web server to deliver path itself, or None
+
+    None means the file can't be offloaded (offloading is off, or the file is
+    outside DOWNLOAD_DIR which the web server location covers) and should be
+    served by send_media. The web server then handles ranges and conditional
+    requests; it keeps its own descriptor open, so eviction during the
+    transfer only frees the space once it is done.
+    """
+    if OFFLOAD_MODE not in ('x-accel', 'x-sendfile'):
+        return None
+
+    real_path = os.path.realpath(path)
+    root = os.path.realpath(DOWNLOAD_DIR)
+    if os.path.commonpath([real_path, root]) != root:
+        return None
+
+    headers = {'Content-Disposition': content_disposition(download_name)}
+    if OFFLOAD_MODE == 'x-accel':
+        relative = os.path.relpath(real_path, root).replace(os.sep, '/')
+        headers['X-Accel-Redirect'] = OFFLOAD_PREFIX.rstrip('/') + '/' + quote(relative)
+    else:
+        headers['X-Sendfile'] = real_path
+    return Response(status=200, mimetype=mimetype, headers=headers)
+
+
+def send_media(path, download_name=None, mimetype=None):
+    """
+    Serve a media file with byte ranges and conditional requests
+
+    Supports single and multiple byte ranges (206, multipart/byteranges for
+    several), If-Range and If-None-Match against a strong ETag,
+    and hands whole files and single ranges to the server's sendfile where it
+    can. The file is pinned against storage eviction until the response closes.
+    With MEDIA_OFFLOAD_MODE set, delivery is handed to the web server instead
+    once the request has been authorized by the calling route.
+
+    Args:
+        path: File to serve
+        download_name: File name offered to the browser; defaults to the basename
+        mimetype: Content type; guessed from download_name when omitted
+    """
+    download_name = download_name or os.path.basename(path)
+    mimetype = mimetype or mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+
+    if not os.path.exists(path):
+        return Response('File not found', status=404)
+
+    offloaded = offload_response(path, download_name, mimetype)
+    if offloaded is not None:
+        return offloaded
+
+    release = storage_manager.pin(path)
+    try:
+        f = PinnedFile(open(path, 'rb'), release)
+    except OSError:
+        release()
+        return Response('File not found', status=404)
+
+    try:
+        stat = os.fstat(f.fileno())
+        size = stat.st_size
+        etag = content_etag(path, stat)
+        last_modified = formatdate(stat.st_mtime, usegmt=True)
+    except Exception:
+        f.close()
+        release()
+        raise
+
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': etag,
+        'Last-Modified': last_modified,
+        'Content-Disposition': content_disposition(download_name),
+        'Cache-Control': 'private, max-age=0, must-revalidate',
+    }
+
+    def finish(response):
+        # Bodiless responses (HEAD, 304, 416) are closed through the response
+        response.call_on_close(release)
+        return response
+
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match and (if_none_match.strip() == '*' or
+                          etag in [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]):
+        f.close()
+        return finish(Response(status=304, headers=headers))
+
+    ranges = None
+    if request.method in ('GET', 'HEAD'):
+        ranges = parse_ranges(request.headers.get('Range'), size)
+        if ranges is not None and not _if_range_matches(request.headers.get('If-Range'), etag, stat):
+            # The client's partial copy is stale; send the whole new file
+            ranges = None
+
+    if ranges is not None and not ranges:
+        f.close()
+        headers['Content-Range'] = f'bytes */{size}'
+        return finish(Response(status=416, headers=headers))
+
+    if ranges is None or ranges == [(0, size)]:
+        headers['Content-Length'] = str(size)
+        body = wrap_file(request.environ, f, CHUNK_SIZE)
+        response = Response(body, status=200, mimetype=mimetype, headers=headers, direct_passthrough=True)
+        return finish(response)
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers['Content-Range'] = f'bytes {start}-{end - 1}/{size}'
+        headers['Content-Length'] = str(end - start)
+        server = request.environ.get('SERVER_SOFTWARE', '')
+        if end == size or server.startswith(ZERO_COPY_SERVERS):
+            # The file wrapper sends from the current offset up to Content-Length
+            f.seek(start)
+            body = wrap_file(request.environ, f, CHUNK_SIZE)
+        else:
+            body = ClosingIterator(_read_range(f, start, end), f.close)
+        response = Response(body, status=206, mimetype=mimetype, headers=headers, direct_passthrough=True)
+        return finish(response)
+
+    # Several ranges: a multipart/byteranges body
+    boundary = uuid.uuid4().hex
+    parts = []
+    length = 0
+    for start, end in ranges:
+        part_header = (f'--{boundary}\r\nContent-Type: {mimetype}\r\n'
+                       f'Content-Range: bytes {start}-{end - 1}/{size}\r\n\r\n').encode('ascii')
+        parts.append((part_header, start, end))
+        length += len(part_header) + (end - start) + 2
+    closing = f'--{boundary}--\r\n'.encode('ascii')
+    length += len(closing)
+
+    def generate():
+        for part_header, start, end in parts:
+            yield part_header
+            yield from _read_range(f, start, end)
+            yield b'\r\n'
+        yield closing
+
+    headers['Content-Length'] = str(length)
+    # The file is closed with the body even if the server never starts it
+    response = Response(ClosingIterator(generate(), f.close), status=206, headers=headers, direct_passthrough=True,
+                        content_type=f'multipart/byteranges; boundary={boundary}')
+    return finish(response)
+
+
+def _if_range_matches(if_range, etag, stat):
+    """True when a Range request should be honoured under its If-Range condition"""
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"'):
+        return if_range == etag
+    if if_range.startswith('W/'):
+        # Weak validators never match If-Range
+        return False
+    try:
+        return int(parsedate_to_datetime(if_range).timestamp()) == int(stat.st_mtime)
+    except (TypeError, ValueError):
+        return False
@@ -1,6 +1,7 @@
 from datetime import datetime
 import json
 from app import db
+from transcript_cues import CueTable
 
 class VideoAnalysis(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -13,6 +14,7 @@ class VideoAnalysis(db.Model):
     duration_seconds = db.Column(db.Integer)
     description = db.Column(db.Text)
     transcript = db.Column(db.Text)
+    transcript_cues = db.Column(db.LargeBinary)  # Serialized CueTable mapping transcript offsets to caption times
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
     # Developer-focused fields
@@ -105,6 +107,12 @@ class VideoAnalysis(db.Model):
         except:
             return []
     
+    def get_transcript_cues(self):
+        """Return the transcript's caption timings as a CueTable, or None if there are none"""
+        if not self.transcript_cues:
+            return None
+        return CueTable.from_bytes(self.transcript_cues)
+    
     def get_translations(self):
         """Return translations as Python dict"""
         if not self.translations:
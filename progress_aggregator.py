@@ -0,0 +1,126 @@
+import os
+import threading
+import time
+
+# Upper bound on published progress updates per job, per second
+PROGRESS_UPDATES_PER_SECOND = float(os.environ.get("PROGRESS_UPDATES_PER_SECOND", 2))
+# Weight of the newest throughput sample in the EWMA speed estimate
+THROUGHPUT_EWMA_ALPHA = float(os.environ.get("PROGRESS_EWMA_ALPHA", 0.3))
+
+
+class ProgressAggregator:
+    """
+    Combines yt-dlp progress hook callbacks from one or more streams of a job
+
+    yt-dlp calls progress hooks for every chunk. The hooks returned by hook()
+    only record the latest byte counts; a progress snapshot is computed and
+    handed to publish at most max_updates_per_second times (plus once whenever
+    a stream finishes). Overall progress is weighted by stream size, and the
+    ETA comes from an exponentially weighted moving average of throughput
+    rather than the average since the download started.
+    """
+
+    def __init__(self, publish, streams=(), max_updates_per_second=PROGRESS_UPDATES_PER_SECOND,
+                 ewma_alpha=THROUGHPUT_EWMA_ALPHA):
+        self.publish = publish
+        self.min_interval = 1.0 / max_updates_per_second if max_updates_per_second > 0 else 0
+        self.ewma_alpha = ewma_alpha
+        self._lock = threading.Lock()
+        self._streams = {}
+        for name in streams:
+            self._add_stream(name)
+        self._last_publish = 0.0
+        self._last_sample_time = None
+        self._last_sample_bytes = 0
+        self.speed = None
+
+    def _add_stream(self, name):
+        self._streams[name] = {'downloaded': 0, 'total': 0, 'finished': False}
+
+    def hook(self, stream=None):
+        """
+        Return a yt-dlp progress hook feeding this aggregator
+
+        Args:
+            stream: Name of the stream the hook reports on; when None the
+                stream is taken from the format ID of each callback, which
+                suits a single YoutubeDL downloading merged formats
+        """
+        def progress_hook(d):
+            name = stream or (d.get('info_dict') or {}).get('format_id') or 'default'
+            self.update(name, d)
+        return progress_hook
+
+    def update(self, stream, d):
+        """Record one yt-dlp progress callback and publish if it is time to"""
+        status = d.get('status')
+        if status not in ('downloading', 'finished'):
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            if stream not in self._streams:
+                self._add_stream(stream)
+            state = self._streams[stream]
+
+            downloaded = d.get('downloaded_bytes') or 0
+            total = d.get('total_bytes') or d.get('total_bytes_estimate') or 0
+            if status == 'finished':
+                state['finished'] = True
+                downloaded = max(downloaded, total, state['downloaded'])
+                total = max(total, downloaded)
+            state['downloaded'] = downloaded
+            state['total'] = total
+
+            if status != 'finished' and now - self._last_publish < self.min_interval:
+                return
+
+            self._last_publish = now
+            snapshot = self._snapshot(now)
+
+        self.publish(snapshot)
+
+    def _snapshot(self, now):
+        # Caller must hold the lock
+        downloaded = sum(s['downloaded'] for s in self._streams.values())
+        total = sum(s['total'] for s in self._streams.values())
+
+        # Update the throughput estimate from bytes moved since the last snapshot
+        if self._last_sample_time is not None and now > self._last_sample_time:
+            sample = max(0, downloaded - self._last_sample_bytes) / (now - self._last_sample_time)
+            if self.speed is None:
+                self.speed = sample
+            else:
+                self.speed = self.ewma_alpha * sample + (1 - self.ewma_alpha) * self.speed
+        self._last_sample_time = now
+        self._last_sample_bytes = downloaded
+
+        if all(s['total'] for s in self._streams.values()) and total:
+            # Weight each stream by its size; audio is often a few percent of the bytes
+            progress = downloaded / total * 100
+        elif self._streams:
+            progress = sum(self._stream_percentage(s) for s in self._streams.values()) / len(self._streams)
+        else:
+            progress = 0
+
+        remaining = max(0, total - downloaded)
+        eta = remaining / self.speed if self.speed else None
+
+        snapshot = {
+            'progress': min(100.0, progress),
+            'downloaded_bytes': downloaded,
+            'total_bytes': total,
+            'speed': self.speed or 0,
+            'eta': eta,
+        }
+        for name, state in self._streams.items():
+            snapshot[f'{name}_progress'] = self._stream_percentage(state)
+        return snapshot
+
+    @staticmethod
+    def _stream_percentage(state):
+        if state['finished']:
+            return 100.0
+        if state['total']:
+            return min(100.0, state['downloaded'] / state['total'] * 100)
+        return 0.0
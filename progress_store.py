@@ -0,0 +1,223 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+PROGRESS_DB_PATH = os.environ.get("DOWNLOAD_PROGRESS_PATH",
+                                  os.path.join('instance', 'download_progress.sqlite3'))
+# How often buffered progress updates are written out, in seconds
+FLUSH_INTERVAL_SECONDS = float(os.environ.get("DOWNLOAD_PROGRESS_FLUSH_INTERVAL", 0.5))
+# How long finished jobs stay queryable before they are purged
+FINISHED_TTL_SECONDS = int(os.environ.get("DOWNLOAD_PROGRESS_TTL", 24 * 60 * 60))
+
+FINISHED_STATUSES = ('complete', 'error')
+
+
+class ProgressStore:
+    """
+    Download progress keyed by job ID, shared by every worker process
+
+    Progress lives in a SQLite file so any gunicorn worker can answer a status
+    request for a job running in another worker, and survives restarts. Updates
+    are buffered in memory and written in batches every FLUSH_INTERVAL_SECONDS;
+    a job reaching a finished state is written immediately. Finished jobs are
+    purged after FINISHED_TTL_SECONDS.
+    """
+
+    def __init__(self, path=PROGRESS_DB_PATH, flush_interval=FLUSH_INTERVAL_SECONDS,
+                 finished_ttl=FINISHED_TTL_SECONDS):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.finished_ttl = finished_ttl
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._states = {}  # job_id -> progress dict for jobs written by this process
+        self._owners = {}  # job_id -> owner (session ID) for jobs written by this process
+        self._dirty = set()
+        self._flusher = None
+        self._flusher_pid = None
+        self._last_purge = 0
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS download_progress ("
+            " job_id TEXT PRIMARY KEY,"
+            " owner TEXT,"
+            " status TEXT,"
+            " data TEXT NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " finished_at REAL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS download_progress_owner ON download_progress (owner, updated_at)")
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _ensure_flusher(self):
+        # Started lazily, and again in a forked child where the thread is gone
+        if self._flusher is not None and self._flusher_pid == os.getpid():
+            return
+        self._flusher = threading.Thread(target=self._flush_loop, name='progress-flusher', daemon=True)
+        self._flusher_pid = os.getpid()
+        self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def set(self, job_id, data, owner=None):
+        """Replace the progress of a job"""
+        self._write(job_id, dict(data), owner, replace=True)
+
+    def update(self, job_id, **fields):
+        """Merge fields into the progress of a job"""
+        self._write(job_id, fields, None, replace=False)
+
+    def _write(self, job_id, fields, owner, replace):
+        self._ensure_flusher()
+        with self._lock:
+            if replace or job_id not in self._states:
+                state = {} if replace else (self._read_one(job_id) or {})
+                self._states[job_id] = state
+            state = self._states[job_id]
+            state.update(fields)
+            if owner is not None:
+                self._owners[job_id] = owner
+            self._dirty.add(job_id)
+            finished = state.get('status') in FINISHED_STATUSES
+
+        if finished:
+            self.flush()
+
+    def flush(self):
+        """Write every buffered update in a single transaction"""
+        with self._lock:
+            if not self._dirty:
+                return
+            now = time.time()
+            rows = []
+            for job_id in self._dirty:
+                state = self._states[job_id]
+                status = state.get('status')
+                finished_at = now if status in FINISHED_STATUSES else None
+                rows.append((job_id, self._owners.get(job_id), status,
+                             json.dumps(state), now, finished_at))
+                if finished_at:
+                    # The database copy is authoritative once a job is done
+                    self._states.pop(job_id, None)
+                    self._owners.pop(job_id, None)
+            self._dirty.clear()
+
+        try:
+            conn = self._connect()
+            conn.execute("BEGIN")
+            conn.executemany(
+                "INSERT INTO download_progress (job_id, owner, status, data, updated_at, finished_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT(job_id) DO UPDATE SET"
+                " owner = COALESCE(excluded.owner, download_progress.owner),"
+                " status = excluded.status, data = excluded.data,"
+                " updated_at = excluded.updated_at, finished_at = excluded.finished_at",
+                rows
+            )
+            conn.execute("COMMIT")
+        except sqlite3.Error as e:
+            logging.error(f"Failed to write download progress: {str(e)}")
+            try:
+                self._connect().execute("ROLLBACK")
+            except sqlite3.Error:
+                pass
+
+        if time.time() - self._last_purge > 60:
+            self.purge_finished()
+
+    def _read_one(self, job_id):
+        rows = self._read_many([job_id])
+        return rows.get(job_id)
+
+    def _read_many(self, job_ids):
+        if not job_ids:
+            return {}
+        placeholders = ','.join('?' * len(job_ids))
+        try:
+            rows = self._connect().execute(
+                f"SELECT job_id, data FROM download_progress WHERE job_id IN ({placeholders})",
+                list(job_ids)
+            ).fetchall()
+        except sqlite3.Error as e:
+            logging.error(f"Failed to read download progress: {str(e)}")
+            return {}
+        return {job_id: json.loads(data) for job_id, data in rows}
+
+    def get(self, job_id):
+        """Return the progress dict of a job, or None if unknown"""
+        return self.get_many([job_id]).get(job_id)
+
+    def get_many(self, job_ids):
+        """Return {job_id: progress} for every known job in job_ids"""
+        job_ids = list(dict.fromkeys(job_ids))
+        result = {}
+        with self._lock:
+            for job_id in job_ids:
+                if job_id in self._states:
+                    result[job_id] = dict(self._states[job_id])
+        missing = [job_id for job_id in job_ids if job_id not in result]
+        result.update(self._read_many(missing))
+        return result
+
+    def unfinished_jobs(self):
+        """Return {job_id: progress} for every job that has neither completed nor failed"""
+        self.flush()
+        try:
+            rows = self._connect().execute(
+                "SELECT job_id, data FROM download_progress WHERE finished_at IS NULL"
+            ).fetchall()
+        except sqlite3.Error as e:
+            logging.error(f"Failed to list unfinished download jobs: {str(e)}")
+            return {}
+        return {job_id: json.loads(data) for job_id, data in rows}
+
+    def jobs_for_owner(self, owner, limit=20):
+        """Return the most recently updated job IDs belonging to owner"""
+        self.flush()
+        try:
+            rows = self._connect().execute(
+                "SELECT job_id FROM download_progress WHERE owner = ? ORDER BY updated_at DESC LIMIT ?",
+                (owner, limit)
+            ).fetchall()
+        except sqlite3.Error as e:
+            logging.error(f"Failed to list download jobs: {str(e)}")
+            return []
+        return [row[0] for row in rows]
+
+    def purge_finished(self):
+        """Delete finished jobs older than the TTL and return how many were removed"""
+        self._last_purge = time.time()
+        try:
+            cursor = self._connect().execute(
+                "DELETE FROM download_progress WHERE finished_at IS NOT NULL AND finished_at < ?",
+                (time.time() - self.finished_ttl,)
+            )
+            return cursor.rowcount
+        except sqlite3.Error as e:
+            logging.error(f"Failed to purge download progress: {str(e)}")
+            return 0
+
+
+# Process-wide handle on the shared progress table
+progress_store = ProgressStore()
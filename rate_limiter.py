@@ -0,0 +1,169 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+# Budget for outbound YouTube calls, overridable per deployment
+RATE_PER_SECOND = float(os.environ.get("YOUTUBE_RATE_LIMIT", 5))
+BURST = float(os.environ.get("YOUTUBE_RATE_BURST", 10))
+# "process" limits each worker on its own, "node" shares one budget between
+# every worker process on the machine through a SQLite file
+SCOPE = os.environ.get("YOUTUBE_RATE_LIMIT_SCOPE", "process")
+NODE_STATE_PATH = os.environ.get("YOUTUBE_RATE_LIMIT_PATH",
+                                 os.path.join('instance', 'rate_limiter.sqlite3'))
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket limiter
+
+    Callers reserve tokens up front, so the bucket can go negative; a caller
+    that pushes it below zero sleeps for exactly the time needed to pay the
+    debt back. This keeps waiting callers in arrival order without a queue.
+    """
+
+    def __init__(self, rate=RATE_PER_SECOND, burst=BURST):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self.acquisitions = 0
+        self.throttled = 0
+        self.waiting = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _reserve(self, tokens):
+        """Take tokens from the bucket and return how long the caller must wait"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            return max(0.0, -self._tokens / self.rate)
+
+    def acquire(self, tokens=1):
+        """
+        Block until tokens are available
+
+        Returns:
+            The number of seconds spent waiting
+        """
+        if self.rate <= 0:
+            return 0.0
+
+        wait = self._reserve(tokens)
+        if wait > 0:
+            with self._metrics_lock:
+                self.waiting += 1
+            try:
+                time.sleep(wait)
+            finally:
+                with self._metrics_lock:
+                    self.waiting -= 1
+
+        with self._metrics_lock:
+            self.acquisitions += 1
+            if wait > 0:
+                self.throttled += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+        return wait
+
+    def stats(self):
+        """Return limiter configuration and queue wait metrics"""
+        with self._metrics_lock:
+            return {
+                'scope': 'process',
+                'rate': self.rate,
+                'burst': self.burst,
+                'acquisitions': self.acquisitions,
+                'throttled': self.throttled,
+                'waiting': self.waiting,
+                'total_wait_seconds': round(self.total_wait, 3),
+                'avg_wait_seconds': round(self.total_wait / self.acquisitions, 3) if self.acquisitions else 0,
+                'max_wait_seconds': round(self.max_wait, 3),
+            }
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    Token bucket whose state lives in a SQLite file shared by every worker
+
+    The reservation runs inside an immediate transaction, so all processes on
+    the node draw from the same budget. Falls back to the in-process bucket if
+    the file cannot be used.
+    """
+
+    def __init__(self, rate=RATE_PER_SECOND, burst=BURST, path=NODE_STATE_PATH, name='youtube'):
+        super().__init__(rate, burst)
+        self.path = path
+        self.name = name
+        self._local = threading.local()
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS token_buckets ("
+            " name TEXT PRIMARY KEY,"
+            " tokens REAL NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _reserve(self, tokens):
+        try:
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = conn.execute(
+                    "SELECT tokens, updated_at FROM token_buckets WHERE name = ?",
+                    (self.name,)
+                ).fetchone()
+                available = self.burst if row is None else min(
+                    self.burst, row[0] + (now - row[1]) * self.rate)
+                available -= tokens
+                conn.execute(
+                    "INSERT OR REPLACE INTO token_buckets (name, tokens, updated_at) VALUES (?, ?, ?)",
+                    (self.name, available, now)
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            return max(0.0, -available / self.rate)
+        except sqlite3.Error as e:
+            logging.warning(f"Node-wide rate limiter unavailable, using process bucket: {str(e)}")
+            return super()._reserve(tokens)
+
+    def stats(self):
+        stats = super().stats()
+        stats['scope'] = 'node'
+        return stats
+
+
+def build_limiter():
+    """Create the limiter configured by YOUTUBE_RATE_LIMIT_SCOPE"""
+    if SCOPE == 'node':
+        return SharedTokenBucket()
+    return TokenBucket()
+
+
+# Every outbound call to YouTube (metadata, streams, transcripts, subtitles)
+# draws from this bucket
+youtube_limiter = build_limiter()
@@ -1,16 +1,25 @@
 import logging
 import json
-import re
 from datetime import datetime
 from urllib.parse import urlparse, parse_qs
-from flask import render_template, request, redirect, url_for, flash, session, jsonify, send_file, make_response
+from flask import render_template, request, redirect, url_for, flash, session, jsonify, send_file, make_response, Response
 import io
 import os
 import tempfile
+import uuid
 
 from app import app, db
 from models import VideoAnalysis
 from youtube_service import get_video_info, get_video_transcript, get_video_description, download_video, get_video_formats
+from youtube_service import get_video_transcript_with_cues
+from youtube_service import download_file_name, select_download_format
+from artifact_cache import artifact_cache, artifact_key
+from download_jobs import QueueFull, download_queue
+from progress_store import progress_store
+from media_merge import STREAM_MIME_TYPES, plan_stream, stream_media, stream_slots
+from media_response import content_disposition, send_media
+from transcript_cleaner import clean_transcript
+from video_metadata import get_video_metadata, video_url
 from utils import generate_embed_code, format_timestamp, format_duration, format_view_count
 
 # Define placeholder functions to replace the GPT service functionality
@@ -42,6 +51,88 @@ def analyze_creator_content(transcript, title="", duration_seconds=0):
         "voiceover_script": ""
     }
 
+def video_download_key(video_id, format_type='mp4', resolution='720p', video_format_id=None, audio_format_id=None):
+    """
+    Artifact cache key of a youtube_service.download_video request
+    """
+    # The resolution only picks the formats when they aren't given explicitly
+    selector = 'explicit' if video_format_id and audio_format_id else resolution
+    return artifact_key(video_id, video_format_id, audio_format_id, format_type,
+                        postprocessing=f'download_video:{selector}')
+
+def run_video_download(job_id, video_id, **download_options):
+    """
+    Queue worker body for youtube_service.download_video that records its progress
+
+    Progress and the outcome go to the shared progress store under job_id, so
+    any worker process can stream or serve the job. The file is kept in the
+    artifact cache, so an identical request is served from disk.
+    """
+    progress_store.update(job_id, status='downloading', message='Downloading...')
+    
+    def progress_callback(progress_data):
+        if progress_data.get('status') == 'error':
+            return
+        progress_store.update(
+            job_id,
+            progress=progress_data.get('progress', 0),
+            message='Processing...' if progress_data.get('status') == 'finished' else 'Downloading...'
+        )
+    
+    def produce(work_dir):
+        download_info = download_video(video_id, progress_callback=progress_callback, work_dir=work_dir,
+                                       **download_options)
+        if not download_info:
+            raise RuntimeError('Download failed')
+        return download_info
+    
+    key = video_download_key(video_id, **download_options)
+    try:
+        download_info = artifact_cache.get_or_produce(key, produce)
+    except Exception as e:
+        logging.error(f"Error downloading video {video_id}: {str(e)}")
+        progress_store.update(job_id, status='error', message='Download failed', error=str(e))
+        # Let the download queue record the job as failed too
+        raise
+    
+    progress_store.update(
+        job_id,
+        status='complete',
+        progress=100,
+        message='Download complete',
+        filename=download_info[1],
+        mime_type=download_info[2],
+        artifact_key=key,
+        download_url=f'/download_artifact/{key}'
+    )
+    return download_info
+
+def queue_video_download(video_id, description, **download_options):
+    """
+    Submit a download_video job to the download queue
+
+    Returns:
+        The job ID; raises QueueFull if the queue cannot take another job
+    """
+    job_id = uuid.uuid4().hex
+    progress_store.set(job_id, {
+        'status': 'queued',
+        'progress': 0,
+        'message': 'Waiting in download queue...',
+        'download_type': download_options.get('format_type', 'mp4')
+    }, owner=session.get('session_id'))
+    
+    try:
+        download_queue.submit(
+            run_video_download, job_id, video_id,
+            description=description, job_id=job_id, **download_options
+        )
+    except QueueFull:
+        progress_store.update(job_id, status='error', message='Download queue is full')
+        raise
+    
+    return job_id
+
 # Add template context processors
 @app.context_processor
 def utility_processor():
@@ -112,7 +203,7 @@ def analyze():
             return redirect(url_for('index'))
         
         # Get video transcript
-        transcript = get_video_transcript(video_id)
+        transcript, transcript_cues = get_video_transcript_with_cues(video_id)
         
         # Check if transcript is an error message (rather than None)
         is_error_message = transcript and transcript.startswith(("No transcript", "Unable to retrieve"))
@@ -158,7 +249,8 @@ def analyze():
             sentiment=analysis_result.get('sentiment', 0),
             duration_seconds=video_info.get('duration_seconds', 0),
             description=description,
-            transcript=transcript
+            transcript=transcript,
+            transcript_cues=transcript_cues.to_bytes() if transcript_cues else None
         )
         
         # Add specialized analysis based on the selected type
@@ -294,6 +386,7 @@ def search_transcript(analysis_id):
         # Find all occurrences (case insensitive)
         import re
         matches = list(re.finditer(re.escape(query), transcript, re.IGNORECASE))
+        cues = analysis.get_transcript_cues()
         
         # Create snippets around each match
         for match in matches:
@@ -309,14 +402,18 @@ def search_transcript(analysis_id):
                 flags=re.IGNORECASE
             )
             
-            # Estimate timestamp based on position in transcript
-            # This is approximate since we don't have actual timestamps
-            position_ratio = match.start() / len(transcript)
-            estimated_seconds = int(position_ratio * (analysis.duration_seconds or 0))
+            if cues:
+                # Start of the caption cue the match is in
+                seconds = int(cues.timestamp_at(match.start()))
+            else:
+                # Older analyses have no caption timings; estimate from the
+                # position in the transcript
+                position_ratio = match.start() / len(transcript)
+                seconds = int(position_ratio * (analysis.duration_seconds or 0))
             
             results.append({
                 'snippet': snippet,
-                'timestamp': estimated_seconds
+                'timestamp': seconds
             })
     
     return render_template('search_results.html', 
@@ -432,36 +529,24 @@ def export_analysis(analysis_id, format):
         video_format_id = request.args.get('video_format_id')
         audio_format_id = request.args.get('audio_format_id')
         
-        # Basic progress tracking function to log progress (not used in this route)
-        def progress_callback(progress_data):
-            logging.debug(f"Download progress: {progress_data}")
-        
-        # Use the enhanced download_video function to get the video/audio
-        download_info = download_video(
-            analysis.video_id, 
-            format_type=format, 
-            resolution=resolution,
-            video_format_id=video_format_id,
-            audio_format_id=audio_format_id,
-            progress_callback=progress_callback
-        )
-        
-        if not download_info:
-            flash(f'Failed to download video in {format} format', 'danger')
+        # Queue the download; the job page serves the file once it is ready
+        try:
+            job_id = queue_video_download(
+                analysis.video_id, 
+                f'{format} export of {analysis.video_id}',
+                format_type=format, 
+                resolution=resolution,
+                video_format_id=video_format_id,
+                audio_format_id=audio_format_id
+            )
+        except QueueFull:
+            flash('The download queue is full, please try again in a few minutes', 'warning')
             if is_creator_content:
                 return redirect(url_for('creator_result', analysis_id=analysis_id))
             else:
                 return redirect(url_for('result', analysis_id=analysis_id))
         
-        file_path, file_name, mime_type = download_info
-        
-        # Send the file
-        return send_file(
-            file_path,
-            as_attachment=True,
-            download_name=file_name,
-            mimetype=mime_type
-        )
+        return redirect(url_for('download_job_file', job_id=job_id))
         
     else:
         # Default redirect based on content type
@@ -472,81 +557,6 @@ def export_analysis(analysis_id, format):
         else:
             return redirect(url_for('result', analysis_id=analysis_id))
 
-# Define a function to clean transcript text
-def clean_transcript(transcript):
-    """
-    Clean transcript text by removing WEBVTT markers, timestamps, and formatting
-    
-    Args:
-        transcript: Raw transcript text
-        
-    Returns:
-        Cleaned transcript text
-    """
-    if not transcript:
-        return ""
-    
-    # Dictionary to track unique content
-    unique_content = {}
-    
-    # Remove WEBVTT header and metadata
-    lines = transcript.split('\n')
-    cleaned_lines = []
-    
-    for line in lines:
-        # Skip WEBVTT headers and metadata
-        if any(keyword in line for keyword in ['WEBVTT', 'Kind:', 'Language:']):
-            continue
-            
-        # Skip timestamp lines (they contain --> format)
-        if '-->' in line:
-            continue
-            
-        # Skip empty numeric lines (usually indices)
-        if line.strip().isdigit():
-            continue
-            
-        # Skip any line with line percentage format (like line:76%)
-        if re.search(r'line:\d+%', line):
-            continue
-            
-        # Skip alignment and position markers
-        if any(marker in line for marker in ['align:', 'position:']):
-            continue
-        
-        # Clean HTML entities and special formatting
-        cleaned_line = line
-        
-        # Replace HTML entities
-        cleaned_line = cleaned_line.replace('&gt;', '>')
-        cleaned_line = cleaned_line.replace('&lt;', '<')
-        cleaned_line = cleaned_line.replace('&amp;', '&')
-        
-        # Remove angle brackets (often used for speaker identification)
-        cleaned_line = re.sub(r'>>>|>>|\[\[.*?\]\]|\[.*?\]', '', cleaned_line)
-        
-        # Remove Reporter: and similar tags
-        cleaned_line = re.sub(r'(Reporter|Speaker|Host|Narrator):\s*', '', cleaned_line)
-        
-        # Trim whitespace
-        cleaned_line = cleaned_line.strip()
-        
-        # Only add non-empty lines that we haven't seen before
-        if cleaned_line and cleaned_line not in unique_content:
-            unique_content[cleaned_line] = True
-            cleaned_lines.append(cleaned_line)
-    
-    # Join the unique lines
-    cleaned_text = '\n'.join(cleaned_lines)
-    
-    # Add paragraph breaks for readability (after sentence-ending punctuation)
-    cleaned_text = re.sub(r'([.!?])\s+', r'\1\n\n', cleaned_text)
-    
-    # Clean up any remaining multiple newlines
-    cleaned_text = re.sub(r'\n{3,}', '\n\n', cleaned_text)
-    
-    return cleaned_text.strip()
-
 @app.route('/api/video/<video_id>', methods=['GET'])
 def api_video(video_id):
     """
@@ -668,7 +678,7 @@ def api_dev_summary(video_id):
             }), 404
         
         # Get video transcript
-        transcript = get_video_transcript(video_id)
+        transcript, transcript_cues = get_video_transcript_with_cues(video_id)
         
         # Check if transcript is an error message
         is_error_message = transcript and transcript.startswith(("No transcript", "Unable to retrieve"))
@@ -702,6 +712,7 @@ def api_dev_summary(video_id):
             duration_seconds=video_info.get('duration_seconds', 0),
             description=video_info.get('description', ''),
             transcript=transcript,
+            transcript_cues=transcript_cues.to_bytes() if transcript_cues else None,
             is_dev_content=dev_analysis.get('is_dev_content', False),
             code_snippets=json.dumps(dev_analysis.get('code_snippets', [])),
             dev_tools=json.dumps(dev_analysis.get('dev_tools', [])),
@@ -790,7 +801,7 @@ def api_creator_summary(video_id):
             }), 404
         
         # Get video transcript
-        transcript = get_video_transcript(video_id)
+        transcript, transcript_cues = get_video_transcript_with_cues(video_id)
         
         # Check if transcript is an error message
         is_error_message = transcript and transcript.startswith(("No transcript", "Unable to retrieve"))
@@ -822,7 +833,8 @@ def api_creator_summary(video_id):
             sentiment=analysis_result.get('sentiment', 0),
             duration_seconds=video_info.get('duration_seconds', 0),
             description=video_info.get('description', ''),
-            transcript=transcript
+            transcript=transcript,
+            transcript_cues=transcript_cues.to_bytes() if transcript_cues else None
         )
         
         # Creator-focused analysis
@@ -961,41 +973,83 @@ def api_download_video(video_id):
     video_format_id = data.get('video_format_id')
     audio_format_id = data.get('audio_format_id')
     
-    # Download function does not include progress tracking yet
-    download_info = download_video(
-        video_id, 
-        format_type=format_type, 
-        resolution=resolution,
-        video_format_id=video_format_id,
-        audio_format_id=audio_format_id
-    )
-    
-    if not download_info:
+    # Queue the download and return straight away
+    try:
+        job_id = queue_video_download(
+            video_id, 
+            f'{format_type} download of {video_id}',
+            format_type=format_type, 
+            resolution=resolution,
+            video_format_id=video_format_id,
+            audio_format_id=audio_format_id
+        )
+    except QueueFull as e:
         return jsonify({
             'success': False,
-            'message': f'Failed to download video in {format_type} format'
-        }), 500
+            'message': str(e)
+        }), 503
     
-    file_path, file_name, mime_type = download_info
-    
-    # Return success with information about the download
-    # The actual file will be served by a separate endpoint
+    # The file is served by a separate endpoint once the job completes
     return jsonify({
         'success': True,
-        'file_name': file_name,
-        'mime_type': mime_type,
-        'download_url': url_for('download_file', video_id=video_id, file_name=file_name)
-    })
+        'job_id': job_id,
+        'queue_position': download_queue.position(job_id),
+        'status_url': url_for('api_download_status', job_id=job_id),
+        'progress_stream_url': url_for('stream_download_progress', job_id=job_id),
+        'download_url': url_for('download_job_file', job_id=job_id)
+    }), 202
+
+@app.route('/api/download/status/<job_id>')
+def api_download_status(job_id):
+    """
+    API endpoint to check a queued download job
+    """
+    status = download_queue.status(job_id)
+    if status is None:
+        return jsonify({'error': 'Unknown download job'}), 404
+    
+    if status['status'] == 'complete':
+        if status.get('download_url'):
+            status['file_name'] = status.get('filename')
+        else:
+            status['status'] = 'error'
+            status['error'] = 'Download failed'
+    
+    return jsonify(status)
+
+@app.route('/download/job/<job_id>')
+def download_job_file(job_id):
+    """
+    Serve the file produced by a download job, or its status while it is queued or running
+    """
+    status = download_queue.status(job_id)
+    if status is None:
+        return jsonify({'error': 'Unknown download job'}), 404
+    
+    if status['status'] == 'error':
+        return jsonify({'error': status.get('error') or 'Download failed'}), 500
+    
+    if status['status'] != 'complete':
+        # Browsers following this link reload it until the file is ready
+        response = jsonify(status)
+        response.status_code = 202
+        response.headers['Retry-After'] = '5'
+        response.headers['Refresh'] = '5'
+        return response
+    
+    artifact = artifact_cache.lookup(status['artifact_key']) if status.get('artifact_key') else None
+    if artifact is None:
+        return jsonify({'error': 'The downloaded file is no longer available'}), 410
+    
+    file_path, file_name, mime_type = artifact
+    return send_media(file_path, download_name=file_name, mimetype=mime_type)
     
 @app.route('/download/file/<video_id>/<file_name>')
 def download_file(video_id, file_name):
     """
     Serve a downloaded file to the user
     """
-    # This is a simplified version - in reality, we'd need to store the file path
-    # Potentially in a database or a temporary session variable
-    
-    # For now, we'll re-download the file based on the format extension
+    # Work out which download the file name refers to from its extension
     format_type = 'mp4'
     resolution = '720p'
     
@@ -1008,19 +1062,75 @@ def download_file(video_id, file_name):
     if request.args.get('resolution'):
         resolution = request.args.get('resolution')
     
-    # Download the file again (not ideal, but works for demo)
-    download_info = download_video(video_id, format_type=format_type, resolution=resolution)
+    # Serve it straight from disk if this download was already produced
+    artifact = artifact_cache.lookup(video_download_key(video_id, format_type=format_type, resolution=resolution))
+    if artifact:
+        file_path, download_name, mime_type = artifact
+        return send_media(file_path, download_name=download_name, mimetype=mime_type)
     
-    if not download_info:
-        flash(f'Failed to download video', 'danger')
+    # Otherwise produce it through the queue; the job page serves it when ready
+    try:
+        job_id = queue_video_download(
+            video_id, f'{format_type} download of {video_id}',
+            format_type=format_type, resolution=resolution
+        )
+    except QueueFull:
+        flash('The download queue is full, please try again in a few minutes', 'warning')
         return redirect(url_for('result', analysis_id=request.args.get('analysis_id', 1)))
     
-    file_path, _, mime_type = download_info
+    return redirect(url_for('download_job_file', job_id=job_id))
+
+@app.route('/download/stream/<video_id>')
+def stream_download(video_id):
+    """
+    Stream a download to the user while it is still being produced
+    
+    Takes the same format_type, resolution, video_format_id and audio_format_id
+    query parameters as /api/download. The browser starts saving within
+    seconds instead of waiting for the download and merge to finish.
+    """
+    format_type = request.args.get('format_type', 'mp4').lower()
+    resolution = request.args.get('resolution', '720p')
+    video_format_id = request.args.get('video_format_id')
+    audio_format_id = request.args.get('audio_format_id')
+    
+    # A finished identical download is served from disk instead
+    artifact = artifact_cache.lookup(video_download_key(
+        video_id, format_type=format_type, resolution=resolution,
+        video_format_id=video_format_id, audio_format_id=audio_format_id
+    ))
+    if artifact:
+        file_path, download_name, mime_type = artifact
+        return send_media(file_path, download_name=download_name, mimetype=mime_type)
     
-    # Send the file
-    return send_file(
-        file_path,
-        as_attachment=True,
-        download_name=file_name,
-        mimetype=mime_type
+    format_spec, extension, _ = select_download_format(format_type, resolution, video_format_id, audio_format_id)
+    url = video_url(video_id)
+    try:
+        metadata = get_video_metadata(url)
+        format_ids, container, output_args = plan_stream(
+            url, format_spec, 'audio' if format_type == 'audio' else extension)
+    except Exception as e:
+        logging.error(f"Error preparing stream for {video_id}: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': f'Could not prepare the download: {str(e)}'
+        }), 500
+    
+    if not stream_slots.acquire(blocking=False):
+        return jsonify({
+            'success': False,
+            'message': 'Too many streamed downloads in progress, please try again shortly'
+        }), 503
+    
+    download_name = f"{download_file_name(metadata.title)}.{container}"
+    response = Response(
+        stream_media(url, format_ids, output_args, container),
+        mimetype=STREAM_MIME_TYPES[container],
+        headers={
+            'Content-Disposition': content_disposition(download_name),
+            'Cache-Control': 'no-store',
+            'X-Accel-Buffering': 'no'
+        }
     )
+    response.call_on_close(stream_slots.release)
+    return response
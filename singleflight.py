@@ -0,0 +1,97 @@
+import functools
+import threading
+
+
+class _Call:
+    """A single in-flight call whose outcome is shared with every waiter"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key into one execution
+
+    The first caller for a key runs the function; callers arriving while it is
+    still running block until it finishes and receive the same return value,
+    or the same exception re-raised. Nothing is remembered once the call
+    completes, so this complements rather than replaces the metadata caches.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executions = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) unless a call for key is already in flight"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                call.waiters += 1
+                self.coalesced += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self.executions += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn(*args, **kwargs)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+        return call.result
+
+    def in_flight(self):
+        """Return the number of keys currently being executed"""
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self):
+        """Return execution and coalescing counters"""
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'executions': self.executions,
+                'coalesced': self.coalesced,
+            }
+
+
+# Shared by every extraction entry point in this process
+extraction_group = SingleFlight()
+
+
+def single_flight(key_func, group=None):
+    """
+    Decorator that coalesces concurrent calls producing the same key
+
+    Args:
+        key_func: Called with the wrapped function's arguments; returns the
+            coalescing key (typically "<operation>:<video id>")
+        group: Optional SingleFlight instance, defaults to extraction_group
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            flight = group or extraction_group
+            return flight.do(key_func(*args, **kwargs), fn, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,83 @@
+import errno
+import hashlib
+import os
+import shutil
+import tempfile
+
+# Finished downloads are served from here
+DOWNLOAD_DIR = os.environ.get("DOWNLOAD_DIR", os.path.join('static', 'downloads'))
+# Scratch space for in-progress downloads. It lives inside DOWNLOAD_DIR by
+# default so finalizing a file is a rename on the same filesystem, not a copy
+SCRATCH_DIR = os.environ.get("DOWNLOAD_SCRATCH_DIR", os.path.join(DOWNLOAD_DIR, '.scratch'))
+
+
+def scratch_root():
+    """Return the scratch directory, creating it if needed"""
+    os.makedirs(SCRATCH_DIR, exist_ok=True)
+    return SCRATCH_DIR
+
+
+def download_dir():
+    """Return the download directory, creating it if needed"""
+    os.makedirs(DOWNLOAD_DIR, exist_ok=True)
+    return DOWNLOAD_DIR
+
+
+def file_sha256(path):
+    """Return the hex SHA-256 digest of a file's content"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def finalize_file(src, dst, keep_source=False):
+    """
+    Atomically publish a finished file at dst
+
+    The file is renamed into place (or hardlinked when keep_source is set), so
+    readers only ever see a complete file and no data is copied. If src is on
+    another filesystem it is copied to a temporary name next to dst first and
+    then renamed, which keeps the publish atomic.
+
+    Args:
+        src: Path of the finished file in scratch space
+        dst: Final path
+        keep_source: Leave src in place (hardlink instead of rename)
+
+    Returns:
+        dst
+    """
+    dst_dir = os.path.dirname(dst) or '.'
+    os.makedirs(dst_dir, exist_ok=True)
+
+    try:
+        if keep_source:
+            # os.link refuses to overwrite, so link to a temporary name first
+            fd, tmp_path = tempfile.mkstemp(dir=dst_dir, prefix='.link-')
+            os.close(fd)
+            os.unlink(tmp_path)
+            os.link(src, tmp_path)
+            os.replace(tmp_path, dst)
+        else:
+            os.replace(src, dst)
+        return dst
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+    # Cross-device: copy next to the destination, then rename into place
+    fd, tmp_path = tempfile.mkstemp(dir=dst_dir, prefix='.copy-')
+    try:
+        with os.fdopen(fd, 'wb') as out, open(src, 'rb') as f:
+            shutil.copyfileobj(f, out, 1024 * 1024)
+        os.replace(tmp_path, dst)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+    if not keep_source:
+        os.unlink(src)
+    return dst
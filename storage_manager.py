@@ -0,0 +1,320 @@
+import fcntl
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+from artifact_cache import ARTIFACT_DIR, artifact_cache
+from download_journal import LOCK_FILE
+from storage import DOWNLOAD_DIR, SCRATCH_DIR
+
+# Total bytes finished downloads may occupy before the least valuable are evicted
+QUOTA_BYTES = int(os.environ.get("DOWNLOAD_QUOTA_BYTES", 10 * 1024 ** 3))
+# Eviction stops once usage is below this fraction of the quota
+LOW_WATERMARK = float(os.environ.get("DOWNLOAD_QUOTA_LOW_WATERMARK", 0.9))
+# How often the janitor runs, in seconds
+JANITOR_INTERVAL_SECONDS = int(os.environ.get("DOWNLOAD_JANITOR_INTERVAL", 300))
+# Scratch directories untouched for this long belong to dead downloads
+ORPHAN_MAX_AGE_SECONDS = int(os.environ.get("DOWNLOAD_ORPHAN_MAX_AGE", 6 * 60 * 60))
+
+# Leftovers of interrupted atomic writes in the storage directories
+TEMP_FILE_PREFIXES = ('.record-', '.link-', '.copy-')
+
+
+class StorageManager:
+    """
+    Keeps download storage under a byte quota and cleans up after dead jobs
+
+    Finished files (artifacts and legacy files in DOWNLOAD_DIR) are evicted
+    when usage exceeds the quota, oldest and largest first: each file is
+    scored by idle time times size. A file being served holds a shared flock,
+    which eviction never breaks, so this is safe across worker processes. A
+    background janitor also removes scratch directories and temporary files
+    left behind by crashed downloads, and reports what it reclaimed.
+    """
+
+    def __init__(self, quota_bytes=QUOTA_BYTES, low_watermark=LOW_WATERMARK,
+                 interval=JANITOR_INTERVAL_SECONDS, orphan_max_age=ORPHAN_MAX_AGE_SECONDS):
+        self.quota_bytes = quota_bytes
+        self.low_watermark = low_watermark
+        self.interval = interval
+        self.orphan_max_age = orphan_max_age
+        self._lock = threading.Lock()
+        self._janitor = None
+        self._janitor_pid = None
+        self.usage_bytes = 0
+        self.reclaimed_bytes = 0
+        self.evicted_files = 0
+        self.orphans_removed = 0
+        self.janitor_runs = 0
+        self.last_run = None
+
+    def start(self):
+        """Start the janitor thread unless it is already running in this process"""
+        if self._janitor is not None and self._janitor_pid == os.getpid():
+            return
+        self._janitor = threading.Thread(target=self._janitor_loop, name='storage-janitor', daemon=True)
+        self._janitor_pid = os.getpid()
+        self._janitor.start()
+
+    def _janitor_loop(self):
+        while True:
+            try:
+                self.run_janitor()
+            except Exception as e:
+                logging.error(f"Storage janitor failed: {str(e)}")
+            time.sleep(self.interval)
+
+    def run_janitor(self):
+        """Remove orphaned scratch data, then enforce the quota"""
+        self.remove_orphans()
+        self.enforce_quota()
+        with self._lock:
+            self.janitor_runs += 1
+            self.last_run = time.time()
+
+    def pin(self, path):
+        """
+        Protect a file from eviction while it is being served
+
+        Returns:
+            A callable that releases the pin; calling it again does nothing,
+            and it is a no-op if the file is gone
+        """
+        self.start()
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return lambda: None
+
+        fcntl.flock(fd, fcntl.LOCK_SH)
+        self._touch(path)
+        pinned = [fd]
+
+        def release():
+            if not pinned:
+                return
+            fd = pinned.pop()
+            try:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+            finally:
+                os.close(fd)
+        return release
+
+    def after_store(self, path):
+        """Called when a new artifact lands; evicts older ones if it pushed usage over quota"""
+        self.start()
+        self.enforce_quota()
+
+    @staticmethod
+    def _record_path(path):
+        return os.path.splitext(path)[0] + '.json'
+
+    def _touch(self, path):
+        # Artifact records carry the last-use time; other files get only their
+        # atime bumped, since their mtime is part of the ETag they are served with
+        record = self._record_path(path)
+        try:
+            if os.path.exists(record):
+                os.utime(record)
+            else:
+                os.utime(path, ns=(time.time_ns(), os.stat(path).st_mtime_ns))
+        except OSError:
+            pass
+
+    def _last_used(self, path, stat):
+        try:
+            return os.stat(self._record_path(path)).st_mtime
+        except OSError:
+            return max(stat.st_atime, stat.st_mtime)
+
+    def _stored_files(self):
+        """Yield (path, stat) for every finished file counted against the quota"""
+        for directory in (ARTIFACT_DIR, DOWNLOAD_DIR):
+            try:
+                entries = list(os.scandir(directory))
+            except FileNotFoundError:
+                continue
+            for entry in entries:
+                if entry.name.startswith('.') or entry.name.endswith('.json'):
+                    continue
+                try:
+                    if entry.is_file(follow_symlinks=False):
+                        yield entry.path, entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+
+    def enforce_quota(self):
+        """Evict files until usage is below the low watermark; returns bytes reclaimed"""
+        with self._lock:
+            files = list(self._stored_files())
+            usage = sum(stat.st_size for _, stat in files)
+            self.usage_bytes = usage
+            if usage <= self.quota_bytes:
+                return 0
+
+            now = time.time()
+            # Size-aware LRU: a big file idle for an hour goes before a small one idle for a day
+            files.sort(key=lambda item: (now - self._last_used(item[0], item[1])) * item[1].st_size,
+                       reverse=True)
+
+            target = self.quota_bytes * self.low_watermark
+            reclaimed = 0
+            for path, stat in files:
+                if usage - reclaimed <= target:
+                    break
+                if self._evict(path):
+                    reclaimed += stat.st_size
+                    self.evicted_files += 1
+
+            self.usage_bytes = usage - reclaimed
+            self.reclaimed_bytes += reclaimed
+
+        if reclaimed:
+            logging.info(f"Evicted {reclaimed} bytes of downloads to stay under the {self.quota_bytes} byte quota")
+        return reclaimed
+
+    def _evict(self, path):
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return False
+
+        try:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Somebody is downloading this file right now
+                return False
+            os.unlink(path)
+            if os.path.normpath(os.path.dirname(path)) == os.path.normpath(ARTIFACT_DIR):
+                artifact_cache.delete(os.path.splitext(os.path.basename(path))[0])
+            return True
+        except OSError:
+            return False
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _newest_mtime(path):
+        newest = os.lstat(path).st_mtime
+        for root, dirs, files in os.walk(path):
+            for name in dirs + files:
+                try:
+                    newest = max(newest, os.lstat(os.path.join(root, name)).st_mtime)
+                except OSError:
+                    pass
+        return newest
+
+    @staticmethod
+    def _locked(path):
+        # A journaled download job holds the lock file in its directory while it runs
+        lock_path = os.path.join(path, LOCK_FILE)
+        if not os.path.isfile(lock_path):
+            return False
+        fd = os.open(lock_path, os.O_RDONLY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            return False
+        except BlockingIOError:
+            return True
+        finally:
+            os.close(fd)
+
+    @staticmethod
+    def _disk_usage(path):
+        if not os.path.isdir(path):
+            return os.lstat(path).st_size
+        total = 0
+        for root, _, files in os.walk(path):
+            for name in files:
+                try:
+                    total += os.lstat(os.path.join(root, name)).st_size
+                except OSError:
+                    pass
+        return total
+
+    def remove_orphans(self):
+        """
+        Delete abandoned scratch directories, temp files and dangling artifact records
+
+        Scratch directories whose lock file is held (journaled jobs, artifacts
+        being produced, live streams) are skipped however old they are.
+
+        Returns:
+            Bytes reclaimed
+        """
+        cutoff = time.time() - self.orphan_max_age
+        candidates = []
+
+        try:
+            candidates += [entry.path for entry in os.scandir(SCRATCH_DIR)]
+        except FileNotFoundError:
+            pass
+        for directory in (ARTIFACT_DIR, DOWNLOAD_DIR):
+            try:
+                candidates += [entry.path for entry in os.scandir(directory)
+                               if entry.name.startswith(TEMP_FILE_PREFIXES)]
+            except FileNotFoundError:
+                pass
+
+        reclaimed = 0
+        removed = 0
+        for path in candidates:
+            try:
+                if self._newest_mtime(path) > cutoff or self._locked(path):
+                    continue
+                size = self._disk_usage(path)
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                else:
+                    os.unlink(path)
+            except OSError:
+                continue
+            reclaimed += size
+            removed += 1
+
+        # Artifact records whose file was deleted by hand
+        try:
+            records = [entry for entry in os.scandir(ARTIFACT_DIR) if entry.name.endswith('.json')]
+        except FileNotFoundError:
+            records = []
+        for entry in records:
+            key = entry.name[:-len('.json')]
+            try:
+                with open(entry.path) as f:
+                    file_name = json.load(f).get('file')
+            except (OSError, ValueError):
+                # Vanished meanwhile, or being replaced atomically
+                continue
+            if file_name and not os.path.exists(os.path.join(ARTIFACT_DIR, file_name)):
+                artifact_cache.delete(key)
+                removed += 1
+
+        with self._lock:
+            self.reclaimed_bytes += reclaimed
+            self.orphans_removed += removed
+
+        if removed:
+            logging.info(f"Storage janitor removed {removed} orphans ({reclaimed} bytes)")
+        return reclaimed
+
+    def stats(self):
+        with self._lock:
+            return {
+                'quota_bytes': self.quota_bytes,
+                'usage_bytes': self.usage_bytes,
+                'reclaimed_bytes': self.reclaimed_bytes,
+                'evicted_files': self.evicted_files,
+                'orphans_removed': self.orphans_removed,
+                'janitor_runs': self.janitor_runs,
+                'last_run': self.last_run,
+            }
+
+
+# Process-wide storage manager; new artifacts trigger a quota check
+storage_manager = StorageManager()
+artifact_cache.on_store = storage_manager.after_store
@@ -0,0 +1,118 @@
+import fcntl
+import os
+import tempfile
+
+# Keep the storage janitor away from real downloads
+os.environ.setdefault("DOWNLOAD_DIR", tempfile.mkdtemp(prefix='media-response-test-'))
+
+from flask import Flask
+from werkzeug.test import EnvironBuilder
+
+from media_response import send_media
+
+app = Flask(__name__)
+
+
+@app.route('/file/<name>')
+def serve(name):
+    return send_media(os.path.join(os.environ["DOWNLOAD_DIR"], name))
+
+
+def make_file(name, size=100000):
+    path = os.path.join(os.environ["DOWNLOAD_DIR"], name)
+    with open(path, 'wb') as f:
+        f.write(os.urandom(size))
+    return path
+
+
+def is_pinned(path):
+    """True if something still holds the shared lock that blocks eviction"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return False
+    except BlockingIOError:
+        return True
+    finally:
+        os.close(fd)
+
+
+def serve_like_wsgi_server(path, headers=None, method='GET'):
+    """Run one request through the WSGI app, consuming and closing the body as gunicorn does"""
+    environ = EnvironBuilder(path=path, method=method, headers=headers or {}).get_environ()
+    status = []
+    body = app.wsgi_app(environ, lambda s, h, exc_info=None: status.append(s))
+    try:
+        data = b''.join(body)
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+    return status[0], data
+
+
+def check_released(name, headers=None, method='GET', expected_status=None):
+    path = make_file(name)
+    status, data = serve_like_wsgi_server(f'/file/{name}', headers, method)
+    if expected_status:
+        assert status.startswith(expected_status), status
+    assert not is_pinned(path), f"{name}: pin still held after {status}"
+    return status, data
+
+
+def test_full_download_releases_pin():
+    status, data = check_released('full.bin', expected_status='200')
+    assert len(data) == 100000
+
+
+def test_single_range_releases_pin():
+    status, data = check_released('range.bin', {'Range': 'bytes=10-99'}, expected_status='206')
+    assert len(data) == 90
+
+
+def test_suffix_range_releases_pin():
+    check_released('suffix.bin', {'Range': 'bytes=-500'}, expected_status='206')
+
+
+def test_multipart_ranges_release_pin():
+    status, data = check_released('multi.bin', {'Range': 'bytes=0-9,100-199'}, expected_status='206')
+    assert b'Content-Range: bytes 100-199/100000' in data
+
+
+def test_unstarted_body_releases_pin():
+    path = make_file('unstarted.bin')
+    for headers in ({}, {'Range': 'bytes=0-9,100-199'}):
+        environ = EnvironBuilder(path='/file/unstarted.bin', headers=headers).get_environ()
+        body = app.wsgi_app(environ, lambda s, h, exc_info=None: None)
+        body.close()
+        assert not is_pinned(path)
+
+
+def test_bodiless_responses_release_pin():
+    check_released('head.bin', method='HEAD', expected_status='200')
+    check_released('unsatisfiable.bin', {'Range': 'bytes=200000-'}, expected_status='416')
+
+
+def test_validators_survive_serving():
+    path = make_file('etag.bin')
+    environ = EnvironBuilder(path='/file/etag.bin').get_environ()
+    etags = set()
+    for _ in range(3):
+        with app.request_context(environ):
+            response = serve('etag.bin')
+            etags.add(response.headers['ETag'])
+            response.response.close()
+    assert len(etags) == 1, etags
+
+    etag = etags.pop()
+    status, _ = serve_like_wsgi_server('/file/etag.bin', {'If-None-Match': etag})
+    assert status.startswith('304'), status
+    status, data = serve_like_wsgi_server('/file/etag.bin', {'Range': 'bytes=100-', 'If-Range': etag})
+    assert status.startswith('206') and len(data) == 100000 - 100, status
+    assert not is_pinned(path)
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_') and callable(test):
+            test()
+            print(f"{name}: ok")
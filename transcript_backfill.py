@@ -0,0 +1,171 @@
+import argparse
+import json
+import os
+import tempfile
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from app import app, db
+from models import VideoAnalysis
+from transcript_cleaner import clean_transcript_batch
+
+# Rows read from the database per query
+READ_BATCH_SIZE = int(os.environ.get("TRANSCRIPT_BACKFILL_READ_BATCH", 1000))
+# Rows handed to a worker process at a time
+WORKER_BATCH_SIZE = int(os.environ.get("TRANSCRIPT_BACKFILL_WORKER_BATCH", 50))
+# Progress of an interrupted backfill; kept in the app's instance folder
+# (outside the source tree and out of reach of the scratch janitor)
+DEFAULT_CHECKPOINT = os.environ.get("TRANSCRIPT_BACKFILL_CHECKPOINT",
+                                    os.path.join(app.instance_path, "transcript_backfill.checkpoint.json"))
+
+
+def load_checkpoint(path):
+    """Return the saved backfill state, or None if there is no checkpoint"""
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def save_checkpoint(path, state):
+    """Write the backfill state atomically, so a crash never leaves half a checkpoint"""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.checkpoint-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def _read_batches(start_id, batch_size):
+    """Yield lists of (id, transcript) in id order, one query per batch"""
+    last_id = start_id
+    while True:
+        rows = (db.session.query(VideoAnalysis.id, VideoAnalysis.transcript)
+                .filter(VideoAnalysis.id > last_id, VideoAnalysis.transcript.isnot(None))
+                .order_by(VideoAnalysis.id)
+                .limit(batch_size)
+                .all())
+        if not rows:
+            return
+        last_id = rows[-1][0]
+        yield [(row_id, transcript) for row_id, transcript in rows]
+
+
+def _write_updates(changed):
+    if changed:
+        db.session.bulk_update_mappings(
+            VideoAnalysis,
+            # Caption timings point into the old text, so they are dropped
+            [{'id': row_id, 'transcript': transcript, 'transcript_cues': None} for row_id, transcript in changed]
+        )
+    db.session.commit()
+
+
+def backfill_transcripts(workers=None, read_batch_size=READ_BATCH_SIZE, worker_batch_size=WORKER_BATCH_SIZE,
+                         checkpoint_path=DEFAULT_CHECKPOINT, resume=True, dry_run=False, progress=None):
+    """
+    Re-clean every stored transcript with the current cleaning rules
+
+    Transcripts are read in id order, cleaned in a pool of worker processes
+    and written back in one batched update per read batch, while the next
+    batches are already being cleaned. After each write the last id written
+    is checkpointed, so an interrupted backfill resumes where it stopped.
+    Only transcripts whose cleaned text differs are written.
+
+    Args:
+        workers: Number of worker processes; defaults to the CPU count
+        read_batch_size: Rows per database read and per batched update
+        worker_batch_size: Rows handed to a worker at a time
+        checkpoint_path: File recording progress, or None for no checkpoint
+        resume: Continue from the checkpoint if there is one
+        dry_run: Clean everything but write nothing back
+        progress: Called with a stats dict after every written batch
+
+    Returns:
+        Dictionary of final stats (processed, updated, last_id, elapsed)
+    """
+    workers = workers or os.cpu_count() or 1
+    state = load_checkpoint(checkpoint_path) if (checkpoint_path and resume) else None
+    state = state or {'last_id': 0, 'processed': 0, 'updated': 0}
+
+    remaining = (db.session.query(db.func.count(VideoAnalysis.id))
+                 .filter(VideoAnalysis.id > state['last_id'], VideoAnalysis.transcript.isnot(None))
+                 .scalar())
+    total = state['processed'] + remaining
+    started = time.monotonic()
+    processed_at_start = state['processed']
+
+    def commit(batch_last_id, batch_size, changed):
+        if not dry_run:
+            _write_updates(changed)
+        state['last_id'] = batch_last_id
+        state['processed'] += batch_size
+        state['updated'] += len(changed)
+        if checkpoint_path and not dry_run:
+            save_checkpoint(checkpoint_path, state)
+        if progress:
+            elapsed = time.monotonic() - started
+            rate = (state['processed'] - processed_at_start) / elapsed if elapsed else 0
+            progress(dict(state, total=total, rate=rate,
+                          eta=(total - state['processed']) / rate if rate else None))
+
+    # Batches waiting for their worker results, in read order; results are
+    # written strictly in order so the checkpoint never skips a row
+    pending = deque()
+    max_pending = max(2, workers * 2 * worker_batch_size // read_batch_size + 1)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for rows in _read_batches(state['last_id'], read_batch_size):
+            futures = [pool.submit(clean_transcript_batch, rows[i:i + worker_batch_size])
+                       for i in range(0, len(rows), worker_batch_size)]
+            pending.append((rows[-1][0], len(rows), futures))
+            while len(pending) >= max_pending:
+                batch_last_id, batch_size, futures = pending.popleft()
+                commit(batch_last_id, batch_size, [item for f in futures for item in f.result()])
+
+        while pending:
+            batch_last_id, batch_size, futures = pending.popleft()
+            commit(batch_last_id, batch_size, [item for f in futures for item in f.result()])
+
+    return dict(state, elapsed=time.monotonic() - started)
+
+
+def print_progress(stats):
+    eta = f"{stats['eta']:.0f}s" if stats['eta'] is not None else "?"
+    print(f"Cleaned {stats['processed']}/{stats['total']} transcripts "
+          f"({stats['updated']} updated, {stats['rate']:.1f}/s, ETA {eta}, last id {stats['last_id']})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-clean all stored video transcripts")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument('--batch-size', type=int, default=READ_BATCH_SIZE, help="Rows per read and update batch")
+    parser.add_argument('--worker-batch-size', type=int, default=WORKER_BATCH_SIZE, help="Rows per worker task")
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT, help="Checkpoint file for resuming")
+    parser.add_argument('--restart', action='store_true', help="Ignore the checkpoint and start from the first row")
+    parser.add_argument('--dry-run', action='store_true', help="Clean without writing anything back")
+    args = parser.parse_args()
+
+    print("Re-cleaning stored transcripts...")
+    with app.app_context():
+        stats = backfill_transcripts(workers=args.workers, read_batch_size=args.batch_size,
+                                     worker_batch_size=args.worker_batch_size,
+                                     checkpoint_path=args.checkpoint, resume=not args.restart,
+                                     dry_run=args.dry_run, progress=print_progress)
+    print(f"Transcript backfill completed: {stats['processed']} processed, "
+          f"{stats['updated']} updated in {stats['elapsed']:.1f}s")
+    if args.checkpoint and not args.dry_run and os.path.exists(args.checkpoint):
+        # A finished backfill starts from scratch next time the rules change
+        os.unlink(args.checkpoint)
+
+
+if __name__ == "__main__":
+    main()
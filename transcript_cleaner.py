@@ -0,0 +1,147 @@
+import io
+import os
+import re
+from collections import deque
+
+# A cleaned line is dropped if it repeats one of this many previous lines;
+# rolling captions repeat each line over two or three cues
+DEDUP_WINDOW = int(os.environ.get("TRANSCRIPT_DEDUP_WINDOW", 8))
+# Paragraphs without sentence punctuation (auto-generated captions) are
+# broken at the next line boundary past this many characters
+MAX_PARAGRAPH_CHARS = int(os.environ.get("TRANSCRIPT_MAX_PARAGRAPH_CHARS", 2000))
+
+# Lines that carry no spoken text: the WEBVTT header, Kind:/Language:
+# metadata, cue timings and cue positioning settings
+_SKIP_LINE = re.compile(r'WEBVTT|Kind:|Language:|-->|line:\d+%|align:|position:')
+# Speaker change markers (>>, >>>) and bracketed annotations ([Music], [[...]])
+_SPEAKER_MARKS = re.compile(r'>>>|>>|\[\[.*?\]\]|\[.*?\]')
+_SPEAKER_LABEL = re.compile(r'(Reporter|Speaker|Host|Narrator):\s*')
+# Inline word timings and <c> class spans of auto-generated captions
+_CUE_TIMESTAMP = re.compile(r'<\d{2}:\d{2}:\d{2}\.\d{3}>')
+_CUE_TAGS = re.compile(r'<\d{2}:\d{2}:\d{2}\.\d{3}>|</?c>')
+_SENTENCE_END = re.compile(r'([.!?])\s+')
+
+
+def _strip_cue_tags(line):
+    stripped = _CUE_TAGS.sub('', line)
+    if '<' in stripped:
+        # Removing one tag can join the pieces of another ("<<c>c>"); those
+        # rare lines take the tag kinds one at a time, in the original order
+        stripped = _CUE_TIMESTAMP.sub('', line).replace('<c>', '').replace('</c>', '')
+    return stripped
+
+
+def clean_caption_line(line):
+    """
+    Return the spoken text of one caption line
+
+    Args:
+        line: A line of a VTT/SRT caption file or of a plain transcript
+
+    Returns:
+        The line without markup, speaker markers and surrounding whitespace,
+        or '' if it is metadata, a cue timing or a cue number
+    """
+    if _SKIP_LINE.search(line) or line.strip().isdigit():
+        return ''
+
+    # Every cleanup step is guarded by the character its pattern needs, so
+    # plain text lines never reach a regex
+    if '&' in line:
+        line = line.replace('&gt;', '>').replace('&lt;', '<').replace('&amp;', '&')
+    if '>' in line or '[' in line:
+        line = _SPEAKER_MARKS.sub('', line)
+    if ':' in line:
+        line = _SPEAKER_LABEL.sub('', line)
+    if '<' in line:
+        line = _strip_cue_tags(line)
+    return line.strip()
+
+
+def split_sentences(text):
+    """Put a paragraph break after each sentence inside one cleaned line"""
+    if '.' in text or '!' in text or '?' in text:
+        return _SENTENCE_END.sub(r'\1\n\n', text)
+    return text
+
+
+def iter_clean_paragraphs(lines, window=DEDUP_WINDOW, max_paragraph_chars=MAX_PARAGRAPH_CHARS):
+    """
+    Clean a transcript line by line, yielding paragraphs as they complete
+
+    Memory stays bounded by one paragraph and the dedup window however long
+    the input is, so a caption file can be cleaned straight off an HTTP
+    response or an upload. Joining the paragraphs with blank lines gives the
+    cleaned transcript.
+
+    Args:
+        lines: Iterable of text lines, str or UTF-8 bytes, with or without
+            line endings (a file object, response.iter_lines(), ...)
+        window: Number of recent lines a line must not repeat to be kept
+        max_paragraph_chars: Length past which an unpunctuated paragraph is
+            broken at the next line
+
+    Yields:
+        Cleaned paragraphs, one or more lines each
+    """
+    recent = deque(maxlen=window)
+    paragraph = []
+    length = 0
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', 'replace')
+        text = clean_caption_line(line)
+        if not text or text in recent:
+            continue
+        recent.append(text)
+
+        sentences = split_sentences(text).split('\n\n')
+        for sentence in sentences[:-1]:
+            paragraph.append(sentence)
+            yield '\n'.join(paragraph)
+            paragraph = []
+            length = 0
+        paragraph.append(sentences[-1])
+        length += len(sentences[-1])
+        if text[-1] in '.!?' or length > max_paragraph_chars:
+            yield '\n'.join(paragraph)
+            paragraph = []
+            length = 0
+
+    if paragraph:
+        yield '\n'.join(paragraph)
+
+
+def clean_transcript(transcript):
+    """
+    Clean transcript text by removing WEBVTT markers, timestamps, and formatting
+
+    Args:
+        transcript: Raw transcript text
+
+    Returns:
+        Cleaned transcript text
+    """
+    if not transcript:
+        return ""
+    lines = io.StringIO(str(transcript), newline='\n')
+    return '\n\n'.join(iter_clean_paragraphs(lines))
+
+
+def clean_transcript_batch(rows):
+    """
+    Clean a batch of stored transcripts, for a worker process
+
+    Args:
+        rows: List of (row_id, transcript) pairs
+
+    Returns:
+        List of (row_id, cleaned_transcript) pairs for the transcripts that
+        changed
+    """
+    changed = []
+    for row_id, transcript in rows:
+        cleaned = clean_transcript(transcript)
+        if cleaned != transcript:
+            changed.append((row_id, cleaned))
+    return changed
@@ -0,0 +1,94 @@
+import struct
+import sys
+import zlib
+from array import array
+from bisect import bisect_right
+
+# Format tag and version of serialized cue tables
+CUE_TABLE_MAGIC = b'CUE1'
+_HEADER = struct.Struct('<4sI')
+
+
+class CueTable:
+    """
+    Caption timings of a stored transcript
+
+    One row per caption cue, kept in three parallel arrays: the cue's start
+    and duration in milliseconds and the character offset in the transcript
+    text where the cue's words begin. Offsets never decrease, so the cue
+    that a position in the text belongs to is found by binary search. A cue
+    costs 12 bytes in memory and less once serialized.
+    """
+
+    def __init__(self):
+        self.starts = array('I')
+        self.durations = array('I')
+        self.offsets = array('I')
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def append(self, start, duration, offset):
+        """
+        Add a cue after the existing ones
+
+        Args:
+            start: Start time in seconds
+            duration: Duration in seconds
+            offset: Character offset of the cue's text in the transcript
+        """
+        if self.offsets and offset < self.offsets[-1]:
+            raise ValueError("Cue offsets must not decrease")
+        self.starts.append(max(0, int(round(start * 1000))))
+        self.durations.append(max(0, int(round(duration * 1000))))
+        self.offsets.append(offset)
+
+    def index_at(self, offset):
+        """Return the index of the cue containing a text offset, or None if there are no cues"""
+        if not self.offsets:
+            return None
+        return max(0, bisect_right(self.offsets, offset) - 1)
+
+    def timestamp_at(self, offset):
+        """Return the start time in seconds of the cue containing a text offset, or None"""
+        index = self.index_at(offset)
+        if index is None:
+            return None
+        return self.starts[index] / 1000
+
+    def cue(self, index):
+        """Return (start, duration, offset) of a cue, times in seconds"""
+        return self.starts[index] / 1000, self.durations[index] / 1000, self.offsets[index]
+
+    def to_bytes(self):
+        """Serialize the table for the transcript_cues column"""
+        arrays = [self.starts, self.durations, self.offsets]
+        if sys.byteorder != 'little':
+            arrays = [array('I', a) for a in arrays]
+            for a in arrays:
+                a.byteswap()
+        payload = b''.join(a.tobytes() for a in arrays)
+        return _HEADER.pack(CUE_TABLE_MAGIC, len(self)) + zlib.compress(payload)
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Deserialize a table written by to_bytes; returns None if data isn't one"""
+        if not data or len(data) < _HEADER.size:
+            return None
+        magic, count = _HEADER.unpack_from(data)
+        if magic != CUE_TABLE_MAGIC:
+            return None
+        try:
+            payload = zlib.decompress(bytes(data[_HEADER.size:]))
+        except zlib.error:
+            return None
+
+        table = cls()
+        width = table.offsets.itemsize * count
+        if len(payload) != 3 * width:
+            return None
+        for i, column in enumerate((table.starts, table.durations, table.offsets)):
+            column.frombytes(payload[i * width:(i + 1) * width])
+            if sys.byteorder != 'little':
+                column.byteswap()
+        return table
@@ -33,6 +33,9 @@ def update_database():
     add_column("voiceover_script", "TEXT")
     add_column("translations", "TEXT")
     
+    # Caption timings of the transcript (serialized CueTable)
+    add_column("transcript_cues", "BYTEA")
+    
     print("Database schema update completed!")
 
 if __name__ == "__main__":
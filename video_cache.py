@@ -0,0 +1,301 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from urllib.parse import urlparse, parse_qs
+
+# Defaults can be overridden per deployment through the environment
+DEFAULT_MAX_BYTES = int(os.environ.get("VIDEO_INFO_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+DEFAULT_TTL_SECONDS = int(os.environ.get("VIDEO_INFO_CACHE_TTL", 6 * 60 * 60))
+
+YOUTUBE_HOSTS = ('youtube.com', 'www.youtube.com', 'm.youtube.com',
+                 'music.youtube.com', 'youtube-nocookie.com',
+                 'www.youtube-nocookie.com')
+
+
+def canonical_video_key(url):
+    """
+    Build a canonical cache key for a video URL
+
+    All YouTube URL variants of the same video (youtu.be links, watch URLs with
+    extra query parameters, mobile/music hosts, embed and shorts links) map to
+    the same "youtube:<video_id>" key. URLs from other sites are keyed on the
+    stripped URL itself.
+
+    Args:
+        url: A video URL or a bare 11 character YouTube video ID
+
+    Returns:
+        A string usable as a cache key
+    """
+    if not url:
+        return url
+
+    url = url.strip()
+
+    # Bare video IDs are passed around by the API routes
+    if len(url) == 11 and '/' not in url and '.' not in url:
+        return f"youtube:{url}"
+
+    parsed = urlparse(url if '://' in url else f"https://{url}")
+    host = parsed.netloc.lower().split(':')[0]
+    path_parts = [p for p in parsed.path.split('/') if p]
+    video_id = None
+
+    if host in ('youtu.be', 'www.youtu.be'):
+        video_id = path_parts[0] if path_parts else None
+    elif host in YOUTUBE_HOSTS:
+        if path_parts and path_parts[0] == 'watch':
+            video_id = parse_qs(parsed.query).get('v', [None])[0]
+        elif len(path_parts) >= 2 and path_parts[0] in ('embed', 'v', 'shorts', 'live'):
+            video_id = path_parts[1]
+
+    if video_id:
+        return f"youtube:{video_id}"
+
+    return url
+
+
+def estimate_size(value):
+    """Approximate the in-memory footprint of a cached value in bytes"""
+    try:
+        return len(json.dumps(value, default=str).encode('utf-8'))
+    except (TypeError, ValueError):
+        return len(str(value).encode('utf-8'))
+
+
+class VideoInfoCache:
+    """
+    Thread-safe LRU cache with a byte-size bound and per-entry TTL
+
+    Entries are evicted least-recently-used first once the total estimated
+    size exceeds max_bytes. Expired entries are dropped lazily on lookup.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL_SECONDS):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self._lock = threading.Lock()
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+
+            value, size, expires_at = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        """Store value under key, evicting older entries if needed"""
+        size = estimate_size(value)
+        ttl = self.ttl if ttl is None else ttl
+        expires_at = time.monotonic() + ttl if ttl else None
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            # Values larger than the whole cache are never stored
+            if size > self.max_bytes:
+                return
+
+            self._entries[key] = (value, size, expires_at)
+            self._total_bytes += size
+
+            while self._total_bytes > self.max_bytes and self._entries:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def delete(self, key):
+        """Remove key from the cache if present"""
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        """Drop every entry, keeping the counters"""
+        with self._lock:
+            self._entries.clear()
+            self._total_bytes = 0
+
+    def stats(self):
+        """Return a snapshot of cache size and hit/miss/eviction counters"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': round(self.hits / lookups, 4) if lookups else 0,
+            }
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    def _remove(self, key):
+        # Caller must hold the lock
+        _, size, _ = self._entries.pop(key)
+        self._total_bytes -= size
+
+
+# Location of the node-wide cache shared by every worker process
+SHARED_CACHE_PATH = os.environ.get("VIDEO_SHARED_CACHE_PATH",
+                                   os.path.join('instance', 'video_cache.sqlite3'))
+SHARED_CACHE_TTL_SECONDS = int(os.environ.get("VIDEO_SHARED_CACHE_TTL", 6 * 60 * 60))
+
+
+class SharedVideoCache:
+    """
+    Cross-process metadata cache backed by a local SQLite file
+
+    Every gunicorn worker on the node opens the same database file, so a video
+    extracted by one worker is served from disk to all the others and survives
+    restarts. Values are stored as zlib-compressed JSON with an absolute expiry
+    time; expired rows are ignored on read and purged opportunistically.
+    """
+
+    def __init__(self, path=SHARED_CACHE_PATH, ttl=SHARED_CACHE_TTL_SECONDS):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+
+    def _connect(self):
+        # SQLite connections must not cross threads or forked processes
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS video_cache ("
+            " key TEXT PRIMARY KEY,"
+            " value BLOB NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default if missing or expired"""
+        try:
+            row = self._connect().execute(
+                "SELECT value, expires_at FROM video_cache WHERE key = ?",
+                (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logging.warning(f"Shared cache read failed for {key}: {str(e)}")
+            self.errors += 1
+            return default
+
+        if row is None or row[1] <= time.time():
+            self.misses += 1
+            return default
+
+        try:
+            value = json.loads(zlib.decompress(row[0]).decode('utf-8'))
+        except (zlib.error, ValueError) as e:
+            logging.warning(f"Discarding corrupt shared cache entry {key}: {str(e)}")
+            self.delete(key)
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        """Store value under key for ttl seconds"""
+        ttl = self.ttl if ttl is None else ttl
+        try:
+            payload = zlib.compress(
+                json.dumps(value, separators=(',', ':'), default=str).encode('utf-8'))
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO video_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, payload, time.time() + ttl)
+            )
+
+            # Purge expired rows every so often rather than on every write
+            self._writes += 1
+            if self._writes % 100 == 0:
+                self.purge_expired()
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logging.warning(f"Shared cache write failed for {key}: {str(e)}")
+            self.errors += 1
+
+    def delete(self, key):
+        """Remove key from the cache if present"""
+        try:
+            self._connect().execute("DELETE FROM video_cache WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            logging.warning(f"Shared cache delete failed for {key}: {str(e)}")
+            self.errors += 1
+
+    def purge_expired(self):
+        """Delete expired rows and return how many were removed"""
+        try:
+            cursor = self._connect().execute(
+                "DELETE FROM video_cache WHERE expires_at <= ?", (time.time(),))
+            return cursor.rowcount
+        except sqlite3.Error as e:
+            logging.warning(f"Shared cache purge failed: {str(e)}")
+            self.errors += 1
+            return 0
+
+    def stats(self):
+        """Return a snapshot of this worker's counters and the shared row count"""
+        try:
+            entries = self._connect().execute(
+                "SELECT COUNT(*) FROM video_cache").fetchone()[0]
+        except sqlite3.Error:
+            entries = None
+        return {
+            'path': self.path,
+            'entries': entries,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'errors': self.errors,
+        }
+
+
+# Process-wide handle on the node-wide cache, shared by app and youtube_service
+shared_video_cache = SharedVideoCache()
@@ -0,0 +1,126 @@
+import logging
+import os
+from datetime import datetime
+
+from extractor_pool import extract_info
+from rate_limiter import youtube_limiter
+from singleflight import single_flight
+from video_cache import VideoInfoCache, canonical_video_key, shared_video_cache
+
+# Raw extraction results embed signed stream URLs that YouTube expires after a
+# few hours, so they are kept for less time than the derived metadata
+METADATA_TTL_SECONDS = int(os.environ.get("VIDEO_METADATA_TTL", 60 * 60))
+METADATA_CACHE_MAX_BYTES = int(os.environ.get("VIDEO_METADATA_CACHE_MAX_BYTES", 128 * 1024 * 1024))
+
+metadata_cache = VideoInfoCache(max_bytes=METADATA_CACHE_MAX_BYTES, ttl=METADATA_TTL_SECONDS)
+
+
+def video_url(url_or_id):
+    """Turn a bare YouTube video ID into a watch URL, leaving URLs untouched"""
+    if '/' in url_or_id or '.' in url_or_id:
+        return url_or_id
+    return f"https://www.youtube.com/watch?v={url_or_id}"
+
+
+class VideoMetadata:
+    """
+    The result of a single yt-dlp extraction for one video
+
+    Page info, format lists, descriptions and downloads are all derived from
+    this object so a request flow only ever extracts a video once.
+    """
+
+    def __init__(self, info):
+        self.info = info
+
+    @property
+    def video_id(self):
+        return self.info.get('id')
+
+    @property
+    def title(self):
+        return self.info.get('title') or f"Video {self.video_id}"
+
+    @property
+    def description(self):
+        return self.info.get('description') or ""
+
+    @property
+    def duration(self):
+        return self.info.get('duration') or 0
+
+    @property
+    def formats(self):
+        return self.info.get('formats') or []
+
+    @property
+    def publish_date(self):
+        upload_date = self.info.get('upload_date')
+        if not upload_date:
+            return None
+        try:
+            return datetime.strptime(upload_date, '%Y%m%d').strftime('%Y-%m-%d')
+        except ValueError:
+            return None
+
+    def to_video_info(self):
+        """Return the basic info dictionary used by the analysis routes"""
+        return {
+            'title': self.title,
+            'author': self.info.get('uploader') or self.info.get('channel') or "Unknown Creator",
+            'duration_seconds': self.duration,
+            'thumbnail_url': self.info.get('thumbnail') or "",
+            'publish_date': self.publish_date,
+            'views': self.info.get('view_count') or 0,
+            'description': self.description
+        }
+
+
+@single_flight(lambda url_or_id: f"metadata:{canonical_video_key(url_or_id)}")
+def get_video_metadata(url_or_id):
+    """
+    Get the shared extraction result for a video
+
+    Looks in the in-process cache, then the node-wide cache, and only runs a
+    yt-dlp extraction (in the extractor pool) when both miss.
+
+    Args:
+        url_or_id: A video URL or a bare YouTube video ID
+
+    Returns:
+        A VideoMetadata object; raises if the extraction fails
+    """
+    cache_key = canonical_video_key(url_or_id)
+
+    info = metadata_cache.get(cache_key)
+    if info is None:
+        info = shared_video_cache.get(f"metadata:{cache_key}")
+        if info is None:
+            youtube_limiter.acquire()
+            info = extract_info(video_url(url_or_id))
+            if not info:
+                raise ValueError(f"Could not extract metadata for {url_or_id}")
+            shared_video_cache.set(f"metadata:{cache_key}", info, ttl=METADATA_TTL_SECONDS)
+        metadata_cache.set(cache_key, info)
+
+    return VideoMetadata(info)
+
+
+def download_with_metadata(ydl, url_or_id):
+    """
+    Download with an existing YoutubeDL instance from the shared extraction result
+
+    The instance's own options (format, outtmpl, hooks) select and write the
+    streams, so no second extraction is needed. If the cached stream URLs have
+    gone stale the video is extracted afresh.
+    """
+    from yt_dlp.utils import DownloadError
+
+    info = get_video_metadata(url_or_id).info
+    youtube_limiter.acquire()
+    try:
+        ydl.process_ie_result(dict(info), download=True)
+    except DownloadError as e:
+        logging.warning(f"Cached metadata for {url_or_id} unusable, re-extracting: {str(e)}")
+        youtube_limiter.acquire()
+        ydl.download([video_url(url_or_id)])
@@ -2,81 +2,159 @@ import logging
 from youtube_transcript_api import YouTubeTranscriptApi, NoTranscriptFound, TranscriptsDisabled
 import requests
 import os
+import shutil
 import tempfile
-import time
 from pytube import YouTube
 
+from progress_aggregator import ProgressAggregator
+from rate_limiter import youtube_limiter
+from singleflight import single_flight
+from storage import scratch_root
+from transcript_cues import CueTable
+from video_cache import shared_video_cache
+from video_metadata import get_video_metadata, download_with_metadata
+
 import logging
 from youtube_transcript_api import YouTubeTranscriptApi, NoTranscriptFound, TranscriptsDisabled
 import string
 
+# Format lists carry signed stream URLs that YouTube expires after a few hours,
+# so they are cached for a shorter time than the rest of the metadata
+FORMATS_CACHE_TTL_SECONDS = int(os.environ.get("VIDEO_FORMATS_CACHE_TTL", 60 * 60))
 
-def get_video_transcript(video_id):
+
+def merge_transcript_entries(entries):
     """
     Advanced transcript cleaning with:
     - Multi-line merging
     - Split-line duplicate detection
     - Context-aware normalization
     - Progressive deduplication
+
+    Runs in one pass over the entries and in time linear in the caption
+    text: the line being merged keeps its parts, word count, last word and
+    normalized form up to date as entries arrive, and is checked for
+    duplicates as soon as the next line starts.
+
+    Args:
+        entries: Caption entries ({text, start, duration}) from YouTubeTranscriptApi
+
+    Returns:
+        A tuple of (text, cues): the cleaned lines joined by newlines, and a
+        CueTable locating each kept entry's words in that text
+    """
+    punctuation = str.maketrans('', '',
+                                string.punctuation.replace("'", ""))
+    cleaned = []
+    cues = CueTable()
+    # Offset in the output where the next kept line starts
+    offset = 0
+    prev_normalized = ""
+
+    # The line being merged: entry texts, (offset in the line, start,
+    # duration) of each entry, and the normalized form of each entry
+    parts = []
+    timings = []
+    normalized = []
+    length = 0
+    words = 0
+    last_word = ""
+
+    def finish_line():
+        """Keep the merged line unless it is empty or repeats the previous one"""
+        nonlocal prev_normalized, offset
+        # Context-aware normalization, built from the entries' normalized forms
+        line_normalized = ''.join(normalized).strip()
+        if not line_normalized:
+            return
+        # Split-line duplicate check
+        if prev_normalized and (line_normalized.startswith(prev_normalized)
+                                or prev_normalized.startswith(line_normalized)):
+            return
+
+        line = ' '.join(parts)
+        cleaned.append(line)
+        prev_normalized = line_normalized
+        for line_offset, start, duration in timings:
+            cues.append(start, duration, offset + line_offset)
+        offset += len(line) + 1
+
+    for entry in entries:
+        text = entry['text'].strip()
+        if not text:
+            continue
+        text_words = text.split()
+
+        # Short lines and lines continuing the previous one's last word are
+        # merged into it
+        if parts and (words < 4 or text.startswith(last_word)):
+            timings.append((length + 1, entry.get('start', 0), entry.get('duration', 0)))
+            length += 1 + len(text)
+            words += len(text_words)
+        else:
+            if parts:
+                finish_line()
+            parts = []
+            timings = [(0, entry.get('start', 0), entry.get('duration', 0))]
+            normalized = []
+            length = len(text)
+            words = len(text_words)
+
+        parts.append(text)
+        normalized.append(text.translate(punctuation).lower().replace(" ", ""))
+        last_word = text_words[-1]
+
+    if parts:
+        finish_line()
+
+    return "\n".join(cleaned), cues
+
+
+@single_flight(lambda video_id: f"transcript:{video_id}")
+def get_video_transcript_with_cues(video_id):
+    """
+    Get the cleaned transcript of a video along with its caption timings
+
+    Args:
+        video_id: The YouTube video ID
+
+    Returns:
+        A tuple of (transcript, cues). When there is no usable transcript,
+        transcript is a message saying why and cues is None.
     """
     try:
+        youtube_limiter.acquire()
         transcript = YouTubeTranscriptApi.get_transcript(video_id,
                                                          languages=['en'])
         if not transcript:
-            return "No transcript available"
-
-        cleaned = []
-        buffer = []
-        prev_normalized = ""
-        punctuation = str.maketrans('', '',
-                                    string.punctuation.replace("'", ""))
-
-        def normalize(t):
-            """Context-aware normalization"""
-            return t.translate(punctuation).lower().replace(" ", "").strip()
-
-        def is_continuation(current, previous):
-            """Check if current line continues previous text"""
-            return current.startswith(
-                previous.split()[-1]) if previous else False
-
-        for entry in transcript:
-            text = entry['text'].strip()
-            if not text:
-                continue
-
-            # Buffer management for split lines
-            if buffer and (len(buffer[-1].split()) < 4
-                           or is_continuation(text, buffer[-1])):
-                buffer[-1] += " " + text
-            else:
-                buffer.append(text)
+            return "No transcript available", None
 
-        # Process buffered lines
-        for line in buffer:
-            line_normalized = normalize(line)
+        text, cues = merge_transcript_entries(transcript)
+        if not text:
+            return "No meaningful transcript found", None
+        return text, cues
 
-            if not line_normalized:
-                continue
+    except (NoTranscriptFound, TranscriptsDisabled):
+        return "Captions unavailable", None
+    except Exception as e:
+        logging.error(f"Transcript error: {str(e)}")
+        return "Error retrieving transcript", None
 
-            # Split-line duplicate check
-            is_duplicate = any(
-                line_normalized.startswith(n) or n.startswith(line_normalized)
-                for n in [prev_normalized])
 
-            if not is_duplicate and line_normalized != prev_normalized:
-                cleaned.append(line)
-                prev_normalized = line_normalized
+def get_video_transcript(video_id):
+    """
+    Get the cleaned transcript text of a video
 
-        return "\n".join(cleaned) or "No meaningful transcript found"
+    Args:
+        video_id: The YouTube video ID
 
-    except (NoTranscriptFound, TranscriptsDisabled):
-        return "Captions unavailable"
-    except Exception as e:
-        logging.error(f"Transcript error: {str(e)}")
-        return "Error retrieving transcript"
+    Returns:
+        The transcript, or a message saying why there is none
+    """
+    return get_video_transcript_with_cues(video_id)[0]
 
 
+@single_flight(lambda video_id: f"service_info:{video_id}")
 def get_video_info(video_id):
     """
     Get basic information about a YouTube video like title, duration, etc.
@@ -87,43 +165,16 @@ def get_video_info(video_id):
     Returns:
         A dictionary with video information or None if unavailable
     """
+    cache_key = f"service_info:youtube:{video_id}"
+    cached = shared_video_cache.get(cache_key)
+    if cached is not None:
+        return cached
 
     try:
-        # Add a user-agent header to avoid being blocked
-        from pytube import YouTube
-        import time
-
-        # Sleep briefly to avoid rate limiting
-        time.sleep(1)
-
-        # Create a YouTube object with an improved request strategy
-        yt = YouTube(f"https://www.youtube.com/watch?v={video_id}",
-                     use_oauth=False,
-                     allow_oauth_cache=False)
-
-        # Force initial data fetch to validate connection
-        yt.check_availability()
-
-        # Extract relevant information with fallbacks
-        title = yt.title if hasattr(yt, 'title') else f"Video {video_id}"
-        author = yt.author if hasattr(yt, 'author') else "Unknown Creator"
-        duration = yt.length if hasattr(yt, 'length') else 0
-        thumbnail = yt.thumbnail_url if hasattr(yt, 'thumbnail_url') else ""
-        publish_date = yt.publish_date.strftime('%Y-%m-%d') if hasattr(
-            yt, 'publish_date') and yt.publish_date else None
-        views = yt.views if hasattr(yt, 'views') else 0
-        description = yt.description if hasattr(yt, 'description') else ""
-
-        video_info = {
-            'title': title,
-            'author': author,
-            'duration_seconds': duration,
-            'thumbnail_url': thumbnail,
-            'publish_date': publish_date,
-            'views': views,
-            'description': description
-        }
+        # Derived from the same extraction as the format list and downloads
+        video_info = get_video_metadata(video_id).to_video_info()
 
+        shared_video_cache.set(cache_key, video_info)
         return video_info
 
     except Exception as e:
@@ -159,7 +210,7 @@ def get_video_description(video_id):
         A string containing the video description, or None if unavailable
     """
     try:
-        # Get description from the video_info function to avoid duplicate requests
+        # Read from the shared extraction result to avoid duplicate requests
         video_info = get_video_info(video_id)
         return video_info.get('description', "No description available")
 
@@ -169,6 +220,7 @@ def get_video_description(video_id):
         return "Unable to retrieve video description due to YouTube API limitations."
 
 
+@single_flight(lambda video_id: f"formats:{video_id}")
 def get_video_formats(video_id):
     """
     Get all available formats for a YouTube video using yt-dlp
@@ -179,195 +231,242 @@ def get_video_formats(video_id):
     Returns:
         A dictionary containing video info and available formats categorized
     """
+    cache_key = f"formats:youtube:{video_id}"
+    cached = shared_video_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     try:
-        import yt_dlp
+        # Formats come from the shared extraction result for this video
+        info = get_video_metadata(video_id).info
 
-        url = f"https://www.youtube.com/watch?v={video_id}"
+        if not info:
+            logging.error(
+                f"Could not retrieve formats for video {video_id}")
+            return None
 
-        # Options to extract all available formats
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'skip_download': True,
-            'format': 'best'
+        # Basic video info
+        basic_info = {
+            'id': info.get('id'),
+            'title': info.get('title', f'Video {video_id}'),
+            'duration': info.get('duration'),
+            'thumbnail': info.get('thumbnail'),
+            'uploader': info.get('uploader'),
+            'view_count': info.get('view_count', 0)
         }
 
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-
-            if not info:
-                logging.error(
-                    f"Could not retrieve formats for video {video_id}")
-                return None
-
-            # Basic video info
-            basic_info = {
-                'id': info.get('id'),
-                'title': info.get('title', f'Video {video_id}'),
-                'duration': info.get('duration'),
-                'thumbnail': info.get('thumbnail'),
-                'uploader': info.get('uploader'),
-                'view_count': info.get('view_count', 0)
-            }
+        # Process formats
+        formats = info.get('formats', [])
 
-            # Process formats
-            formats = info.get('formats', [])
-
-            # Categorize formats
-            video_formats = []
-            audio_formats = []
-            combined_formats = []
-
-            for f in formats:
-                format_id = f.get('format_id', '')
-                ext = f.get('ext', '')
-
-                # Skip formats with no id or extension
-                if not format_id or not ext:
-                    continue
-
-                format_info = {
-                    'format_id': format_id,
-                    'ext': ext,
-                    'format_note': f.get('format_note', ''),
-                    'filesize': f.get('filesize'),
-                    'tbr': f.get('tbr'),  # Total bitrate
-                    'url': f.get('url'),
-                }
+        # Categorize formats
+        video_formats = []
+        audio_formats = []
+        combined_formats = []
 
-                # Video only formats
-                if f.get('vcodec', 'none') != 'none' and f.get(
-                        'acodec', 'none') == 'none':
-                    if f.get('width') and f.get('height'):
-                        format_info[
-                            'resolution'] = f"{f.get('width')}x{f.get('height')}"
-                        format_info['height'] = f.get('height')
-                        format_info['width'] = f.get('width')
-                        format_info['fps'] = f.get('fps')
-                        format_info['vcodec'] = f.get('vcodec')
-                        video_formats.append(format_info)
-
-                # Audio only formats
-                elif f.get('vcodec', 'none') == 'none' and f.get(
-                        'acodec', 'none') != 'none':
-                    format_info['acodec'] = f.get('acodec')
-                    format_info['abr'] = f.get('abr')  # Audio bitrate
-                    audio_formats.append(format_info)
-
-                # Combined formats (video and audio)
-                elif f.get('vcodec', 'none') != 'none' and f.get(
-                        'acodec', 'none') != 'none':
-                    if f.get('width') and f.get('height'):
-                        format_info[
-                            'resolution'] = f"{f.get('width')}x{f.get('height')}"
-                        format_info['height'] = f.get('height')
-                        format_info['width'] = f.get('width')
-                        format_info['fps'] = f.get('fps')
-                        format_info['vcodec'] = f.get('vcodec')
-                        format_info['acodec'] = f.get('acodec')
-                        combined_formats.append(format_info)
-
-            # Sort formats by quality (resolution/bitrate)
-            video_formats.sort(key=lambda x:
-                               (x.get('height', 0) or 0, x.get('tbr', 0) or 0),
-                               reverse=True)
-            audio_formats.sort(key=lambda x: x.get('abr', 0) or 0,
-                               reverse=True)
-            combined_formats.sort(
-                key=lambda x: (x.get('height', 0) or 0, x.get('tbr', 0) or 0),
-                reverse=True)
-
-            # Generate convenient format lists for the UI
-            video_quality_options = []
-            for vf in video_formats:
-                if vf.get('height'):
-                    label = f"{vf.get('height')}p"
-                    if vf.get('fps') and vf.get('fps') > 30:
-                        label += f" {vf.get('fps')}fps"
-                    if not any(opt['label'] == label
-                               for opt in video_quality_options):
-                        video_quality_options.append({
-                            'label':
-                            label,
-                            'format_id':
-                            vf.get('format_id'),
-                            'height':
-                            vf.get('height'),
-                            'ext':
-                            vf.get('ext')
-                        })
+        for f in formats:
+            format_id = f.get('format_id', '')
+            ext = f.get('ext', '')
 
-            audio_quality_options = []
-            for af in audio_formats:
-                if af.get('abr'):
-                    label = f"{int(af.get('abr'))}kbps {af.get('ext').upper()}"
-                    if not any(opt['label'] == label
-                               for opt in audio_quality_options):
-                        audio_quality_options.append({
-                            'label':
-                            label,
-                            'format_id':
-                            af.get('format_id'),
-                            'abr':
-                            af.get('abr'),
-                            'ext':
-                            af.get('ext')
-                        })
+            # Skip formats with no id or extension
+            if not format_id or not ext:
+                continue
 
-            preset_formats = []
-            # 4K
-            if any(vf.get('height', 0) >= 2160 for vf in video_formats):
-                preset_formats.append({'label': '4K (2160p)', 'value': '2160'})
-            # 2K/1440p
-            if any(vf.get('height', 0) >= 1440 for vf in video_formats):
-                preset_formats.append({'label': '2K (1440p)', 'value': '1440'})
-            # 1080p
-            if any(vf.get('height', 0) >= 1080 for vf in video_formats):
-                preset_formats.append({
-                    'label': 'Full HD (1080p)',
-                    'value': '1080'
-                })
-            # 720p
-            if any(vf.get('height', 0) >= 720 for vf in video_formats):
-                preset_formats.append({'label': 'HD (720p)', 'value': '720'})
-            # 480p
-            if any(vf.get('height', 0) >= 480 for vf in video_formats):
-                preset_formats.append({'label': 'SD (480p)', 'value': '480'})
-            # 360p
-            if any(vf.get('height', 0) >= 360 for vf in video_formats):
-                preset_formats.append({'label': '360p', 'value': '360'})
-
-            # Add audio options
-            preset_formats.append({
-                'label': 'Audio only (High Quality)',
-                'value': 'audio_high'
-            })
+            format_info = {
+                'format_id': format_id,
+                'ext': ext,
+                'format_note': f.get('format_note', ''),
+                'filesize': f.get('filesize'),
+                'tbr': f.get('tbr'),  # Total bitrate
+                'url': f.get('url'),
+            }
+
+            # Video only formats
+            if f.get('vcodec', 'none') != 'none' and f.get(
+                    'acodec', 'none') == 'none':
+                if f.get('width') and f.get('height'):
+                    format_info[
+                        'resolution'] = f"{f.get('width')}x{f.get('height')}"
+                    format_info['height'] = f.get('height')
+                    format_info['width'] = f.get('width')
+                    format_info['fps'] = f.get('fps')
+                    format_info['vcodec'] = f.get('vcodec')
+                    video_formats.append(format_info)
+
+            # Audio only formats
+            elif f.get('vcodec', 'none') == 'none' and f.get(
+                    'acodec', 'none') != 'none':
+                format_info['acodec'] = f.get('acodec')
+                format_info['abr'] = f.get('abr')  # Audio bitrate
+                audio_formats.append(format_info)
+
+            # Combined formats (video and audio)
+            elif f.get('vcodec', 'none') != 'none' and f.get(
+                    'acodec', 'none') != 'none':
+                if f.get('width') and f.get('height'):
+                    format_info[
+                        'resolution'] = f"{f.get('width')}x{f.get('height')}"
+                    format_info['height'] = f.get('height')
+                    format_info['width'] = f.get('width')
+                    format_info['fps'] = f.get('fps')
+                    format_info['vcodec'] = f.get('vcodec')
+                    format_info['acodec'] = f.get('acodec')
+                    combined_formats.append(format_info)
+
+        # Sort formats by quality (resolution/bitrate)
+        video_formats.sort(key=lambda x:
+                           (x.get('height', 0) or 0, x.get('tbr', 0) or 0),
+                           reverse=True)
+        audio_formats.sort(key=lambda x: x.get('abr', 0) or 0,
+                           reverse=True)
+        combined_formats.sort(
+            key=lambda x: (x.get('height', 0) or 0, x.get('tbr', 0) or 0),
+            reverse=True)
+
+        # Generate convenient format lists for the UI
+        video_quality_options = []
+        for vf in video_formats:
+            if vf.get('height'):
+                label = f"{vf.get('height')}p"
+                if vf.get('fps') and vf.get('fps') > 30:
+                    label += f" {vf.get('fps')}fps"
+                if not any(opt['label'] == label
+                           for opt in video_quality_options):
+                    video_quality_options.append({
+                        'label':
+                        label,
+                        'format_id':
+                        vf.get('format_id'),
+                        'height':
+                        vf.get('height'),
+                        'ext':
+                        vf.get('ext')
+                    })
+
+        audio_quality_options = []
+        for af in audio_formats:
+            if af.get('abr'):
+                label = f"{int(af.get('abr'))}kbps {af.get('ext').upper()}"
+                if not any(opt['label'] == label
+                           for opt in audio_quality_options):
+                    audio_quality_options.append({
+                        'label':
+                        label,
+                        'format_id':
+                        af.get('format_id'),
+                        'abr':
+                        af.get('abr'),
+                        'ext':
+                        af.get('ext')
+                    })
+
+        preset_formats = []
+        # 4K
+        if any(vf.get('height', 0) >= 2160 for vf in video_formats):
+            preset_formats.append({'label': '4K (2160p)', 'value': '2160'})
+        # 2K/1440p
+        if any(vf.get('height', 0) >= 1440 for vf in video_formats):
+            preset_formats.append({'label': '2K (1440p)', 'value': '1440'})
+        # 1080p
+        if any(vf.get('height', 0) >= 1080 for vf in video_formats):
             preset_formats.append({
-                'label': 'Audio only (MP3)',
-                'value': 'mp3'
+                'label': 'Full HD (1080p)',
+                'value': '1080'
             })
+        # 720p
+        if any(vf.get('height', 0) >= 720 for vf in video_formats):
+            preset_formats.append({'label': 'HD (720p)', 'value': '720'})
+        # 480p
+        if any(vf.get('height', 0) >= 480 for vf in video_formats):
+            preset_formats.append({'label': 'SD (480p)', 'value': '480'})
+        # 360p
+        if any(vf.get('height', 0) >= 360 for vf in video_formats):
+            preset_formats.append({'label': '360p', 'value': '360'})
+
+        # Add audio options
+        preset_formats.append({
+            'label': 'Audio only (High Quality)',
+            'value': 'audio_high'
+        })
+        preset_formats.append({
+            'label': 'Audio only (MP3)',
+            'value': 'mp3'
+        })
+
+        result = {
+            'info': basic_info,
+            'video_formats': video_formats,
+            'audio_formats': audio_formats,
+            'combined_formats': combined_formats,
+            'video_quality_options': video_quality_options,
+            'audio_quality_options': audio_quality_options,
+            'preset_formats': preset_formats
+        }
 
-            return {
-                'info': basic_info,
-                'video_formats': video_formats,
-                'audio_formats': audio_formats,
-                'combined_formats': combined_formats,
-                'video_quality_options': video_quality_options,
-                'audio_quality_options': audio_quality_options,
-                'preset_formats': preset_formats
-            }
+        shared_video_cache.set(cache_key, result, ttl=FORMATS_CACHE_TTL_SECONDS)
+        return result
 
     except Exception as e:
         logging.error(f"Error getting video formats for {video_id}: {str(e)}")
         return None
 
 
+def download_file_name(title):
+    """
+    Turn a video title into a safe file name stem (no extension)
+    """
+    return "".join(c for c in title
+                   if c.isalnum() or c in ' _-')[:50].strip().replace(' ', '_')
+
+
+def select_download_format(format_type="mp4",
+                           resolution="720p",
+                           video_format_id=None,
+                           audio_format_id=None):
+    """
+    Choose the yt-dlp format selector for a download request
+    
+    Args:
+        format_type: The format to download ('mp4', 'mp3', 'webm', 'audio')
+        resolution: The resolution for video ('720p', '360p', etc.), ignored for audio
+        video_format_id: Optional specific format ID for video stream
+        audio_format_id: Optional specific format ID for audio stream
+        
+    Returns:
+        A tuple of (format_spec, extension, mime_type)
+    """
+    if format_type.lower() in ["mp3", "audio"]:
+        # Audio download; a specific audio format if requested, else the best
+        return (audio_format_id or 'bestaudio/best'), "mp3", "audio/mpeg"
+
+    if format_type.lower() == "webm":
+        # WebM video download
+        if video_format_id and audio_format_id:
+            format_spec = f"{video_format_id}+{audio_format_id}/best"
+        else:
+            # WebM format with best quality
+            format_spec = 'bestvideo[ext=webm]+bestaudio[ext=webm]/best[ext=webm]/best'
+        return format_spec, "webm", "video/webm"
+
+    # Default to mp4
+    if video_format_id and audio_format_id:
+        format_spec = f"{video_format_id}+{audio_format_id}/best"
+    elif resolution in ("360p", "480p", "720p", "1080p", "1440p", "2160p"):
+        # Select format based on resolution
+        height = resolution[:-1]
+        format_spec = (f'bestvideo[height<={height}][ext=mp4]+bestaudio[ext=m4a]/'
+                       f'best[height<={height}][ext=mp4]/best[ext=mp4]/best')
+    else:
+        format_spec = 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best'
+    return format_spec, "mp4", "video/mp4"
+
+
 def download_video(video_id,
                    format_type="mp4",
                    resolution="720p",
                    video_format_id=None,
                    audio_format_id=None,
-                   progress_callback=None):
+                   progress_callback=None,
+                   work_dir=None):
     """
     Download a YouTube video in the specified format and resolution using yt-dlp
     
@@ -378,67 +477,50 @@ def download_video(video_id,
         video_format_id: Optional specific format ID for video stream
         audio_format_id: Optional specific format ID for audio stream
         progress_callback: Optional callback function for progress updates
+        work_dir: Optional directory to download into; defaults to a new
+            directory in the download scratch space, which the storage
+            janitor removes once it is abandoned
         
     Returns:
         A tuple of (file_path, file_name, mime_type) or None if download failed
     """
+    temp_dir = None
     try:
         import yt_dlp
 
         # Create a temp directory for downloading
-        temp_dir = tempfile.mkdtemp()
+        temp_dir = tempfile.mkdtemp(prefix='download-', dir=work_dir or scratch_root())
         url = f"https://www.youtube.com/watch?v={video_id}"
 
-        # Get video info to use for filename
-        with yt_dlp.YoutubeDL({'quiet': True}) as ydl:
-            info = ydl.extract_info(url, download=False)
-            title = info.get('title', f'video_{video_id}')
-
-        # Clean up file name
-        file_name = "".join(c for c in title
-                            if c.isalnum() or c in ' _-')[:50].strip().replace(
-                                ' ', '_')
+        # Reuse the shared extraction result for the filename and the download
+        info = get_video_metadata(video_id).info
+        title = info.get('title', f'video_{video_id}')
+        file_name = download_file_name(title)
 
         class MyProgressHook:
+            """Forwards throttled, byte-weighted progress to progress_callback"""
 
             def __init__(self):
-                self.downloaded_bytes = 0
-                self.total_bytes = 0
-                self.start_time = time.time()
+                self.aggregator = ProgressAggregator(self.publish)
+                # One YoutubeDL may fetch several formats; each is tracked by format ID
+                self.hook = self.aggregator.hook()
+
+            def publish(self, snapshot):
+                if not progress_callback:
+                    return
+                update = {
+                    'progress': snapshot['progress'],
+                    'downloaded_bytes': snapshot['downloaded_bytes'],
+                    'total_bytes': snapshot['total_bytes'],
+                    'speed': snapshot['speed'],
+                    'eta': snapshot['eta'] or 0
+                }
+                if snapshot['progress'] >= 100:
+                    update['status'] = 'finished'
+                progress_callback(update)
 
             def __call__(self, d):
-                if d['status'] == 'downloading':
-                    self.downloaded_bytes = d.get('downloaded_bytes', 0)
-                    self.total_bytes = d.get('total_bytes') or d.get(
-                        'total_bytes_estimate', 0)
-
-                    if self.total_bytes > 0:
-                        progress = (self.downloaded_bytes /
-                                    self.total_bytes) * 100
-                        elapsed = time.time() - self.start_time
-                        speed = self.downloaded_bytes / elapsed if elapsed > 0 else 0
-                        eta = (self.total_bytes - self.downloaded_bytes
-                               ) / speed if speed > 0 else 0
-
-                        if progress_callback:
-                            progress_callback({
-                                'progress': progress,
-                                'downloaded_bytes': self.downloaded_bytes,
-                                'total_bytes': self.total_bytes,
-                                'speed': speed,
-                                'eta': eta
-                            })
-
-                elif d['status'] == 'finished':
-                    if progress_callback:
-                        progress_callback({
-                            'progress': 100,
-                            'downloaded_bytes': self.total_bytes,
-                            'total_bytes': self.total_bytes,
-                            'status': 'finished'
-                        })
-
-                elif d['status'] == 'error':
+                if d['status'] == 'error':
                     if progress_callback:
                         progress_callback({
                             'status':
@@ -446,6 +528,8 @@ def download_video(video_id,
                             'error':
                             d.get('error', 'Unknown error')
                         })
+                else:
+                    self.hook(d)
 
         progress_hook = MyProgressHook()
 
@@ -457,88 +541,24 @@ def download_video(video_id,
         }
 
         # Set options based on format type
-        if format_type.lower() in ["mp3", "audio"]:
-            # Audio download
-            output_file = os.path.join(temp_dir, f"{file_name}.mp3")
-            mime_type = "audio/mpeg"
-            file_name_with_ext = f"{file_name}.mp3"
-
-            # If specific audio format requested
-            if audio_format_id:
-                format_spec = audio_format_id
-                if format_type.lower() == "mp3":
-                    base_ydl_opts['postprocessors'] = [{
-                        'key':
-                        'FFmpegExtractAudio',
-                        'preferredcodec':
-                        'mp3',
-                        'preferredquality':
-                        '192',
-                    }]
-            else:
-                # Audio-only settings with best quality
-                format_spec = 'bestaudio/best'
-                if format_type.lower() == "mp3":
-                    base_ydl_opts['postprocessors'] = [{
-                        'key':
-                        'FFmpegExtractAudio',
-                        'preferredcodec':
-                        'mp3',
-                        'preferredquality':
-                        '192',
-                    }]
-
-            ydl_opts = {**base_ydl_opts, 'format': format_spec}
-
-        elif format_type.lower() == "webm":
-            # WebM video download
-            output_file = os.path.join(temp_dir, f"{file_name}.webm")
-            mime_type = "video/webm"
-            file_name_with_ext = f"{file_name}.webm"
-
-            # If specific formats requested
-            if video_format_id and audio_format_id:
-                format_spec = f"{video_format_id}+{audio_format_id}/best"
-            else:
-                # WebM format with best quality
-                format_spec = 'bestvideo[ext=webm]+bestaudio[ext=webm]/best[ext=webm]/best'
-
-            ydl_opts = {**base_ydl_opts, 'format': format_spec}
-
-        else:  # Default to mp4
-            # MP4 video download
-            output_file = os.path.join(temp_dir, f"{file_name}.mp4")
-            mime_type = "video/mp4"
-            file_name_with_ext = f"{file_name}.mp4"
-
-            # If specific formats requested
-            if video_format_id and audio_format_id:
-                format_spec = f"{video_format_id}+{audio_format_id}/best"
-            else:
-                # Select format based on resolution
-                if resolution == "360p":
-                    format_spec = 'bestvideo[height<=360][ext=mp4]+bestaudio[ext=m4a]/best[height<=360][ext=mp4]/best[ext=mp4]/best'
-                elif resolution == "480p":
-                    format_spec = 'bestvideo[height<=480][ext=mp4]+bestaudio[ext=m4a]/best[height<=480][ext=mp4]/best[ext=mp4]/best'
-                elif resolution == "720p":
-                    format_spec = 'bestvideo[height<=720][ext=mp4]+bestaudio[ext=m4a]/best[height<=720][ext=mp4]/best[ext=mp4]/best'
-                elif resolution == "1080p":
-                    format_spec = 'bestvideo[height<=1080][ext=mp4]+bestaudio[ext=m4a]/best[height<=1080][ext=mp4]/best[ext=mp4]/best'
-                elif resolution == "1440p":
-                    format_spec = 'bestvideo[height<=1440][ext=mp4]+bestaudio[ext=m4a]/best[height<=1440][ext=mp4]/best[ext=mp4]/best'
-                elif resolution == "2160p":
-                    format_spec = 'bestvideo[height<=2160][ext=mp4]+bestaudio[ext=m4a]/best[height<=2160][ext=mp4]/best[ext=mp4]/best'
-                else:
-                    format_spec = 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best'
-
-            ydl_opts = {
-                **base_ydl_opts, 'format': format_spec,
-                'merge_output_format': 'mp4'
-            }
-
-        # Download the file
+        format_spec, extension, mime_type = select_download_format(
+            format_type, resolution, video_format_id, audio_format_id)
+        ydl_opts = {**base_ydl_opts, 'format': format_spec}
+        if format_type.lower() == "mp3":
+            ydl_opts['postprocessors'] = [{
+                'key':
+                'FFmpegExtractAudio',
+                'preferredcodec':
+                'mp3',
+                'preferredquality':
+                '192',
+            }]
+        elif extension == "mp4":
+            ydl_opts['merge_output_format'] = 'mp4'
+
+        # Download the file from the already-extracted info
         with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            ydl.download([url])
+            download_with_metadata(ydl, video_id)
 
         # Find the downloaded file
         downloaded_files = os.listdir(temp_dir)
@@ -557,14 +577,19 @@ def download_video(video_id,
         logging.error(
             f"Error downloading video {video_id} with yt-dlp: {str(e)}")
 
+        # Drop the partial yt-dlp output before trying again
+        if temp_dir:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+
         # Fallback to pytube if yt-dlp fails
         try:
             # Create a YouTube object
             url = f"https://www.youtube.com/watch?v={video_id}"
+            youtube_limiter.acquire()
             yt = YouTube(url)
 
             # Create a temp directory for downloading
-            temp_dir = tempfile.mkdtemp()
+            temp_dir = tempfile.mkdtemp(prefix='download-', dir=work_dir or scratch_root())
             file_name = f"{yt.title.replace(' ', '_')[:50]}"  # Truncate and remove spaces
 
             # Handle different format types
@@ -622,4 +647,6 @@ def download_video(video_id,
             logging.error(
                 f"Fallback download with pytube also failed: {str(fallback_error)}"
             )
+            if temp_dir:
+                shutil.rmtree(temp_dir, ignore_errors=True)
             return None